@@ -23,6 +23,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pathlib
 import pandas as pd
 
@@ -32,6 +33,17 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table, update_columns
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 # %% [markdown]
 # #### Collect required datasets ####
 # 
@@ -83,33 +95,30 @@ def add_field(layer, field_name):
         return
     else:
         arcpy.AddField_management(layer, field_name, 'SHORT')
-        with arcpy.da.UpdateCursor(layer, field_name) as cur:
-            for row in cur:
-                row[0] = 1
-                cur.updateRow(row)
+        update_columns(layer, {field_name: 1})
         print(f'{field_name} added to table')
 
 # Overlap APN with CoSS
-arcpy.lr.OverlayRouteEvents(
+overlay_route_events(
         tbl_apn,
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         tbl_coss, 
         "RTE_NM; Line; BEGIN_MSR; END_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tbl_apn_coss'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tbl_apn_coss.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
         "INDEX")
 
 # Overlap APN and CoSS with RN
-arcpy.lr.OverlayRouteEvents(
-        os.path.join(intermediate_gdb, 'tbl_apn_coss'),
+overlay_route_events(
+        os.path.join(os.path.dirname(intermediate_gdb), 'tbl_apn_coss.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         tbl_rn, 
         "RTE_NM; Line; BEGIN_MSR; END_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tbl_apn_coss_rn'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tbl_apn_coss_rn.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
@@ -131,8 +140,8 @@ fields_to_keep = [
     'COSS'
 ]
 
-tbl_apn_coss_rn = os.path.join(intermediate_gdb, 'tbl_apn_coss_rn')
-df = pd.DataFrame([row for row in arcpy.da.SearchCursor(tbl_apn_coss_rn, fields_to_keep)], columns=fields_to_keep)
+tbl_apn_coss_rn = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_apn_coss_rn.parquet')
+df = read_table(tbl_apn_coss_rn, fields_to_keep)
 
 # Add and calculate capcity preservation needs fields:
 # CoSS and APN
@@ -154,14 +163,12 @@ df = df.loc[(df['CoSS_Capacity_Preservation'] == 'YES') | (df['RN_Capacity_Prese
 # #### Create output event table and layer ####
 
 # %%
-output_csv = os.path.join(os.path.dirname(intermediate_gdb), 'output.csv')
-df.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_capacity_preservation')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_capacity_preservation.parquet')
+publish_stage('tbl_capacity_preservation', df, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_capacity_preservation Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_capacity_preservation Events", output_gdb, "Capacity_Preservation")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df, LRS, output_gdb, 'tbl_capacity_preservation', 'Capacity_Preservation')
 
 
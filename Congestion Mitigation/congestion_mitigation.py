@@ -19,6 +19,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -27,6 +28,17 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events, write_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 # %%
 # Paths to intermediate and output geodatabases
 intermediate_gdb = f'{main_path}\\A1 - Common Datasets\\Congestion Mitigation\\data\\intermediate.gdb'
@@ -50,6 +62,11 @@ LRS = f'{common_datasets_gdb}\\SDE_VDOT_RTE_OVERLAP_LRS_DY'
 MasterLRS = f'{common_datasets_gdb}\\SDE_VDOT_RTE_MASTER_LRS_DY'
 TMC_LRS = f'{common_datasets_gdb}\\tbl_tmc_lrs_2023_master'
 
+# Policy thresholds (see the notes on PECC and TTI below)
+pecc_threshold = 2  # percent of person miles traveled in excessively congested conditions
+tti_13_hours_threshold = 3  # hours with a TTI above 1.3
+tti_15_hours_threshold = 1  # hours with a TTI above 1.5
+
 # Performance Measures
 PECC = f'{main_path}\\A1 - Common Datasets\\Congestion Mitigation\\data\\PECC_2022.csv'
 TTI = f'{main_path}\\A1 - Common Datasets\\Congestion Mitigation\\data\\2022_TTI_WA.csv'
@@ -77,64 +94,60 @@ df_pecc_tti.loc[df_pecc_tti['PECC_Weight'].notnull(), ['F22SHrGT13', 'F22SHrGT15
 
 # Join TTI data to TMC layer by TMC
 tmc_fields = ['tmc', 'rte_nm', 'begin_msr', 'end_msr']
-df_tmc = pd.DataFrame([row for row in arcpy.da.SearchCursor(TMC_LRS, tmc_fields)], columns=tmc_fields)
+df_tmc = read_table(TMC_LRS, tmc_fields)
 df_tmc_pecc_tti = df_tmc.merge(df_pecc_tti, 'outer', on='tmc')
 df_tmc_pecc_tti.rename(columns={'rte_nm': 'RTE_NM', 'begin_msr': 'BEGIN_MSR', 'end_msr': 'END_MSR'}, inplace=True)
 
 # %%
 # Overlay TMC data with Limited Access, CoSS, and RN tables
-# Export as csv
-csv_tmc_pecc_tti = os.path.join(os.path.dirname(intermediate_gdb), 'tmc_pecc_tti.csv')
-df_tmc_pecc_tti.to_csv(csv_tmc_pecc_tti, index=False)
-
-# Convert to gdb table
-tbl_tmc_pecc_tti = os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti')
-arcpy.TableToTable_conversion(csv_tmc_pecc_tti, intermediate_gdb, 'tbl_tmc_pecc_tti')
+# Export as a Parquet event table
+tbl_tmc_pecc_tti = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti.parquet')
+write_events(df_tmc_pecc_tti, tbl_tmc_pecc_tti)
 
 # Overlay tbl_tmc_pecc_tti with Limited Access
-tbl_tmc_pecc_tti_la = os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti_la')
-arcpy.lr.OverlayRouteEvents(
+tbl_tmc_pecc_tti_la = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti_la.parquet')
+overlay_route_events(
         tbl_tmc_pecc_tti,
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         LA, 
         "RTE_NM; Line; RTE_FROM_MSR; RTE_TO_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti_la'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti_la.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
         "INDEX")
 
 # Overlay with CoSS
-tbl_tmc_pecc_tti_la_coss = os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti_la_coss')
-arcpy.lr.OverlayRouteEvents(
+tbl_tmc_pecc_tti_la_coss = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti_la_coss.parquet')
+overlay_route_events(
         tbl_tmc_pecc_tti_la,
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         CoSS, 
         "RTE_NM; Line; BEGIN_MSR; END_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti_la_coss'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti_la_coss.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
         "INDEX")
 
 # Overlay with RN
-tbl_tmc_pecc_tti_la_coss_rn = os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti_la_coss_rn')
-arcpy.lr.OverlayRouteEvents(
+tbl_tmc_pecc_tti_la_coss_rn = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti_la_coss_rn.parquet')
+overlay_route_events(
         tbl_tmc_pecc_tti_la_coss,
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         RN, 
         "RTE_NM; Line; BEGIN_MSR; END_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tbl_tmc_pecc_tti_la_coss_rn'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tbl_tmc_pecc_tti_la_coss_rn.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
         "INDEX")
 
 congestion_fields = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'tmc', 'PECC_Weight', 'F22SHrGT13', 'F22SHrGT15', 'COSS', 'RN', 'RIM_ACCESS_CONTROL_DSC']
-df_congestion = pd.DataFrame([row for row in arcpy.da.SearchCursor(tbl_tmc_pecc_tti_la_coss_rn, congestion_fields)], columns=congestion_fields)
+df_congestion = read_table(tbl_tmc_pecc_tti_la_coss_rn, congestion_fields)
 
 # %% [markdown]
 # #### Locate Congestion Needs ####
@@ -145,11 +158,11 @@ df_congestion = pd.DataFrame([row for row in arcpy.da.SearchCursor(tbl_tmc_pecc_
 
 # %%
 # Locate segments that meet congestion needs threshold with PECC
-df_congestion.loc[(df_congestion['PECC_Weight'] > 2) & ~(df_congestion['RIM_ACCESS_CONTROL_DSC'] == ''), 'congestion_need'] = 'YES'
+df_congestion.loc[(df_congestion['PECC_Weight'] > pecc_threshold) & ~(df_congestion['RIM_ACCESS_CONTROL_DSC'] == ''), 'congestion_need'] = 'YES'
 
 
 # Locate segments that meet TTI threshold.  Must be on non-limited access segments according to policy
-df_congestion.loc[((df_congestion['F22SHrGT13'] >= 3) | (df_congestion['F22SHrGT15'] >= 1)) & (df_congestion['RIM_ACCESS_CONTROL_DSC'] == ''), 'tti_threshold'] = 'YES'
+df_congestion.loc[((df_congestion['F22SHrGT13'] >= tti_13_hours_threshold) | (df_congestion['F22SHrGT15'] >= tti_15_hours_threshold)) & (df_congestion['RIM_ACCESS_CONTROL_DSC'] == ''), 'tti_threshold'] = 'YES'
 
 # (1) non-limited access roadways within CoSS
 df_congestion.loc[(df_congestion['RIM_ACCESS_CONTROL_DSC'] == '') & (df_congestion['COSS'] == 1) & (df_congestion['tti_threshold'] == 'YES'), 'congestion_need'] = 'YES'
@@ -172,14 +185,12 @@ df_output = df_congestion.loc[(df_congestion['CoSS_Congestion'] == 'YES') | (df_
 # #### Create output event table and layer ####
 
 # %%
-output_csv = os.path.join(os.path.dirname(intermediate_gdb), 'output.csv')
-df_output.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_congestion_mitigation')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_congestion_mitigation.parquet')
+publish_stage('tbl_congestion_mitigation', df_output, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_congestion_mitigation Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_congestion_mitigation Events", output_gdb, "Congestion_Mitigation")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df_output, LRS, output_gdb, 'tbl_congestion_mitigation', 'Congestion_Mitigation')
 
 
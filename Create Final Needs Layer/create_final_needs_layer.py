@@ -1,6 +1,7 @@
 import arcpy
 import pandas as pd
 import os
+import sys
 
 from field_schema import FIELD_ALIAS, FIELD_TYPE
 FIELDS = list(FIELD_ALIAS.keys())
@@ -8,8 +9,26 @@ NEEDS_FIELDS = FIELDS[19:]
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.dedup import duplicate_segments, overlap_report
+from needs_tools.flags import flag_mask, has_any, pack_flags, unpack_flags
+from needs_tools.incremental import changed_routes, digest_sources, fingerprint, incremental_enabled, layer_frame, load_state, patch_routes, route_subset, save_state
+from needs_tools.measures import FINAL_MEASURE_SCALE
+from needs_tools.interval_index import RouteIntervalIndex
+from needs_tools.overlay import overlay_many_route_events
+from needs_tools.registry import STAGES, publish_stage, stage_source
+from needs_tools.routes import RouteCatalog
+from needs_tools.segment_ids import segment_id_report, segment_ids
+from needs_tools.spatial import midpoints, polygon_values, read_shapes
+from needs_tools.tables import read_table, update_columns, write_table
+from needs_tools.trace import step, step_rows, trace_geoprocessing
+
 arcpy.env.overwriteOutput = True
 
+# Each step and geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 
 class Field:
   def __init__(self, name, alias, type):
@@ -30,19 +49,20 @@ if not os.path.exists(output_gdb):
     arcpy.CreateFileGDB_management(os.path.dirname(output_gdb), os.path.basename(output_gdb))
 
 
-# Needs event tables
-source_Congestion = f"{main_path}\\A1 - Common Datasets\\Congestion Mitigation\\data\\output.gdb\\tbl_congestion_mitigation"
-source_Reliability = f"{main_path}\\A1 - Common Datasets\\Improved Reliability (Roadway)\\data\\output.gdb\\tbl_reliability"
+# Needs event tables.  Stages run by run.bat write Parquet event tables, the others are in geodatabases.
+# Stages that ran in this process are used directly from memory
+source_Congestion = stage_source('tbl_congestion_mitigation', f"{main_path}\\A1 - Common Datasets\\Congestion Mitigation\\data\\tbl_congestion_mitigation.parquet")
+source_Reliability = stage_source('tbl_reliability', f"{main_path}\\A1 - Common Datasets\\Improved Reliability (Roadway)\\data\\tbl_reliability.parquet")
 source_CoSS_Rail_Reliability = f"{main_path}\\A1 - Common Datasets\\Improved Reliability (Intercity and Passenger Rail)\\data\\output.gdb\\tbl_rail_reliability"
-source_Capacity_Preservation = f"{main_path}\\A1 - Common Datasets\\Capacity Preservation\\data\\output.gdb\\tbl_capacity_preservation"
-source_TDM = f"{main_path}\\A1 - Common Datasets\\Transportation Demand Management (TDM)\\data\\output.gdb\\tbl_tdm_needs"
+source_Capacity_Preservation = stage_source('tbl_capacity_preservation', f"{main_path}\\A1 - Common Datasets\\Capacity Preservation\\data\\tbl_capacity_preservation.parquet")
+source_TDM = stage_source('tbl_tdm_needs', f"{main_path}\\A1 - Common Datasets\\Transportation Demand Management (TDM)\\data\\tbl_tdm_needs.parquet")
 source_Safety_Intersection = f"{main_path}\\A1 - Common Datasets\\Roadway Safety\\data\\output.gdb\\tbl_safety_intersections"
 source_Safety_Segments = f"{main_path}\\A1 - Common Datasets\\Roadway Safety\\data\\output.gdb\\tbl_safety_segment"
-source_RN_AC_Bicycle_Access = f"{main_path}\\A1 - Common Datasets\\Need for Bicycle Access to Activity Centers\\data\\output.gdb\\tbl_bicycle_access"
-source_RN_AC_Pedestrian_Access = f"{main_path}\\A1 - Common Datasets\\Need for Pedestrian Access to Activity Centers\\data\\output.gdb\\tbl_ped_access"
-source_RN_AC_Transit_Access = f"{main_path}\\A1 - Common Datasets\\Need for Transit Access to Activity Centers\\data\\output.gdb\\tbl_transit_access"
-source_RN_Transit_Emphasis = f"{main_path}\\A1 - Common Datasets\\Need for Transit Access for Equity Emphasis Areas\\data\\output.gdb\\tbl_transit_access_eaa"
-source_RN_Safety_Pedestrian = f"{main_path}\\A1 - Common Datasets\\Pedestrian Safety\\data\\output.gdb\\tbl_ped_safety"
+source_RN_AC_Bicycle_Access = stage_source('tbl_bicycle_access', f"{main_path}\\A1 - Common Datasets\\Need for Bicycle Access to Activity Centers\\data\\tbl_bicycle_access.parquet")
+source_RN_AC_Pedestrian_Access = stage_source('tbl_ped_access', f"{main_path}\\A1 - Common Datasets\\Need for Pedestrian Access to Activity Centers\\data\\tbl_ped_access.parquet")
+source_RN_AC_Transit_Access = stage_source('tbl_transit_access', f"{main_path}\\A1 - Common Datasets\\Need for Transit Access to Activity Centers\\data\\tbl_transit_access.parquet")
+source_RN_Transit_Emphasis = stage_source('tbl_transit_access_eaa', f"{main_path}\\A1 - Common Datasets\\Need for Transit Access for Equity Emphasis Areas\\data\\tbl_transit_access_eaa.parquet")
+source_RN_Safety_Pedestrian = stage_source('tbl_ped_safety', f"{main_path}\\A1 - Common Datasets\\Pedestrian Safety\\data\\tbl_ped_safety.parquet")
 source_RN_VEDP_Business_Ready_Site = f"{main_path}\\A1 - Common Datasets\\Access to Industrial and Economic Development Areas (IEDAs)\\data\\output.gdb\\tbl_vedp"
 source_UDA = f"{main_path}\\A1 - Common Datasets\\Urban Development Areas (UDAs) Needs\\data\\output.gdb\\tbl_uda_needs"
 
@@ -60,188 +80,101 @@ Census_Urban_Areas = f'{main_path}\\A1 - Common Datasets\\tl_rd22_51_place.shp'
 RNs = f'{common_datasets_gdb}\\RegionalNetworks'
 UDAs = f'{common_datasets_gdb}\\UrbanDevelopmentAreas'
 
+step('Preparing CoSS and FC tables')
+
 # Prepare CoSS - in order for the join to work, a version of the coss with matching field names needs to be created.  This will
 # be used to join to the final output table
 prepared_CoSS = os.path.join(intermediate_gdb, 'CoSS')
-arcpy.CreateTable_management(intermediate_gdb, 'CoSS')
-arcpy.AddField_management(prepared_CoSS, 'RTE_NM', 'TEXT')
-arcpy.AddField_management(prepared_CoSS, 'BEGIN_MSR', 'DOUBLE')
-arcpy.AddField_management(prepared_CoSS, 'END_MSR', 'DOUBLE')
-arcpy.AddField_management(prepared_CoSS, 'CoSS', 'TEXT')
-arcpy.AddField_management(prepared_CoSS, 'CoSS_Primary', 'TEXT')
-arcpy.AddField_management(prepared_CoSS, 'CoSS_Name', 'TEXT')
-
-# Get CoSS data from source
-source_CoSS_fields = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'COSS_NAME', 'Primary']
-CoSS_data = [row for row in arcpy.da.SearchCursor(source_CoSS, source_CoSS_fields)]
-
-# Add CoSS data to prepared_CoSS table
-prepared_CoSS_fields = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'CoSS', 'CoSS_Primary', 'CoSS_Name']
-with arcpy.da.InsertCursor(prepared_CoSS, prepared_CoSS_fields) as cur:
-    for rte_nm, begin_msr, end_msr, coss_name, primary in CoSS_data:
-        record_data = (rte_nm, begin_msr, end_msr, 'YES', primary, coss_name)
-        cur.insertRow(record_data)
-        
-
-# Prepare FC
+df_source_coss = read_table(source_CoSS, ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'COSS_NAME', 'Primary'])
+write_table(pd.DataFrame({
+    'RTE_NM': df_source_coss['RTE_NM'].astype(object),
+    'BEGIN_MSR': df_source_coss['BEGIN_MSR'].astype(float),
+    'END_MSR': df_source_coss['END_MSR'].astype(float),
+    'CoSS': pd.Series('YES', index=df_source_coss.index, dtype=object),
+    'CoSS_Primary': df_source_coss['Primary'].astype(object),
+    'CoSS_Name': df_source_coss['COSS_NAME'].astype(object)
+}), prepared_CoSS)
+
+
+# Prepare FC.  The functional class is stored as text, as str() of each value
 prepared_FC = os.path.join(intermediate_gdb, 'FC')
-arcpy.CreateTable_management(intermediate_gdb, 'FC')
-arcpy.AddField_management(prepared_FC, 'RTE_NM', 'TEXT')
-arcpy.AddField_management(prepared_FC, 'BEGIN_MSR', 'DOUBLE')
-arcpy.AddField_management(prepared_FC, 'END_MSR', 'DOUBLE')
-arcpy.AddField_management(prepared_FC, 'VDOT_FC', 'TEXT')
-
-# Get FC data from source
-source_FC_fields = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'STATE_FUNCT_CLASS_ID']
-FC_data = [row for row in arcpy.da.SearchCursor(source_FC, source_FC_fields)]
-
-# Add FC data to prepared_FC table
-prepared_FC_fields = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'VDOT_FC']
-with arcpy.da.InsertCursor(prepared_FC, prepared_FC_fields) as cur:
-    for rte_nm, begin_msr, end_msr, vdot_fc in FC_data:
-        record_data = (rte_nm, begin_msr, end_msr, str(vdot_fc))
-        cur.insertRow(record_data)
+df_source_fc = read_table(source_FC, ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'STATE_FUNCT_CLASS_ID'])
+vdot_fc = df_source_fc['STATE_FUNCT_CLASS_ID']
+if pd.api.types.is_float_dtype(vdot_fc) and (vdot_fc.dropna() % 1 == 0).all():
+    # Integer ids with nulls are read as floats
+    vdot_fc = vdot_fc.astype('Int64')
+write_table(pd.DataFrame({
+    'RTE_NM': df_source_fc['RTE_NM'].astype(object),
+    'BEGIN_MSR': df_source_fc['BEGIN_MSR'].astype(float),
+    'END_MSR': df_source_fc['END_MSR'].astype(float),
+    'VDOT_FC': [str(value) for value in vdot_fc.astype(object).where(vdot_fc.notna(), None)]
+}), prepared_FC)
 
 
 # Join event tables
-print('Creating initial table\n')
-initial_table = os.path.join(intermediate_gdb, 'initial_table')
-arcpy.CreateTable_management(os.path.dirname(initial_table), os.path.basename(initial_table))
-arcpy.AddField_management(initial_table, 'RTE_NM', 'TEXT')
-arcpy.AddField_management(initial_table, 'BEGIN_MSR', 'DOUBLE')
-arcpy.AddField_management(initial_table, 'END_MSR', 'DOUBLE')
-
-# Arcpy only allows you to overlap two tables at a time
-# Output paths for intermediate event tables:
-overlay_CoSS = os.path.join(intermediate_gdb, 'overlay_CoSS')
-overlay_FC = os.path.join(intermediate_gdb, 'overlay_FC')
-overlay_Congestion = os.path.join(intermediate_gdb, 'overlay_Congestion')
-overlay_Reliability = os.path.join(intermediate_gdb, 'overlay_Reliability')
-overlay_CoSS_Rail_Reliability = os.path.join(intermediate_gdb, 'overlay_CoSS_Rail_Reliability')
-overlay_Capacity_Preservation = os.path.join(intermediate_gdb, 'overlay_Capacity_Preservation')
-overlay_TDM = os.path.join(intermediate_gdb, 'overlay_TDM')
-overlay_Safety_Intersection = os.path.join(intermediate_gdb, 'overlay_Safety_Intersection')
-overlay_Safety_Segments = os.path.join(intermediate_gdb, 'overlay_Safety_Segments')
-overlay_RN_AC_Bicycle_Access = os.path.join(intermediate_gdb, 'overlay_RN_AC_Bicycle_Access')
-overlay_RN_AC_Pedestrian_Access = os.path.join(intermediate_gdb, 'overlay_RN_AC_Pedestrian_Access')
-overlay_RN_AC_Transit_Access = os.path.join(intermediate_gdb, 'overlay_RN_AC_Transit_Access')
-overlay_RN_Transit_Emphasis = os.path.join(intermediate_gdb, 'overlay_RN_Transit_Emphasis')
-overlay_RN_Safety_Pedestrian = os.path.join(intermediate_gdb, 'overlay_RN_Safety_Pedestrian')
-overlay_RN_VEDP_Business_Ready_Site = os.path.join(intermediate_gdb, 'overlay_RN_VEDP_Business_Ready_Site')
-overlay_UDA = os.path.join(intermediate_gdb, 'overlay_UDA')
 all_needs_overlapped = os.path.join(intermediate_gdb, 'all_needs_overlapped')
 
-# Ensure that the from/to measures for all input event tables are rounded.  Otherwise the overlay tool will create zero length events
-print('Rounding Measures')
+# Route names are replaced by integer ids from the LRS while the tables are overlaid
+step('Building route catalog')
+route_catalog = RouteCatalog.from_lrs(lrs, ['RTE_STREET_NM', 'RTE_COMMON_NM', 'RTE_DIRECTION_CD'])
+
 source_tables = [prepared_CoSS, prepared_FC, source_Congestion,source_Reliability,source_CoSS_Rail_Reliability,source_Capacity_Preservation,source_TDM,source_Safety_Intersection,source_Safety_Segments,source_RN_AC_Bicycle_Access,source_RN_AC_Pedestrian_Access,source_RN_AC_Transit_Access,source_RN_Transit_Emphasis,source_RN_Safety_Pedestrian,source_RN_VEDP_Business_Ready_Site,source_UDA]
-for table in source_tables:
-    if table is not None:
-        with arcpy.da.UpdateCursor(table, ['BEGIN_MSR', 'END_MSR']) as cur:
-            for row in cur:
-                row[0] = round(row[0], 2)
-                row[1] = round(row[1], 2)
-                cur.updateRow(row)
-
-
-print('Overlaying prepared_CoSS')
-if source_Congestion:
-    arcpy.lr.OverlayRouteEvents(initial_table, 'RTE_NM LINE BEGIN_MSR END_MSR', prepared_CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(initial_table, intermediate_gdb, 'overlay_CoSS')
-
-print('Overlaying prepared_FC')
-if source_Congestion:
-    arcpy.lr.OverlayRouteEvents(overlay_CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', prepared_FC, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_FC, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_CoSS, intermediate_gdb, 'overlay_FC')
-
-print('Overlaying source_Congestion')
-if source_Congestion:
-    arcpy.lr.OverlayRouteEvents(overlay_FC, 'RTE_NM LINE BEGIN_MSR END_MSR', source_Congestion, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_Congestion, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_FC, intermediate_gdb, 'overlay_congestion')
-
-print('Overlaying source_Reliability')
-if source_Reliability:
-    arcpy.lr.OverlayRouteEvents(overlay_Congestion, 'RTE_NM LINE BEGIN_MSR END_MSR', source_Reliability, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_Reliability, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_Congestion, intermediate_gdb, 'overlay_Reliability')
-
-print('Overlaying source_CoSS_Rail_Reliability')
-if source_CoSS_Rail_Reliability:
-    arcpy.lr.OverlayRouteEvents(overlay_Reliability, 'RTE_NM LINE BEGIN_MSR END_MSR', source_CoSS_Rail_Reliability, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_CoSS_Rail_Reliability, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_Reliability, intermediate_gdb, 'overlay_CoSS_Rail_Reliability')
-
-print('Overlaying source_Capacity_Preservation')
-if source_Capacity_Preservation:
-    arcpy.lr.OverlayRouteEvents(overlay_CoSS_Rail_Reliability, 'RTE_NM LINE BEGIN_MSR END_MSR', source_Capacity_Preservation, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_Capacity_Preservation, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_CoSS_Rail_Reliability, intermediate_gdb, 'overlay_Capacity_Preservation')
-
-print('Overlaying source_TDM')
-if source_TDM:
-    arcpy.lr.OverlayRouteEvents(overlay_Capacity_Preservation, 'RTE_NM LINE BEGIN_MSR END_MSR', source_TDM, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_TDM, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_Capacity_Preservation, intermediate_gdb, 'overlay_TDM')
-
-print('Overlaying source_Safety_Intersection')
-if source_Safety_Intersection:
-    arcpy.lr.OverlayRouteEvents(overlay_TDM, 'RTE_NM LINE BEGIN_MSR END_MSR', source_Safety_Intersection, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_Safety_Intersection, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_TDM, intermediate_gdb, 'overlay_Safety_Intersection')
-
-print('Overlaying source_Safety_Segments')
-if source_Safety_Segments:
-    arcpy.lr.OverlayRouteEvents(overlay_Safety_Intersection, 'RTE_NM LINE BEGIN_MSR END_MSR', source_Safety_Segments, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_Safety_Segments, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_Safety_Intersection, intermediate_gdb, 'overlay_Safety_Segments')
-
-print('Overlaying source_RN_AC_Bicycle_Access')
-if source_RN_AC_Bicycle_Access:
-    arcpy.lr.OverlayRouteEvents(overlay_Safety_Segments, 'RTE_NM LINE BEGIN_MSR END_MSR', source_RN_AC_Bicycle_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_RN_AC_Bicycle_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_Safety_Segments, intermediate_gdb, 'overlay_RN_AC_Bicycle_Access')
-
-print('Overlaying source_RN_AC_Pedestrian_Access')
-if source_RN_AC_Pedestrian_Access:
-    arcpy.lr.OverlayRouteEvents(overlay_RN_AC_Bicycle_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', source_RN_AC_Pedestrian_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_RN_AC_Pedestrian_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_RN_AC_Bicycle_Access, intermediate_gdb, 'overlay_RN_AC_Pedestrian_Access')
-
-print('Overlaying source_RN_AC_Transit_Access')
-if source_RN_AC_Transit_Access:
-    arcpy.lr.OverlayRouteEvents(overlay_RN_AC_Pedestrian_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', source_RN_AC_Transit_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_RN_AC_Transit_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_RN_AC_Pedestrian_Access, intermediate_gdb, 'overlay_RN_AC_Transit_Access')
-
-print('Overlaying source_RN_Transit_Emphasis')
-if source_RN_Transit_Emphasis:
-    arcpy.lr.OverlayRouteEvents(overlay_RN_AC_Transit_Access, 'RTE_NM LINE BEGIN_MSR END_MSR', source_RN_Transit_Emphasis, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_RN_Transit_Emphasis, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_RN_AC_Transit_Access, intermediate_gdb, 'overlay_RN_Transit_Emphasis')
-
-print('Overlaying source_RN_Safety_Pedestrian')
-if source_RN_Safety_Pedestrian:
-    arcpy.lr.OverlayRouteEvents(overlay_RN_Transit_Emphasis, 'RTE_NM LINE BEGIN_MSR END_MSR', source_RN_Safety_Pedestrian, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_RN_Safety_Pedestrian, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_RN_Transit_Emphasis, intermediate_gdb, 'overlay_RN_Safety_Pedestrian')
-
-print('Overlaying source_RN_VEDP_Business_Ready_Site')
-if source_RN_VEDP_Business_Ready_Site:
-    arcpy.lr.OverlayRouteEvents(overlay_RN_Safety_Pedestrian, 'RTE_NM LINE BEGIN_MSR END_MSR', source_RN_VEDP_Business_Ready_Site, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', overlay_RN_VEDP_Business_Ready_Site, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_RN_Safety_Pedestrian, intermediate_gdb, 'overlay_RN_VEDP_Business_Ready_Site')
-
-print('Overlaying source_UDA')
-if source_UDA:
-    arcpy.lr.OverlayRouteEvents(overlay_RN_VEDP_Business_Ready_Site, 'RTE_NM LINE BEGIN_MSR END_MSR', source_UDA, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', all_needs_overlapped, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
-else:
-    arcpy.TableToTable_conversion(overlay_RN_VEDP_Business_Ready_Site, intermediate_gdb, 'all_needs_overlapped')
+source_names = ['CoSS', 'FC', 'Congestion', 'Reliability', 'CoSS_Rail_Reliability', 'Capacity_Preservation', 'TDM', 'Safety_Intersection', 'Safety_Segments', 'RN_AC_Bicycle_Access', 'RN_AC_Pedestrian_Access', 'RN_AC_Transit_Access', 'RN_Transit_Emphasis', 'RN_Safety_Pedestrian', 'RN_VEDP_Business_Ready_Site', 'UDA']
+
+
+# Incremental rebuild.  Each source table and the LRS fields of each route are reduced to a digest
+# per route, and with NEEDS_INCREMENTAL=yes only the routes whose digests changed since the last
+# run are rebuilt.  Changes to this script, the shared tools or the boundary layers rebuild everything
+step('Finding changed routes')
+all_needs_events = f"{main_path}\\2023_VTrans_MidTerm_Needs.parquet"
+incremental_dir = os.path.join(os.path.dirname(intermediate_gdb), 'incremental')
+source_frames = {name: read_table(table) for name, table in zip(source_names, source_tables) if table is not None}
+lrs_route_fields = ['RTE_STREET_NM', 'RTE_COMMON_NM', 'RTE_OPPOSITE_DIRECTION_RTE_NM', 'RTE_DIRECTION_CD', 'RTE_PARENT_RTE_NM']
+source_frames['LRS'] = pd.DataFrame([(route,) + values for route, values in route_catalog.lookup(lrs_route_fields).items()], columns=['RTE_NM'] + lrs_route_fields)
+route_digests = digest_sources(source_frames)
+source_tables = [df for name, df in source_frames.items() if name != 'LRS']
+
+code_files = [os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), 'field_schema.py')]
+code_files += sorted(os.path.join(main_path, 'needs_tools', name) for name in os.listdir(os.path.join(main_path, 'needs_tools')) if name.endswith('.py'))
+boundary_layers = [layer_frame(layer, [field]) for layer, field in [(VDOT_Districts, 'DISTRICT_NAME'), (MPOs, 'MPO_NAME'), (UDAs, 'UDA_NM'), (RNs, 'RN_Name')]]
+layer_fingerprint = fingerprint(code_files, boundary_layers)
+
+rebuilt_routes = None
+previous_fingerprint, previous_digests = load_state(incremental_dir)
+if incremental_enabled() and previous_fingerprint == layer_fingerprint and os.path.exists(all_needs_events):
+    rebuilt_routes = changed_routes(previous_digests, route_digests)
+    print(f'  Rebuilding {len(rebuilt_routes)} changed routes')
+    if not rebuilt_routes:
+        print('No routes changed since the last run')
+        sys.exit(0)
+    source_tables = [route_subset(df, rebuilt_routes) for name, df in source_frames.items() if name != 'LRS']
+elif incremental_enabled():
+    print('  Rebuilding every route, the previous run cannot be reused')
+
+
+# All of the event tables are overlaid in a single pass, which gives the same result as
+# overlaying them two at a time in this order.  Measures are compared in hundredths of a
+# mile so the overlay does not create zero length events, and the source tables are not changed
+step('Overlaying event tables')
+df_all_needs_overlapped = overlay_many_route_events([table for table in source_tables if table is not None], 'RTE_NM LINE BEGIN_MSR END_MSR', measure_scale=FINAL_MEASURE_SCALE, catalog=route_catalog)
+if route_catalog.added():
+    print(f'  {route_catalog.added()} routes are not in the LRS and were added to the route catalog')
+
+# Needs are carried as one bit per need field, so anything other than YES is NO.  Delete records if all needs are NO
+needs_bits = pack_flags(df_all_needs_overlapped, NEEDS_FIELDS)
+has_need = has_any(needs_bits)
+print(f'  Removing {(~has_need).sum()} records without needs')
+df_all_needs_overlapped = df_all_needs_overlapped.loc[has_need].drop(columns=NEEDS_FIELDS, errors='ignore').reset_index(drop=True)
+needs_bits = needs_bits[has_need]
+step_rows(len(df_all_needs_overlapped))
+
+# Needs are only written as YES/NO text here
+df_all_needs_overlapped = pd.concat([df_all_needs_overlapped, unpack_flags(needs_bits, NEEDS_FIELDS)], axis=1)
+write_table(df_all_needs_overlapped, all_needs_overlapped)
 
 
 # Create final output table
-print('Creating intermediate output table')
+step('Creating intermediate output table')
 tbl_output = os.path.join(output_gdb, 'tbl_2023_VTrans_MidTerm_Needs')
 arcpy.CreateTable_management(output_gdb, os.path.basename(tbl_output))
 for f in FIELDS:
@@ -251,30 +184,6 @@ for f in FIELDS:
 # Add needs data
 arcpy.Append_management(all_needs_overlapped, tbl_output, schema_type='NO_TEST')
 
-# Calculate all non-YES needs to NO.  Delete records if all needs are NO
-# needs_fields = ['CoSS_Congestion','CoSS_Reliability','CoSS_Rail_Reliability','CoSS_Capacity_Preservation','CoSS_TDM','CoSS_Safety_Intersection','CoSS_Safety_Segments','RN_Congestion','RN_Reliability','RN_Capacity_Preservation','RN_TDM','RN_AC_Bicycle_Access','RN_AC_Pedestrian_Access','RN_AC_Transit_Access','RN_Transit_Equity','RN_Safety_Segments','RN_Safety_Intersection','RN_Safety_Pedestrian','IEDA','UDA_Bike_Infrast','UDA_Comp_Street','UDA_Intersection_Des','UDA_Landscape','UDA_Offstreet_Park','UDA_Onstreet_Park','UDA_Ped_Infrast','UDA_Road_Capacity','UDA_Road_Ops','UDA_Safety_Feat','UDA_Sidewalk','UDA_Signage','UDA_Street_Grid','UDA_Traffic_Calm','UDA_Transit_Capacity','UDA_Transit_Facilities','UDA_Transit_Freq','UDA_Transit_Ops','RN_Growth_Area']
-del_count = 0
-with arcpy.da.UpdateCursor(tbl_output, NEEDS_FIELDS) as cur:
-    for row in cur:
-        # Set all non-YES fields to NO
-        for n in range(len(row)):
-            if row[n] is None or row[n] != 'YES':
-                row[n] = 'NO'
-
-        # Delete record if all needs are NO
-        no_count = 0
-        for n in range(len(row)):
-            if row[n] == 'NO':
-                no_count +=1
-        
-        if no_count == len(row):
-            del_count += 1
-            cur.deleteRow()
-            continue
-
-        cur.updateRow(row)
-
-
 
 # Make route event layer
 arcpy.lr.MakeRouteEventLayer(lrs, "RTE_NM", tbl_output, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_output Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
@@ -286,41 +195,38 @@ fc_needs = os.path.join(intermediate_gdb, 'VTrans_MidTerm_Needs_2023_Intermediat
 
 ### Fill LRS-related fields
 # Make lrs dictionary
-print('Update LRS Fields')
-routes_needed = set([route[0] for route in arcpy.da.SearchCursor(fc_needs, 'RTE_NM')])
+step('Update LRS Fields')
 lrs_fields = ['RTE_NM', 'RTE_STREET_NM', 'RTE_COMMON_NM', 'RTE_OPPOSITE_DIRECTION_RTE_NM', 'RTE_DIRECTION_CD', 'RTE_PARENT_RTE_NM']
-lrs_dict = {row[0]: (row[1], row[2], row[3], row[4], row[5]) for row in arcpy.da.SearchCursor(lrs, lrs_fields)}
-
-update_lrs_fields = ['RTE_NM', 'ST_NM', 'VDOT_COMMON_NM', 'RTE_OPPOSITE_DIRECTION_RTE_NM', 'Direction', 'MASTER_RTE_NM']
-with arcpy.da.UpdateCursor(fc_needs, update_lrs_fields) as cur:
-    for row in cur:
-        try:
-            st_nm, vdot_common_nm, rte_opposite_direction_rte_nm, direction, master_rte_nm = lrs_dict.get(row[0])
-        except:
-            st_nm, vdot_common_nm, rte_opposite_direction_rte_nm, direction, master_rte_nm = ('ERROR', 'ERROR', 'ERROR', 'ERROR', 'ERROR')
-        row[1] = st_nm
-        row[2] = vdot_common_nm
-        row[3] = rte_opposite_direction_rte_nm
-        row[4] = direction
-        row[5] = master_rte_nm
-        cur.updateRow(row)
-
-lyr_fc_needs = 'lyr_fc_needs'
-arcpy.MakeFeatureLayer_management(fc_needs, lyr_fc_needs)
-
-### VDOT Districts
-print('Update VDOT Districts Fields')
-lyr_districts = 'lyr_districts'
-arcpy.MakeFeatureLayer_management(VDOT_Districts, lyr_districts)
-districts = [row[0] for row in arcpy.da.SearchCursor(lyr_districts, 'DISTRICT_NAME')]
-for district in districts:
-    arcpy.SelectLayerByAttribute_management(lyr_districts, 'NEW_SELECTION', f"DISTRICT_NAME = '{district}'")
-    arcpy.SelectLayerByLocation_management(lyr_fc_needs, 'HAVE_THEIR_CENTER_IN', lyr_districts, selection_type='NEW_SELECTION')
-    with arcpy.da.UpdateCursor(lyr_fc_needs, 'VDOT_District') as cur:
-        for row in cur:
-            row[0] = district
-            cur.updateRow(row)
-arcpy.SelectLayerByAttribute_management(lyr_fc_needs, 'CLEAR_SELECTION')
+lrs_dict = route_catalog.lookup(lrs_fields[1:])
+
+# Routes that are not in the LRS get ERROR in every LRS field
+update_lrs_fields = ['ST_NM', 'VDOT_COMMON_NM', 'RTE_OPPOSITE_DIRECTION_RTE_NM', 'Direction', 'MASTER_RTE_NM']
+df_needs_routes = read_table(fc_needs, ['OID@', 'RTE_NM'])
+df_lrs_values = pd.DataFrame([lrs_dict.get(route, ('ERROR',) * len(update_lrs_fields)) for route in df_needs_routes['RTE_NM']], columns=update_lrs_fields)
+update_columns(fc_needs, {field: df_lrs_values[field] for field in update_lrs_fields}, oids=df_needs_routes['OID@'])
+
+### VDOT Districts, MPOs, Urban Development Areas and Regional Networks
+# The midpoint of each segment is found once and looked up in every boundary layer
+step('Update VDOT District, MPO, UDA and Regional Network Fields')
+spatial_reference = arcpy.Describe(fc_needs).spatialReference
+needs_shapes, df_needs_shapes = read_shapes(fc_needs, ['OID@'])
+mid_x, mid_y = midpoints(needs_shapes)
+needs_position = {oid: i for i, oid in enumerate(df_needs_shapes['OID@'])}
+
+district_names = polygon_values(mid_x, mid_y, VDOT_Districts, 'DISTRICT_NAME', spatial_reference)
+MPO_Names = polygon_values(mid_x, mid_y, MPOs, 'MPO_NAME', spatial_reference)
+UDA_Names = polygon_values(mid_x, mid_y, UDAs, 'UDA_NM', spatial_reference)
+RN_Names = polygon_values(mid_x, mid_y, RNs, 'RN_Name', spatial_reference)
+
+# Segments outside of every UDA are set to NO.  Other fields are only set where the segment is in a polygon
+df_needs_areas = read_table(fc_needs, ['OID@', 'VDOT_District', 'MPO', 'UDA_Name', 'RN_Name']).set_index('OID@').loc[df_needs_shapes['OID@']]
+update_columns(fc_needs, {
+    'VDOT_District': df_needs_areas['VDOT_District'].where(pd.isna(district_names), district_names),
+    'MPO': df_needs_areas['MPO'].where(pd.isna(MPO_Names), MPO_Names),
+    'UDA': pd.Series(pd.notna(UDA_Names)).map({True: 'YES', False: 'NO'}),
+    'UDA_Name': df_needs_areas['UDA_Name'].where(pd.isna(UDA_Names), UDA_Names),
+    'RN_Name': df_needs_areas['RN_Name'].where(pd.isna(RN_Names), RN_Names)
+}, oids=df_needs_shapes['OID@'])
 
 
 # ### VDOT Jurisdictions  (Field Removed)
@@ -336,20 +242,6 @@ arcpy.SelectLayerByAttribute_management(lyr_fc_needs, 'CLEAR_SELECTION')
 #             row[0] = jurisdiction
 #             cur.updateRow(row)
 
-### MPOs
-print('Update MPO Fields')
-lyr_MPOs = 'lyr_MPOs'
-arcpy.MakeFeatureLayer_management(MPOs, lyr_MPOs)
-MPO_Names = [row[0] for row in arcpy.da.SearchCursor(lyr_MPOs, 'MPO_NAME')]
-for MPO_Name in MPO_Names:
-    arcpy.SelectLayerByAttribute_management(lyr_MPOs, 'NEW_SELECTION', f"MPO_NAME = '{MPO_Name}'")
-    arcpy.SelectLayerByLocation_management(lyr_fc_needs, 'HAVE_THEIR_CENTER_IN', lyr_MPOs, selection_type='NEW_SELECTION')
-    with arcpy.da.UpdateCursor(lyr_fc_needs, 'MPO') as cur:
-        for row in cur:
-            row[0] = MPO_Name
-            cur.updateRow(row)
-arcpy.SelectLayerByAttribute_management(lyr_fc_needs, 'CLEAR_SELECTION')
-
 
 # ### Census Urban Areas  (Field Removed)
 # print('Update Census Urban Areas Fields')
@@ -367,75 +259,26 @@ arcpy.SelectLayerByAttribute_management(lyr_fc_needs, 'CLEAR_SELECTION')
 #             cur.updateRow(row)
 
 
-### Urban Development Areas
-print('Update Urban Development Area Fields')
-lyr_UDA = 'lyr_UDA'
-arcpy.MakeFeatureLayer_management(UDAs, lyr_UDA)
-UDA_Names = [row[0] for row in arcpy.da.SearchCursor(lyr_UDA, 'UDA_NM')]
-
-# Set all UDA field for all records to NO
-with arcpy.da.UpdateCursor(lyr_fc_needs, 'UDA') as cur:
-    for row in cur:
-        row[0] = 'NO'
-        cur.updateRow(row)
-
-# For each UDA, update UDA field to YES and enter the UDA Name
-for UDA_Name in UDA_Names:
-    # Fix single quote issue in sql query
-    sql_uda_name = UDA_Name.replace("'", "''")
-    arcpy.SelectLayerByAttribute_management(lyr_UDA, 'NEW_SELECTION', f"UDA_NM = '{sql_uda_name}'")
-    arcpy.SelectLayerByLocation_management(lyr_fc_needs, 'HAVE_THEIR_CENTER_IN', lyr_UDA, selection_type='NEW_SELECTION')
-    with arcpy.da.UpdateCursor(lyr_fc_needs, ['UDA', 'UDA_Name']) as cur:
-        for row in cur:
-            row[0] = 'YES'
-            row[1] = UDA_Name
-            cur.updateRow(row)
-arcpy.SelectLayerByAttribute_management(lyr_fc_needs, 'CLEAR_SELECTION')
-
 ### CoSS
 # CoSS data is brought in from the CoSS layer.  Set CoSS field to NO if field is NULL.  Set CoSS_Primary to NO if field is NULL
-with arcpy.da.UpdateCursor(fc_needs, ['CoSS', 'CoSS_Primary']) as cur:
-    for row in cur:
-        update = False
-
-        if row[0] is None or row[0] == '':
-            row[0] = 'NO'
-            update = True
-
-        if row[1] is None or row[0] == '':
-            row[1] = 'NO'
-            update = True
-        
-        if update == True:
-            cur.updateRow(row)
-
-
-
-### Regional Networks
-print('Update Regional Networks')
-lyr_RN = 'lyr_RN'
-arcpy.MakeFeatureLayer_management(RNs, lyr_RN)
-RN_Names = [row[0] for row in arcpy.da.SearchCursor(lyr_RN, 'RN_Name')]
-for RN_Name in RN_Names:
-    arcpy.SelectLayerByAttribute_management(lyr_RN, 'NEW_SELECTION', f"RN_Name = '{RN_Name}'")
-    arcpy.SelectLayerByLocation_management(lyr_fc_needs, 'HAVE_THEIR_CENTER_IN', lyr_RN, selection_type='NEW_SELECTION')
-    with arcpy.da.UpdateCursor(lyr_fc_needs, ['RN_Name']) as cur:
-        for row in cur:
-            row[0] = RN_Name
-            cur.updateRow(row)
-arcpy.SelectLayerByAttribute_management(lyr_fc_needs, 'CLEAR_SELECTION')
+df_coss = read_table(fc_needs, ['OID@', 'CoSS', 'CoSS_Primary'])
+coss_blank = df_coss['CoSS'].isna() | (df_coss['CoSS'] == '')
+primary_blank = df_coss['CoSS_Primary'].isna()
+update_columns(fc_needs, {
+    'CoSS': df_coss['CoSS'].where(~coss_blank, 'NO'),
+    'CoSS_Primary': df_coss['CoSS_Primary'].where(~primary_blank, 'NO')
+}, oids=df_coss['OID@'])
+
+
 
 ### Segment Length
-print('Update Length')
-with arcpy.da.UpdateCursor(fc_needs, ['BEGIN_MSR', 'END_MSR', 'Segment_Length']) as cur:
-    for row in cur:
-        len = abs(row[1] - row[0])
-        row[2] = len
-        cur.updateRow(row)
+step('Update Length')
+df_lengths = read_table(fc_needs, ['OID@', 'BEGIN_MSR', 'END_MSR'])
+update_columns(fc_needs, {'Segment_Length': (df_lengths['END_MSR'] - df_lengths['BEGIN_MSR']).abs()}, oids=df_lengths['OID@'])
 
 
 ### Functional Classification - Change numbers to text description
-print('Update Functional Classification')
+step('Update Functional Classification')
 fc_dict = {
     '1': '1 - Interstate',
     '2': '2 - Other Freeways & Expressways',
@@ -445,77 +288,88 @@ fc_dict = {
     '6': '6 - Minor Collector',
     '7': '7 - Local'
 }
-with arcpy.da.UpdateCursor(fc_needs, 'VDOT_FC') as cur:
-    for row in cur:
-        fc_text = fc_dict.get(row[0])
-        row[0] = fc_text
-        cur.updateRow(row)
+df_fc = read_table(fc_needs, ['OID@', 'VDOT_FC'])
+update_columns(fc_needs, {'VDOT_FC': df_fc['VDOT_FC'].map(fc_dict)}, oids=df_fc['OID@'])
 
 
 ### Segment IDs
-print('Update Segment IDs')
-def calculate_seg_id(rte_nm, geom):
-    """ Calculates segment id based on line mid-point coordinates and direction """
-
-    try:
-        # Get direction as 1 for prime and 0 for non-prime
-        if rte_nm.startswith('R-VA'):
-            d = '1' if rte_nm[14:16] in ['NB', 'EB'] else '0'
-        else:
-            d = '1' if rte_nm[7:9] == 'PR' else '0'
-
-        # Get last three of route number to avoid duplicates at intersections
-        if rte_nm.startswith('R-VA'):
-            n = rte_nm[11:14]
-        else:
-            n = rte_nm[10:13]
-        # Get midpoint coordinates
-        midPoint = geom.positionAlongLine(0.5, True)
-        x = str(midPoint.firstPoint.X * -1).replace('.','')[:7]
-        y = str(midPoint.firstPoint.Y).replace('.','')[:7]
-
-        return d + n + x + y
-    except:
-        return None
-
-with arcpy.da.UpdateCursor(fc_needs, ['Segment_ID', 'RTE_NM', 'SHAPE@']) as cur:
-    for row in cur:
-        rte_nm = row[1]
-        geom = row[2]
-        seg_id = calculate_seg_id(rte_nm, geom)
-        row[0] = seg_id
-        cur.updateRow(row)
+# Built from the segment midpoints found for the district, MPO, UDA and RN fields
+step('Update Segment IDs')
+seg_id_fields = ['OID@', 'RTE_NM', 'BEGIN_MSR', 'END_MSR']
+df_seg_ids = read_table(fc_needs, seg_id_fields)
+seg_id_positions = df_seg_ids['OID@'].map(needs_position).to_numpy()
+df_seg_ids['Segment_ID'] = segment_ids(df_seg_ids['RTE_NM'], mid_x[seg_id_positions], mid_y[seg_id_positions])
+update_columns(fc_needs, {'Segment_ID': df_seg_ids['Segment_ID']}, oids=df_seg_ids['OID@'])
+
+# Report segments without a Segment_ID or sharing one with another segment
+df_seg_id_report = segment_id_report(df_seg_ids)
+seg_id_report_csv = os.path.join(os.path.dirname(intermediate_gdb), 'segment_id_report.csv')
+df_seg_id_report.to_csv(seg_id_report_csv, index=False)
+print(f'  {(df_seg_id_report["Problem"] == "Failed").sum()} failed and {(df_seg_id_report["Problem"] == "Duplicate").sum()} duplicate Segment IDs, see {seg_id_report_csv}')
 
 # Remove duplicate segments
-print('Removing Duplicates')
+step('Removing Duplicates')
 all_needs_fields = [field.name for field in arcpy.ListFields(fc_needs) if field.name not in ['OBJECTID', 'Shape', 'Shape_Length']]
-df_all_needs = pd.DataFrame([row for row in arcpy.da.SearchCursor(fc_needs, all_needs_fields)], columns=all_needs_fields)
-# print(f'  Before count: {len(df_all_needs)}')
-df_all_needs_nodup = df_all_needs.drop_duplicates()
-# print(f'  After count: {len(df_all_needs_nodup)}')
+df_all_needs = read_table(fc_needs, all_needs_fields)
+
+# Segments are compared on a 64-bit key of route, measures, needs and the other fields
+needs_bits = pack_flags(df_all_needs, NEEDS_FIELDS)
+other_fields = [field for field in all_needs_fields if field not in NEEDS_FIELDS + ['RTE_NM', 'BEGIN_MSR', 'END_MSR']]
+duplicate = duplicate_segments(df_all_needs, needs_bits, other_fields=other_fields, measure_scale=FINAL_MEASURE_SCALE, catalog=route_catalog)
+df_all_needs_nodup = df_all_needs.loc[~duplicate].reset_index(drop=True)
+needs_bits = needs_bits[~duplicate]
+print(f'  Removed {duplicate.sum()} duplicate segments')
+step_rows(len(df_all_needs_nodup))
+
+# Segments left on the same route with the same needs should not overlap
+df_overlap_report = overlap_report(df_all_needs_nodup, needs_bits, measure_scale=FINAL_MEASURE_SCALE, catalog=route_catalog)
+overlap_report_csv = os.path.join(os.path.dirname(intermediate_gdb), 'overlap_report.csv')
+df_overlap_report.to_csv(overlap_report_csv, index=False)
+print(f'  {len(df_overlap_report)} segments overlap another segment with the same needs, see {overlap_report_csv}')
 
 # RN Eligible UDA Needs are calculated here, after congestion and UDA segments have been finalized in the code above
-print('Calculating RN Eligible UDA Needs')
+step('Calculating RN Eligible UDA Needs')
 
 # RNs with less than 20 miles of congestion needs
 Congestion_RNs = ['Kingsport Region', 'Danville Region', 'Bristol Region', 'Central VA MPO Region (Lynchburg)', 'Harrisonburg Region', 'Charlottesville Region', 'New River Valley Region', 'Winchester Region', 'Staunton/Augusta/Waynesboro Region']
 
-df_all_needs_nodup.loc[((df_all_needs_nodup['UDA_Bike_Infrast'] == 'YES') | (df_all_needs_nodup['UDA_Comp_Street'] == 'YES') | (df_all_needs_nodup['UDA_Intersection_Des'] == 'YES') | (df_all_needs_nodup['UDA_Landscape'] == 'YES') | (df_all_needs_nodup['UDA_Offstreet_Park'] == 'YES') | (df_all_needs_nodup['UDA_Onstreet_Park'] == 'YES') | (df_all_needs_nodup['UDA_Ped_Infrast'] == 'YES') | (df_all_needs_nodup['UDA_Road_Capacity'] == 'YES') | (df_all_needs_nodup['UDA_Road_Ops'] == 'YES') | (df_all_needs_nodup['UDA_Safety_Feat'] == 'YES') | (df_all_needs_nodup['UDA_Sidewalk'] == 'YES') | (df_all_needs_nodup['UDA_Signage'] == 'YES') | (df_all_needs_nodup['UDA_Street_Grid'] == 'YES') | (df_all_needs_nodup['UDA_Traffic_Calm'] == 'YES') | (df_all_needs_nodup['UDA_Transit_Capacity'] == 'YES') | (df_all_needs_nodup['UDA_Transit_Facilities'] == 'YES') | (df_all_needs_nodup['UDA_Transit_Freq'] == 'YES') | (df_all_needs_nodup['UDA_Transit_Ops'] == 'YES')) & (df_all_needs_nodup['RN_Name'].isin(Congestion_RNs)), 'RN_Growth_Area'] = 'YES'
+# Segments with any UDA need in one of those RNs
+UDA_NEEDS_FIELDS = ['UDA_Bike_Infrast', 'UDA_Comp_Street', 'UDA_Intersection_Des', 'UDA_Landscape', 'UDA_Offstreet_Park', 'UDA_Onstreet_Park', 'UDA_Ped_Infrast', 'UDA_Road_Capacity', 'UDA_Road_Ops', 'UDA_Safety_Feat', 'UDA_Sidewalk', 'UDA_Signage', 'UDA_Street_Grid', 'UDA_Traffic_Calm', 'UDA_Transit_Capacity', 'UDA_Transit_Facilities', 'UDA_Transit_Freq', 'UDA_Transit_Ops']
+has_uda_need = has_any(needs_bits, flag_mask(NEEDS_FIELDS, UDA_NEEDS_FIELDS))
+df_all_needs_nodup.loc[has_uda_need & df_all_needs_nodup['RN_Name'].isin(Congestion_RNs).to_numpy(), 'RN_Growth_Area'] = 'YES'
 
-all_needs_csv = os.path.join(os.path.dirname(intermediate_gdb), 'all_needs.csv')
-df_all_needs_nodup.to_csv(all_needs_csv, index=False)
+# In an incremental rebuild the rebuilt routes replace their segments in the previous final needs.
+# The Segment_ID and overlap reports above only cover the rebuilt routes
+if rebuilt_routes is not None:
+    df_all_needs_nodup = patch_routes(all_needs_events, df_all_needs_nodup, rebuilt_routes)
+    print(f'  Replaced the segments of {len(rebuilt_routes)} routes in {all_needs_events}')
+
+# Final needs as a Parquet event table, clustered by route
+publish_stage('2023_VTrans_MidTerm_Needs', df_all_needs_nodup, all_needs_events)
+
+# Route/measure index of the final needs for point and range lookups without ArcGIS
+step('Creating needs index')
+needs_index = f"{main_path}\\2023_VTrans_MidTerm_Needs_index.npz"
+RouteIntervalIndex(df_all_needs_nodup, measure_scale=FINAL_MEASURE_SCALE).save(needs_index)
 
 # Make route event layer
 tbl_output = os.path.join(output_gdb, 'tbl_2023_VTrans_MidTerm_Needs')
 
-print('Creating final output table')
+step('Creating final output table')
 arcpy.CreateTable_management(output_gdb, os.path.basename(tbl_output))
 for f in FIELDS:
     field = Field(name=f, alias=FIELD_ALIAS[f], type=FIELD_TYPE[f])
     arcpy.AddField_management(tbl_output, field.name, field.type, field_alias=field.alias)
 
 # Add needs data
-arcpy.Append_management(all_needs_csv, tbl_output, schema_type='NO_TEST')
+all_needs_table = write_table(df_all_needs_nodup, os.path.join(intermediate_gdb, 'all_needs'))
+arcpy.Append_management(all_needs_table, tbl_output, schema_type='NO_TEST')
 
 arcpy.lr.MakeRouteEventLayer(lrs, "RTE_NM", tbl_output, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_output Events2", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_output Events2", output_gdb, "VTrans_MidTerm_Needs_2023")
\ No newline at end of file
+arcpy.conversion.FeatureClassToFeatureClass("tbl_output Events2", output_gdb, "VTrans_MidTerm_Needs_2023")
+
+# Wait for the Parquet event tables written in the background
+STAGES.wait()
+
+# Route digests of this run for the next incremental rebuild
+save_state(incremental_dir, layer_fingerprint, route_digests)
@@ -18,6 +18,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -26,6 +27,17 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 # %%
 # Paths to intermediate and output geodatabases
 intermediate_gdb = f"{main_path}\\A1 - Common Datasets\\Improved Reliability (Roadway)\\data\\intermediate.gdb"
@@ -74,27 +86,27 @@ df_lottr.loc[df_lottr['F22SHrGT15'] > 0, 'reliability_threshold'] = 'YES'
 
 # %%
 # Overlay TMC, CoSS, and RN layers
-tmc_coss = os.path.join(intermediate_gdb, 'tmc_coss')
-arcpy.lr.OverlayRouteEvents(
+tmc_coss = os.path.join(os.path.dirname(intermediate_gdb), 'tmc_coss.parquet')
+overlay_route_events(
         TMC_LRS,
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         CoSS, 
         "RTE_NM; Line; BEGIN_MSR; END_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tmc_coss'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tmc_coss.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
         "INDEX")
 
-tmc_coss_rn = os.path.join(intermediate_gdb, 'tmc_coss_rn')
-arcpy.lr.OverlayRouteEvents(
+tmc_coss_rn = os.path.join(os.path.dirname(intermediate_gdb), 'tmc_coss_rn.parquet')
+overlay_route_events(
         tmc_coss,
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         RN, 
         "RTE_NM; Line; BEGIN_MSR; END_MSR",
         'UNION', 
-        os.path.join(intermediate_gdb, 'tmc_coss_rn'),
+        os.path.join(os.path.dirname(intermediate_gdb), 'tmc_coss_rn.parquet'),
         'RTE_NM; LINE; BEGIN_MSR; END_MSR',
         "NO_ZERO",
         "FIELDS", 
@@ -103,7 +115,7 @@ arcpy.lr.OverlayRouteEvents(
 # %%
 # Join data to LRS by TMC
 tmc_fields = ['TMC', 'RTE_NM', 'BEGIN_MSR', 'END_MSR', 'COSS', 'RN']
-df_tmcs = pd.DataFrame([row for row in arcpy.da.SearchCursor(tmc_coss_rn, tmc_fields)], columns=tmc_fields).rename(columns={'TMC':'tmc'})
+df_tmcs = read_table(tmc_coss_rn, tmc_fields).rename(columns={'TMC':'tmc'})
 df_tmcs['len'] = round(df_tmcs['END_MSR'] - df_tmcs['BEGIN_MSR'], 3)
 df_tmcs = df_tmcs.loc[~(df_tmcs['tmc'] == '') & (df_tmcs['len'] > 0)]
 
@@ -128,14 +140,12 @@ fields_to_keep = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'CoSS_Reliability', 'RN_Reli
 df_output = df_lottr_tmc.loc[(df_lottr_tmc['CoSS_Reliability'] == 'YES') | (df_lottr_tmc['RN_Reliability'] == 'YES')][fields_to_keep]
 
 # %%
-output_csv = os.path.join(os.path.dirname(intermediate_gdb), 'output.csv')
-df_output.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_reliability')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_reliability.parquet')
+publish_stage('tbl_reliability', df_output, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_reliability Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_reliability Events", output_gdb, "Reliability")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df_output, LRS, output_gdb, 'tbl_reliability', 'Reliability')
 
 
@@ -43,6 +43,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -51,6 +52,20 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.distance_measures import METERS_PER_MILE, distance_route_events
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.network_measures import network_route_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.polygon_measures import polygon_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table, update_columns
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 # %% [markdown]
 # #### Input parameters ####
 # Set the following input parameters:
@@ -58,6 +73,9 @@ common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Data
 # 2. walk_commute_time - Virginia's 90th percentile single-mode walk commute time from ACS Table B08534
 # 3. bike_commute_time - from equation found in the technical guide
 # 4. bike_needs_radius - calculate by multiplying bike speeed by bike commute time and rounding to nearest integer
+# 5. bike_shed_method - 'buffer' (the method of the published needs) clips the LRS with dissolved buffers around the
+# Activity Centers and stops, 'distance' finds the roads within bike_needs_radius of them directly,
+# 'network' finds the roads within bike_needs_radius of them along the road network, without crossing limited access roads
 
 # %%
 bike_speed = 9.9  # mph
@@ -69,6 +87,8 @@ bike_commute_time = bike_commute_time / 60 # Convert to hours to match walk spee
 
 bike_needs_radius = 7
 
+bike_shed_method = 'buffer'
+
 # %% [markdown]
 # ### Data Sources ###
 # 1. Acitvity Centers (OIPI)
@@ -147,10 +167,7 @@ arcpy.TableToTable_conversion(tbl_limited_access, intermediate_gdb, 'tbl_la')
 tbl_limited_access = os.path.join(intermediate_gdb, 'tbl_la')
 if 'la' not in [field.name for field in arcpy.ListFields(tbl_limited_access)]:
     arcpy.AddField_management(tbl_limited_access, 'la', 'SHORT')
-    with arcpy.da.UpdateCursor(tbl_limited_access, 'la') as cur:
-        for row in cur:
-            row[0] = 1
-            cur.updateRow(row)
+    update_columns(tbl_limited_access, {'la': 1})
 
 # %% [markdown]
 # ### Calculations ###
@@ -164,63 +181,56 @@ if 'la' not in [field.name for field in arcpy.ListFields(tbl_limited_access)]:
 # for Pedestrian Access to Activity Centers.
 
 # %%
-# Generate bike needs buffer
-activity_centers_buffer = os.path.join(intermediate_gdb, 'activity_centers_buffer')
-arcpy.analysis.PairwiseBuffer(activity_centers, activity_centers_buffer, f'{bike_needs_radius} MILES', "ALL", None, "PLANAR", "0 DecimalDegrees")
-
-gtfs_stops_dissolved = os.path.join(intermediate_gdb, 'gtfs_stops_dissolved')
-arcpy.analysis.PairwiseDissolve(gtfs_stops, gtfs_stops_dissolved, None, None, "MULTI_PART")
-gtfs_stops_buffer = os.path.join(intermediate_gdb, 'gtfs_stops_buffer')
-arcpy.analysis.PairwiseBuffer(gtfs_stops_dissolved, gtfs_stops_buffer, f'{bike_needs_radius} MILES', "ALL", None, "PLANAR", "0 DecimalDegrees")
-
-bike_needs_buffer_source = os.path.join(intermediate_gdb, 'bike_needs_buffer_source')
-arcpy.analysis.Union([activity_centers_buffer, gtfs_stops_buffer], bike_needs_buffer_source)
-bike_needs_buffer = os.path.join(intermediate_gdb, 'bike_needs_buffer_noTownsOrCities')
-arcpy.analysis.PairwiseDissolve(bike_needs_buffer_source, bike_needs_buffer, None, None, "MULTI_PART")
-
-
-lrs_clip = os.path.join(intermediate_gdb, 'lrs_clip')
-lrs_clip_rn = os.path.join(intermediate_gdb, 'lrs_clip_rn')
-lrs_clip_explode = os.path.join(intermediate_gdb, 'lrs_clip_explode')
-arcpy.analysis.PairwiseClip(lrs, bike_needs_buffer, lrs_clip)
-arcpy.analysis.PairwiseClip(lrs_clip, rn_boundaries, lrs_clip_rn)
-arcpy.management.MultipartToSinglepart(lrs_clip_rn, lrs_clip_explode)
-# Add mp fields to lrs_clip_explode if they do not yet exist
-mp_fields = ['BEGIN_MSR', 'END_MSR']
-for field in mp_fields:
-    if field not in [field.name for field in arcpy.ListFields(lrs_clip_explode)]:
-        arcpy.AddField_management(lrs_clip_explode, field, 'DOUBLE')
-
-with arcpy.da.UpdateCursor(lrs_clip_explode, ['BEGIN_MSR', 'END_MSR', 'SHAPE@']) as cur:
-    for row in cur:
-        geom = row[-1]
-        begin_msr = geom.firstPoint.M
-        end_msr = geom.lastPoint.M
-        row[0] = begin_msr
-        row[1] = end_msr
-        cur.updateRow(row)
-
-tbl_lrs_clip_explode = os.path.join(intermediate_gdb, 'tbl_lrs_clip_explode')
-arcpy.TableToTable_conversion(lrs_clip_explode, intermediate_gdb, 'tbl_lrs_clip_explode')
+if bike_shed_method == 'buffer':
+    # Generate bike needs buffer
+    activity_centers_buffer = os.path.join(intermediate_gdb, 'activity_centers_buffer')
+    arcpy.analysis.PairwiseBuffer(activity_centers, activity_centers_buffer, f'{bike_needs_radius} MILES', "ALL", None, "PLANAR", "0 DecimalDegrees")
+
+    gtfs_stops_dissolved = os.path.join(intermediate_gdb, 'gtfs_stops_dissolved')
+    arcpy.analysis.PairwiseDissolve(gtfs_stops, gtfs_stops_dissolved, None, None, "MULTI_PART")
+    gtfs_stops_buffer = os.path.join(intermediate_gdb, 'gtfs_stops_buffer')
+    arcpy.analysis.PairwiseBuffer(gtfs_stops_dissolved, gtfs_stops_buffer, f'{bike_needs_radius} MILES', "ALL", None, "PLANAR", "0 DecimalDegrees")
+
+    bike_needs_buffer_source = os.path.join(intermediate_gdb, 'bike_needs_buffer_source')
+    arcpy.analysis.Union([activity_centers_buffer, gtfs_stops_buffer], bike_needs_buffer_source)
+    bike_needs_buffer = os.path.join(intermediate_gdb, 'bike_needs_buffer_noTownsOrCities')
+    arcpy.analysis.PairwiseDissolve(bike_needs_buffer_source, bike_needs_buffer, None, None, "MULTI_PART")
+
+
+    # Measures of the parts of the LRS inside both the needs buffer and the RN boundaries,
+    # found without clipping the LRS (see needs_tools/polygon_measures.py)
+    df_lrs_clip = polygon_route_events(lrs, [bike_needs_buffer, rn_boundaries])
+elif bike_shed_method == 'network':
+    # Measures of the parts of the LRS within bike_needs_radius miles of the Activity Centers
+    # and stops along the roads, from one shortest path search over the LRS (see
+    # needs_tools/network_measures.py), limited to the RN boundaries.  Limited access
+    # roads are left out of the network
+    df_bike_shed = network_route_events(lrs, [activity_centers, gtfs_stops], bike_needs_radius * METERS_PER_MILE, arcpy.SpatialReference(3969),
+                                        barriers=tbl_limited_access, barrier_properties='RTE_NM LINE RTE_TO_MSR RTE_FROM_MSR')
+    df_lrs_clip = overlay_route_events(df_bike_shed, 'RTE_NM LINE BEGIN_MSR END_MSR', polygon_route_events(lrs, rn_boundaries), 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', zero_length_events='NO_ZERO')
+elif bike_shed_method == 'distance':
+    # Measures of the parts of the LRS within bike_needs_radius miles of the Activity
+    # Centers and stops, found without making buffers (see needs_tools/distance_measures.py)
+    # and limited to the RN boundaries.  Distances are in the meters of VA Lambert, as the
+    # planar buffers were
+    df_bike_shed = distance_route_events(lrs, [activity_centers, gtfs_stops], bike_needs_radius * METERS_PER_MILE, arcpy.SpatialReference(3969))
+    df_lrs_clip = overlay_route_events(df_bike_shed, 'RTE_NM LINE BEGIN_MSR END_MSR', polygon_route_events(lrs, rn_boundaries), 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', zero_length_events='NO_ZERO')
+else:
+    raise ValueError(f"bike_shed_method must be 'buffer', 'network' or 'distance', not {bike_shed_method!r}")
 
 # %%
 # Overlay event tables
 tbl_la_fc = os.path.join(intermediate_gdb, 'tbl_la_fc')
-arcpy.lr.OverlayRouteEvents(tbl_limited_access, 'RTE_NM LINE RTE_TO_MSR RTE_FROM_MSR', tbl_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', tbl_la_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+overlay_route_events(tbl_limited_access, 'RTE_NM LINE RTE_TO_MSR RTE_FROM_MSR', tbl_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', tbl_la_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
 tbl_la_fc_buffer = os.path.join(intermediate_gdb, 'tbl_la_fc_buffer')
-arcpy.lr.OverlayRouteEvents(tbl_la_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_lrs_clip_explode, 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', tbl_la_fc_buffer, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+overlay_route_events(tbl_la_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', df_lrs_clip, 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', tbl_la_fc_buffer, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
 # Create needs field.  Need = 1 where not limited access (la = 0)
 sql = 'la = 0'
 arcpy.AddField_management(tbl_la_fc_buffer, 'RN_AC_Bicycle_Access', 'TEXT')
-with arcpy.da.UpdateCursor(tbl_la_fc_buffer, ['la', 'RN_AC_Bicycle_Access']) as cur:
-    for row in cur:
-        if row[0] == 0:
-            row[1] = 'YES'
-        else:
-            row[1] = 'NO'
-        cur.updateRow(row)
+df_la = read_table(tbl_la_fc_buffer, ['OID@', 'la'])
+update_columns(tbl_la_fc_buffer, {'RN_AC_Bicycle_Access': df_la['la'].eq(0).map({True: 'YES', False: 'NO'})}, oids=df_la['OID@'])
 
 # %% [markdown]
 # #### Create output event table and layer ####
@@ -228,20 +238,18 @@ with arcpy.da.UpdateCursor(tbl_la_fc_buffer, ['la', 'RN_AC_Bicycle_Access']) as
 # %%
 # Create a dataframe from the previous output that will  match the required schema for needs
 fields_to_keep = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'RN_AC_Bicycle_Access']
-df = pd.DataFrame([row for row in arcpy.da.SearchCursor(tbl_la_fc_buffer, fields_to_keep)], columns=fields_to_keep)
+df = read_table(tbl_la_fc_buffer, fields_to_keep)
 
 # Limit records to only those with a need
 df = df.loc[df['RN_AC_Bicycle_Access'] == 'YES']
 
-output_csv = os.path.join(os.path.dirname(output_gdb), 'output.csv')
-df.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_bicycle_access')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_bicycle_access.parquet')
+publish_stage('tbl_bicycle_access', df, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(lrs, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_bicycle_access Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_bicycle_access Events", output_gdb, "Bicycle_Access")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df, lrs, output_gdb, 'tbl_bicycle_access', 'Bicycle_Access')
 
 
 # %%
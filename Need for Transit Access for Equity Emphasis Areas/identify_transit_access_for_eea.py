@@ -13,6 +13,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -21,6 +22,18 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.polygon_measures import polygon_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 
 # Paths to intermediate and output geodatabases
 intermediate_gdb = f"{main_path}\\A1 - Common Datasets\\Need for Transit Access for Equity Emphasis Areas\\data\\intermediate.gdb"
@@ -57,17 +70,17 @@ Transit_Viability_Underserved = f'{main_path}\\A1 - Common Datasets\\Need for Tr
 
 # EEA Blocks
 eea_fields = ['GEOID', 'eea']
-df_EEAs = pd.DataFrame([row for row in arcpy.da.SearchCursor(EEAs, eea_fields)], columns=eea_fields).set_index('GEOID')
+df_EEAs = read_table(EEAs, eea_fields).set_index('GEOID')
 
 # Transit Viability Blocks
 viability_fields = ['GEOID', 'TransitViability_Flag']
-df_transit_viability = pd.DataFrame([row for row in arcpy.da.SearchCursor(Transit_Viability_Underserved, viability_fields)], columns=viability_fields).set_index('GEOID')
+df_transit_viability = read_table(Transit_Viability_Underserved, viability_fields).set_index('GEOID')
 df_transit_viability.loc[df_transit_viability['TransitViability_Flag'] == 1, 'TransitViability_Flag'] = 'YES'
 df_transit_viability.loc[df_transit_viability['TransitViability_Flag'] == 0, 'TransitViability_Flag'] = 'NO'
 
 # Underserved Transit Blocks
 underserved_fields = ['GEOID', 'TransitUnderserved_Flag']
-df_transit_underserved = pd.DataFrame([row for row in arcpy.da.SearchCursor(Transit_Viability_Underserved, underserved_fields)], columns=underserved_fields).set_index('GEOID')
+df_transit_underserved = read_table(Transit_Viability_Underserved, underserved_fields).set_index('GEOID')
 df_transit_underserved.loc[df_transit_underserved['TransitUnderserved_Flag'] == 1, 'TransitUnderserved_Flag'] = 'YES'
 df_transit_underserved.loc[df_transit_underserved['TransitUnderserved_Flag'] == 0, 'TransitUnderserved_Flag'] = 'NO'
 
@@ -91,46 +104,25 @@ arcpy.PairwiseDissolve_analysis(threshold_blocks_buffer, threshold_blocks)
 # %%
 # Using functional classification > local as base, identify segments that are within threshold_blocks as a need
 
-# Make FC route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", TBL_FC, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_fc Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_fc Events", intermediate_gdb, "tbl_fc_events")
-tbl_fc_events = os.path.join(intermediate_gdb, 'tbl_fc_events')
-
-# Clip FC with threshold_blocks
-fc_threshold_blocks = os.path.join(intermediate_gdb, 'fc_threshold_blocks')
-arcpy.PairwiseClip_analysis(tbl_fc_events, threshold_blocks, fc_threshold_blocks)
-
+# Measures of the parts of the LRS inside threshold_blocks, found without clipping the LRS
+# (see needs_tools/polygon_measures.py)
+df_threshold_blocks_routes = polygon_route_events(LRS, threshold_blocks)
 
-
-# %%
-# Recalculate begin and end measures
-fc_threshold_blocks_singlepart = os.path.join(intermediate_gdb, 'fc_threshold_blocks_singlepart')
-arcpy.MultipartToSinglepart_management(fc_threshold_blocks, fc_threshold_blocks_singlepart)
-with arcpy.da.UpdateCursor(fc_threshold_blocks_singlepart, ['SHAPE@', 'BEGIN_MSR', 'END_MSR']) as cur:
-    for row in cur:
-        geom = row[0]
-        begin_msr = geom.firstPoint.M
-        end_msr = geom.lastPoint.M
-        row[1] = begin_msr
-        row[2] = end_msr
-        cur.updateRow(row)
+# Functional classification events inside threshold_blocks
+df_fc_threshold_blocks = overlay_route_events(TBL_FC, 'RTE_NM LINE BEGIN_MSR END_MSR', df_threshold_blocks_routes, 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', zero_length_events='NO_ZERO')
 
 # %%
 # Overlay with RN to only include segments within RN
 
-# Convert fc_threshold_blocks_singlepart to event table
-tbl_fc_threshold_blocks_singlepart = os.path.join(intermediate_gdb, 'tbl_fc_threshold_blocks_singlepart')
-arcpy.TableToTable_conversion(fc_threshold_blocks_singlepart, intermediate_gdb, 'tbl_fc_threshold_blocks_singlepart')
-
 # Overlay with RN
 transit_access_RN_Overlay = os.path.join(intermediate_gdb, 'transit_access_RN_Overlay')
-arcpy.lr.OverlayRouteEvents(tbl_fc_threshold_blocks_singlepart, 'RTE_NM LINE BEGIN_MSR END_MSR', RN, 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', transit_access_RN_Overlay, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+overlay_route_events(df_fc_threshold_blocks, 'RTE_NM LINE BEGIN_MSR END_MSR', RN, 'RTE_NM LINE BEGIN_MSR END_MSR', 'INTERSECT', transit_access_RN_Overlay, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
 
 # %%
 # Clean up needs event table in Pandas
 transit_access_fields = [field.name for field in arcpy.ListFields(transit_access_RN_Overlay) if field.name not in ('OBJECTID', 'Shape', 'ORIG_FID', 'Shape_Length', 'RN')]
-df_transit_access = pd.DataFrame([row for row in arcpy.da.SearchCursor(transit_access_RN_Overlay, transit_access_fields)], columns=transit_access_fields)
+df_transit_access = read_table(transit_access_RN_Overlay, transit_access_fields)
 df_transit_access['RN_Transit_Equity'] = 'YES'
 
 # Filter out ramps and non-local functional classification
@@ -140,15 +132,13 @@ df_transit_access
 
 # %%
 # Create final output
-output_csv = os.path.join(os.path.dirname(intermediate_gdb), 'output.csv')
-df_transit_access.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_transit_access_eaa')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_transit_access_eaa.parquet')
+publish_stage('tbl_transit_access_eaa', df_transit_access, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_transit_access Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_transit_access Events", output_gdb, "Transit_Access_EAA")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df_transit_access, LRS, output_gdb, 'tbl_transit_access_eaa', 'Transit_Access_EAA')
 
 # %%
 
@@ -20,6 +20,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -28,6 +29,18 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.polygon_measures import polygon_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table, update_columns
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 # Paths to intermediate and output geodatabases
 intermediate_gdb = f"{main_path}\\A1 - Common Datasets\\Need for Transit Access to Activity Centers\\data\\intermediate.gdb"
 output_gdb = f"{main_path}\\A1 - Common Datasets\\Need for Transit Access to Activity Centers\\data\\output.gdb"
@@ -85,7 +98,7 @@ field_aliases = [
         '45-59 min',
         'GT 60 min'
     ]
-df_rn_commute_times = pd.DataFrame([row for row in arcpy.da.SearchCursor(RN_Commute_Times, commute_time_fields)], columns=field_aliases)
+df_rn_commute_times = read_table(RN_Commute_Times, commute_time_fields).set_axis(field_aliases, axis=1)
 
 # %%
 # Identify the median transit commute time as the midpoint of the travel time bin containing the 50th percentile transit commuter
@@ -198,14 +211,9 @@ arcpy.Buffer_analysis(AC_Results, AC_Buffer, 'Buffer_Dis')
 if 'need' not in [field.name for field in arcpy.ListFields(AC_Buffer)]:
     arcpy.AddField_management(AC_Buffer, 'need', 'TEXT')
 
-with arcpy.da.UpdateCursor(AC_Buffer, ['POP20_AUTO', 'POP20_TRAN', 'need']) as cur:
-    for row in cur:
-        if row[1] < row[0]:
-            row[2] = 'YES'
-        else:
-            row[2] = 'NO'
-
-        cur.updateRow(row)
+df_ac_buffer = read_table(AC_Buffer, ['OID@', 'POP20_AUTO', 'POP20_TRAN'])
+ac_need = df_ac_buffer['POP20_TRAN'] < df_ac_buffer['POP20_AUTO']
+update_columns(AC_Buffer, {'need': ac_need.map({True: 'YES', False: 'NO'})}, oids=df_ac_buffer['OID@'])
 
 # Export only buffered ACs where need = 'YES'
 AC_Buffer_w_Need = os.path.join(intermediate_gdb, 'AC_Buffer_w_Need')
@@ -215,33 +223,17 @@ AC_Buffer_w_Need_Dissolved = os.path.join(intermediate_gdb, 'AC_Buffer_w_Need_Di
 arcpy.Dissolve_management(AC_Buffer_w_Need, AC_Buffer_w_Need_Dissolved)
 
 # %%
-# Use the Functional Classification layer as a base for segmentation.  Then clip by AC_Buffer to determine the needs
+# Use the Functional Classification table as a base for segmentation.  Then keep the parts inside AC_Buffer to determine the needs
 
-# Make FC route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", TBL_FC, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_fc Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_fc Events", intermediate_gdb, "tbl_fc_events")
-tbl_fc_events = os.path.join(intermediate_gdb, 'tbl_fc_events')
+# Measures of the parts of the LRS inside the buffers, found without clipping the LRS (see needs_tools/polygon_measures.py)
+df_ac_buffer_routes = polygon_route_events(LRS, AC_Buffer_w_Need_Dissolved)
 
-# Clip tbl_fc_events by buffer
-fc_ac_buffer = os.path.join(intermediate_gdb, 'fc_ac_buffer')
-arcpy.PairwiseClip_analysis(tbl_fc_events, AC_Buffer_w_Need_Dissolved, fc_ac_buffer)
-
-# Recalculate begin and end measures
-fc_ac_buffer_singlepart = os.path.join(intermediate_gdb, 'fc_ac_buffer_singlepart')
-arcpy.MultipartToSinglepart_management(fc_ac_buffer, fc_ac_buffer_singlepart)
-with arcpy.da.UpdateCursor(fc_ac_buffer_singlepart, ['SHAPE@', 'BEGIN_MSR', 'END_MSR']) as cur:
-    for row in cur:
-        geom = row[0]
-        begin_msr = geom.firstPoint.M
-        end_msr = geom.lastPoint.M
-        row[1] = begin_msr
-        row[2] = end_msr
-        cur.updateRow(row)
+# Functional Classification events inside the buffers
+df_fc_ac_buffer = overlay_route_events(TBL_FC, 'RTE_NM; Line; BEGIN_MSR; END_MSR', df_ac_buffer_routes, 'RTE_NM; Line; BEGIN_MSR; END_MSR', 'INTERSECT', zero_length_events='NO_ZERO')
 
 # %%
 # Clean up needs event table in Pandas
-transit_access_fields = [field.name for field in arcpy.ListFields(fc_ac_buffer_singlepart) if field.name not in ('OBJECTID', 'Shape', 'ORIG_FID', 'Shape_Length')]
-df_transit_access = pd.DataFrame([row for row in arcpy.da.SearchCursor(fc_ac_buffer_singlepart, transit_access_fields)], columns=transit_access_fields)
+df_transit_access = df_fc_ac_buffer.copy()
 df_transit_access['RN_AC_Transit_Access'] = 'YES'
 
 # Filter out ramps and non-local functional classification
@@ -251,15 +243,13 @@ df_transit_access
 
 # %%
 # Create final output
-output_csv = os.path.join(os.path.dirname(intermediate_gdb), 'output.csv')
-df_transit_access.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_transit_access')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_transit_access.parquet')
+publish_stage('tbl_transit_access', df_transit_access, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_transit_access Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_transit_access Events", output_gdb, "Transit_Access")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df_transit_access, LRS, output_gdb, 'tbl_transit_access', 'Transit_Access')
 
 # %%
 
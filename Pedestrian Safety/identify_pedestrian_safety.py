@@ -22,6 +22,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -30,6 +31,16 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table, update_columns
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 intermediate_gdb = f"{main_path}\\A1 - Common Datasets\\Pedestrian Safety\\data\\intermediate.gdb"
 output_gdb = f"{main_path}\\A1 - Common Datasets\\Pedestrian Safety\\data\\output.gdb"
 
@@ -57,17 +68,14 @@ if 'flip' not in [field.name for field in arcpy.ListFields(psap)]:
     arcpy.AddField_management(psap, 'flip', 'SHORT')
 
 # Identify fields that need to be flipped
-with arcpy.da.UpdateCursor(psap, ['VDOT_DIVIDED', 'UMIS_FACILITY_TYPE', 'flip']) as cur:
-    for row in cur:
-        if row[0] == 'Undivided' and row[1] != '1-One-Way Undivided':
-            row[2] = 1
-        else:
-            row[2] = 0
-        cur.updateRow(row)
+df_psap_flip = read_table(psap, ['OID@', 'VDOT_DIVIDED', 'UMIS_FACILITY_TYPE'])
+flip = (df_psap_flip['VDOT_DIVIDED'] == 'Undivided') & (df_psap_flip['UMIS_FACILITY_TYPE'] != '1-One-Way Undivided')
+update_columns(psap, {'flip': flip.astype(int)}, oids=df_psap_flip['OID@'])
 
 # %%
 # Make opposite route dictionary
-opp_rte_nm_dict = {row[0]: row[1] for row in arcpy.da.SearchCursor(lrs, ['RTE_NM', 'RTE_OPPOSITE_DIRECTION_RTE_NM'])}
+df_opp_rte_nm = read_table(lrs, ['RTE_NM', 'RTE_OPPOSITE_DIRECTION_RTE_NM'])
+opp_rte_nm_dict = dict(zip(df_opp_rte_nm['RTE_NM'], df_opp_rte_nm['RTE_OPPOSITE_DIRECTION_RTE_NM']))
 
 # %%
 # Create new feature class containing only flip segments
@@ -96,8 +104,8 @@ with arcpy.da.UpdateCursor(psap_to_flip, ['RTE_NM', 'FMEAS', 'TMEAS', 'SHAPE@'])
 # %%
 # Convert original and flipped event tables in pandas dataframes and convert to schema
 fields_to_keep = ['RTE_NM', 'FMEAS', 'TMEAS']
-df_original_psap = pd.DataFrame([row for row in arcpy.da.SearchCursor(psap, fields_to_keep)], columns=fields_to_keep)
-df_flipped_psap = pd.DataFrame([row for row in arcpy.da.SearchCursor(psap_to_flip, fields_to_keep)], columns=fields_to_keep)
+df_original_psap = read_table(psap, fields_to_keep)
+df_flipped_psap = read_table(psap_to_flip, fields_to_keep)
 
 # DataFrame with both tables
 df_psap = df_original_psap.append(df_flipped_psap)
@@ -107,16 +115,13 @@ df_psap.rename(columns={'FMEAS': 'BEGIN_MSR', 'TMEAS': 'END_MSR'}, inplace=True)
 df_psap['Safety_Pedestrian'] = 'YES'
 
 # %%
-# Export to csv
-output_csv = os.path.join(os.path.dirname(output_gdb), 'output.csv')
-df_psap.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_ped_safety')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_ped_safety.parquet')
+publish_stage('tbl_ped_safety', df_psap, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(lrs, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_ped_safety Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_ped_safety Events", output_gdb, "Pedestrian_Safety_Improvements")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df_psap, lrs, output_gdb, 'tbl_ped_safety', 'Pedestrian_Safety_Improvements')
 
 # %%
 
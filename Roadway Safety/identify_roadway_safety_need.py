@@ -39,6 +39,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -47,6 +48,12 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.overlay import dissolve_route_events, overlay_route_events
+from needs_tools.polygon_measures import polygon_route_events
+from needs_tools.tables import read_table, update_columns
+
 # %%
 # Input PSI data from VDOT
 segment_psi_source = f"{main_path}\\A1 - Common Datasets\\Roadway Safety\\data\\SEG_PSI_OIPI.csv"
@@ -98,31 +105,12 @@ intersection_psi_buffer = make_path(intermediate_gdb, 'intersection_psi_buffer')
 arcpy.XYTableToPoint_management(intersection_psi_csv, intersection_psi_points, 'LON', 'LAT', coordinate_system=arcpy.SpatialReference(4326))
 arcpy.PairwiseBuffer_analysis(intersection_psi_points, intersection_psi_buffer, '150 FEET', 'ALL')
 
-# Clip LRS to buffer
-lrs_clip = make_path(intermediate_gdb, 'lrs_clip')
-arcpy.PairwiseClip_analysis(master_lrs, intersection_psi_buffer, lrs_clip)
-
-# Explode LRS Clip to remove multipart segments
-lrs_clip_explode = make_path(intermediate_gdb, 'lrs_clip_explode')
-arcpy.management.MultipartToSinglepart(lrs_clip, lrs_clip_explode)
-
-# Get begin and end points for LRS Clip
-mp_fields = ['BEGIN_MSR', 'END_MSR']
-for field in mp_fields:
-    if field not in [field.name for field in arcpy.ListFields(lrs_clip_explode)]:
-        arcpy.AddField_management(lrs_clip_explode, field, 'DOUBLE')
-
-with arcpy.da.UpdateCursor(lrs_clip_explode, ['BEGIN_MSR', 'END_MSR', 'SHAPE@']) as cur:
-    for row in cur:
-        geom = row[-1]
-        begin_msr = geom.firstPoint.M
-        end_msr = geom.lastPoint.M
-        row[0] = begin_msr
-        row[1] = end_msr
-        cur.updateRow(row)
+# Measures of the parts of the master LRS inside the buffers, found without clipping the
+# LRS (see needs_tools/polygon_measures.py)
+df_lrs_clip = polygon_route_events(master_lrs, intersection_psi_buffer)
 
 # %%
-# Routes not included in the intersection PSI should not be included in the event table.  The clip will include all routes within the buffer.lrs_clip
+# Routes not included in the intersection PSI should not be included in the event table.  The clip will include all routes within the buffer.
 # This step will create an event table as well as remove routes that should not be included.
 
 # Get list of routes in intersection PSI
@@ -136,7 +124,7 @@ with arcpy.da.SearchCursor(intersection_psi_points, 'RTE_NAME') as cur:
 
 # Make intersection psi needs event table in pandas
 fields = ['RTE_NM', 'BEGIN_MSR', 'END_MSR']
-df_intersection_psi = pd.DataFrame([row for row in arcpy.da.SearchCursor(lrs_clip_explode, fields)], columns=fields)
+df_intersection_psi = df_lrs_clip[fields]
 
 # Only include routes in psi_routes list
 df_intersection_psi = df_intersection_psi.loc[df_intersection_psi['RTE_NM'].isin(psi_routes)]
@@ -181,7 +169,7 @@ arcpy.TableToTable_conversion(safety_segment_csv, intermediate_gdb, 'tbl_safety_
 
 # Overlap with CoSS
 output_table = os.path.join(output_gdb, 'tbl_safety_segment')
-arcpy.lr.OverlayRouteEvents(os.path.join(intermediate_gdb, 'tbl_safety_segment'), 'RTE_NM LINE BEGIN_MSR END_MSR', CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', output_table, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+overlay_route_events(os.path.join(intermediate_gdb, 'tbl_safety_segment'), 'RTE_NM LINE BEGIN_MSR END_MSR', CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', output_table, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
 # Delete all records where RN Safety Segments do not exist
 with arcpy.da.UpdateCursor(output_table, 'Safety_Segments') as cur:
@@ -190,13 +178,8 @@ with arcpy.da.UpdateCursor(output_table, 'Safety_Segments') as cur:
             cur.deleteRow()
 
 # Mark overlaps with CoSS with CoSS Need
-with arcpy.da.UpdateCursor(output_table, ['COSS', 'CoSS_Safety_Segments']) as cur:
-    for row in cur:
-        if row[0] == 1:
-            row[1] = 'YES'
-        else:
-            row[1] = 'NO'
-        cur.updateRow(row)
+df_coss = read_table(output_table, ['OID@', 'COSS'])
+update_columns(output_table, {'CoSS_Safety_Segments': df_coss['COSS'].eq(1).map({True: 'YES', False: 'NO'})}, oids=df_coss['OID@'])
 
 # Delete null values
 
@@ -234,11 +217,11 @@ arcpy.TableToTable_conversion(safety_intersections_csv, intermediate_gdb, 'tbl_s
 
 # Dissolve table to remove potential overlaps
 tbl_safety_intersections_dissolve = os.path.join(intermediate_gdb, 'tbl_safety_intersections_dissolve')
-arcpy.lr.DissolveRouteEvents(tbl_safety_intersections_predissolve, "RTE_NM; Line; BEGIN_MSR; END_MSR", "Safety_Intersection;CoSS_Safety_Intersection", tbl_safety_intersections_dissolve, "RTE_NM; Line; BEGIN_MSR; END_MSR", "DISSOLVE", "INDEX")
+dissolve_route_events(tbl_safety_intersections_predissolve, "RTE_NM; Line; BEGIN_MSR; END_MSR", "Safety_Intersection;CoSS_Safety_Intersection", tbl_safety_intersections_dissolve, "RTE_NM; Line; BEGIN_MSR; END_MSR", "DISSOLVE", "INDEX")
 
 # Overlap with CoSS
 output_table = os.path.join(output_gdb, 'tbl_safety_intersections')
-arcpy.lr.OverlayRouteEvents(tbl_safety_intersections_dissolve, 'RTE_NM LINE BEGIN_MSR END_MSR', CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', output_table, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+overlay_route_events(tbl_safety_intersections_dissolve, 'RTE_NM LINE BEGIN_MSR END_MSR', CoSS, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', output_table, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
 # Delete all records where RN Safety Segments do not exist
 with arcpy.da.UpdateCursor(output_table, 'Safety_Intersection') as cur:
@@ -247,13 +230,8 @@ with arcpy.da.UpdateCursor(output_table, 'Safety_Intersection') as cur:
             cur.deleteRow()
 
 # Mark overlaps with CoSS with CoSS Need
-with arcpy.da.UpdateCursor(output_table, ['COSS', 'CoSS_Safety_Intersection']) as cur:
-    for row in cur:
-        if row[0] == 1:
-            row[1] = 'YES'
-        else:
-            row[1] = 'NO'
-        cur.updateRow(row)
+df_coss = read_table(output_table, ['OID@', 'COSS'])
+update_columns(output_table, {'CoSS_Safety_Intersection': df_coss['COSS'].eq(1).map({True: 'YES', False: 'NO'})}, oids=df_coss['OID@'])
 
 # Make route event layer
 arcpy.lr.MakeRouteEventLayer(lrs, "RTE_NM", output_table, "RTE_NM; Line; BEGIN_MSR; END_MSR", "safety_intersection Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
@@ -29,6 +29,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -37,6 +38,17 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.event_store import export_enabled, export_events
+from needs_tools.overlay import overlay_route_events
+from needs_tools.registry import publish_stage
+from needs_tools.tables import read_table
+from needs_tools.trace import trace_geoprocessing
+
+# Each geoprocessing tool is timed, see needs_tools/trace.py
+trace_geoprocessing(arcpy)
+
 # %% [markdown]
 # #### Prepare Data Sources ####
 # 1. lrs - Overlap LRS
@@ -77,20 +89,20 @@ tbl_fc = f'{common_datasets_gdb}\\tbl_fc23'
 
 # %%
 # Overlap all event tables
-tbl_coss_rn = os.path.join(intermediate_gdb, 'tbl_coss_rn')
-arcpy.lr.OverlayRouteEvents(tbl_coss, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_rn, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', tbl_coss_rn, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+tbl_coss_rn = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_coss_rn.parquet')
+overlay_route_events(tbl_coss, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_rn, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', tbl_coss_rn, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
-tbl_coss_rn_la = os.path.join(intermediate_gdb, 'tbl_coss_rn_la')
-arcpy.lr.OverlayRouteEvents(tbl_coss_rn, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_la, 'RTE_NM LINE RTE_FROM_MSR RTE_TO_MSR', 'UNION', tbl_coss_rn_la, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+tbl_coss_rn_la = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_coss_rn_la.parquet')
+overlay_route_events(tbl_coss_rn, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_la, 'RTE_NM LINE RTE_FROM_MSR RTE_TO_MSR', 'UNION', tbl_coss_rn_la, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
-tbl_coss_rn_la_fc = os.path.join(intermediate_gdb, 'tbl_coss_rn_la_fc')
-arcpy.lr.OverlayRouteEvents(tbl_coss_rn_la, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', tbl_coss_rn_la_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
+tbl_coss_rn_la_fc = os.path.join(os.path.dirname(intermediate_gdb), 'tbl_coss_rn_la_fc.parquet')
+overlay_route_events(tbl_coss_rn_la, 'RTE_NM LINE BEGIN_MSR END_MSR', tbl_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', 'UNION', tbl_coss_rn_la_fc, 'RTE_NM LINE BEGIN_MSR END_MSR', zero_length_events='NO_ZERO')
 
 
 # %%
 # Convert to DataFrame
 fields_to_keep = ['RTE_NM', 'BEGIN_MSR', 'END_MSR', 'COSS', 'RN', 'RIM_ACCESS_CONTROL_DSC', 'STATE_FUNCT_CLASS_ID']
-df = pd.DataFrame([row for row in arcpy.da.SearchCursor(tbl_coss_rn_la_fc, fields_to_keep)], columns=fields_to_keep)
+df = read_table(tbl_coss_rn_la_fc, fields_to_keep)
 
 # Create cleaner limited access column
 df['LA'] = 0
@@ -138,14 +150,12 @@ df = df[fields_to_keep]
 # #### Create output event table and layer ####
 
 # %%
-output_csv = os.path.join(os.path.dirname(output_gdb), 'output.csv')
-df.to_csv(output_csv, index=False)
-
-# Make gdb event table
-arcpy.TableToTable_conversion(output_csv, output_gdb, 'tbl_tdm_needs')
+# Result used by the final needs layer, written to a Parquet event table in the background
+output_events = os.path.join(os.path.dirname(output_gdb), 'tbl_tdm_needs.parquet')
+publish_stage('tbl_tdm_needs', df, output_events)
 
-# Make route event layer
-arcpy.lr.MakeRouteEventLayer(lrs, "RTE_NM", output_csv, "RTE_NM; Line; BEGIN_MSR; END_MSR", "tbl_tdm_needs Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
-arcpy.conversion.FeatureClassToFeatureClass("tbl_tdm_needs Events", output_gdb, "Transportation_Demand_Management")
+# Geodatabase event table and route event layer
+if export_enabled():
+    export_events(df, lrs, output_gdb, 'tbl_tdm_needs', 'Transportation_Demand_Management')
 
 
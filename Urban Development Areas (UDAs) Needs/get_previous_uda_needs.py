@@ -1,6 +1,7 @@
 # %%
 import arcpy
 import os
+import sys
 import pandas as pd
 
 arcpy.env.overwriteOutput = True
@@ -9,6 +10,11 @@ arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
 
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.overlay import dissolve_route_events
+from needs_tools.tables import read_table
+
 
 # Paths to intermediate and output geodatabases
 intermediate_gdb = f"{main_path}\\A1 - Common Datasets\\Urban Development Areas (UDAs) Needs\\data\\intermediate.gdb"
@@ -60,7 +66,7 @@ uda_fields = [
 
 fields_to_keep += uda_fields
 
-df_previous_uda_needs = pd.DataFrame([row for row in arcpy.da.SearchCursor(previous_needs, fields_to_keep)], columns=fields_to_keep)
+df_previous_uda_needs = read_table(previous_needs, fields_to_keep)
 
 # %%
 # Find only records that previously contained a UDA need.  Replace NO with 0 and YES with 1 then sum all need columns.
@@ -90,7 +96,7 @@ predissolve_table = os.path.join(intermediate_gdb, 'tbl_uda_needs_predissolve')
 arcpy.TableToTable_conversion(output_csv, intermediate_gdb, 'tbl_uda_needs_predissolve')
 
 tbl_output = os.path.join(output_gdb, 'tbl_uda_needs')
-arcpy.lr.DissolveRouteEvents(predissolve_table, "RTE_NM; Line; BEGIN_MSR; END_MSR", "UDA_road_capacity;UDA_road_ops;UDA_transit_freq;UDA_transit_ops;UDA_transit_capacity;UDA_transit_facilities;UDA_street_grid;UDA_bike_infrast;UDA_ped_infrast;UDA_comp_street;UDA_safety_feat;UDA_onstreet_park;UDA_offstreet_park;UDA_intersection_des;UDA_signage;UDA_traffic_calm;UDA_landscape;UDA_sidewalk;RN_Growth_Area", tbl_output, "RTE_NM; Line; BEGIN_MSR; END_MSR", "DISSOLVE", "INDEX")
+dissolve_route_events(predissolve_table, "RTE_NM; Line; BEGIN_MSR; END_MSR", "UDA_road_capacity;UDA_road_ops;UDA_transit_freq;UDA_transit_ops;UDA_transit_capacity;UDA_transit_facilities;UDA_street_grid;UDA_bike_infrast;UDA_ped_infrast;UDA_comp_street;UDA_safety_feat;UDA_onstreet_park;UDA_offstreet_park;UDA_intersection_des;UDA_signage;UDA_traffic_calm;UDA_landscape;UDA_sidewalk;RN_Growth_Area", tbl_output, "RTE_NM; Line; BEGIN_MSR; END_MSR", "DISSOLVE", "INDEX")
 
 # Make route event layer
 arcpy.lr.MakeRouteEventLayer(LRS, "RTE_NM", tbl_output, "RTE_NM; LINE; BEGIN_MSR; END_MSR", "tbl_uda_needs Events", None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
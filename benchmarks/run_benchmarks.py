@@ -0,0 +1,316 @@
+""" Benchmarks of the hot paths of the needs scripts.
+
+Each benchmark builds synthetic event tables at a fraction or multiple of the size of the
+statewide data (0.01 is a 1% sample, 10 is ten times statewide), times the operation and
+reports events per second.  Results are saved per commit in benchmarks/results/<commit>.json
+so runs on different commits can be compared.
+
+    python benchmarks/run_benchmarks.py                          every benchmark at every size
+    python benchmarks/run_benchmarks.py --sizes 0.01 0.1         smaller sizes only
+    python benchmarks/run_benchmarks.py --only overlay dedup     some of the benchmarks
+    python benchmarks/run_benchmarks.py --compare <commit>       compare with the results of a commit
+
+The benchmarks only need numpy, pandas, shapely and scipy, not ArcGIS.
+"""
+
+import argparse
+import ast
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+main_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.dedup import duplicate_segments, overlap_report
+from needs_tools.distance_measures import RELATIVE_TOLERANCE, distance_measure_arrays, source_points
+from needs_tools.flags import has_any, pack_flags, unpack_flags
+from needs_tools.lrs_cache import line_vertices
+from needs_tools.measures import FINAL_MEASURE_SCALE
+from needs_tools.network_measures import blocked_vertices, network_measure_arrays
+from needs_tools.overlay import dissolve_events, overlay_many_events
+from needs_tools.polygon_measures import polygon_measure_arrays
+from needs_tools.routes import RouteCatalog
+from needs_tools.segment_ids import segment_ids
+from needs_tools.spatial import containing_polygon
+from needs_tools.synthetic import MILES_PER_DEGREE_Y, SyntheticLRS, activity_centers, limited_access_table, transit_stops
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Approximate size of the statewide data: routes in the overlap LRS and events per route in
+# a need event table
+STATEWIDE_ROUTES = 60000
+EVENTS_PER_ROUTE = 10
+STATEWIDE_BLOCK_GROUPS = 5963
+
+SIZES = [0.01, 0.1, 1, 10]
+
+
+class Skip(Exception):
+    """ Raised by a benchmark that cannot run here """
+
+
+def route_names(n_routes, rng):
+    """ State route names in the LRS format, e.g. R-VA   US00250WB """
+    prefixes = np.array(['IS', 'US', 'SR', 'SC'])
+    directions = np.array(['NB', 'SB', 'EB', 'WB'])
+    numbers = rng.permutation(max(n_routes, 1) * 4)[:n_routes]
+    return pd.Series([f'R-VA   {prefixes[n % 4]}{n // 4:05d}{directions[n % 4]}' for n in numbers], dtype=object)
+
+
+def event_table(size, rng, fields=1, events_per_route=EVENTS_PER_ROUTE, routes=None):
+    """ Event table with random YES/NO need fields on routes of 1 to 20 miles """
+    routes = route_names(max(int(STATEWIDE_ROUTES * size), 1), rng) if routes is None else routes
+    n = len(routes) * events_per_route
+    route = routes.to_numpy()[rng.integers(0, len(routes), n)]
+    begin = np.round(rng.uniform(0, 20, n), 3)
+    end = np.round(begin + rng.exponential(0.5, n) + 0.01, 3)
+    df = pd.DataFrame({'RTE_NM': route, 'BEGIN_MSR': begin, 'END_MSR': end})
+    for i in range(fields):
+        df[f'Need_{i}'] = np.where(rng.random(n) < 0.3, 'YES', 'NO').astype(object)
+    return df
+
+
+def bench_overlay(size, rng):
+    tables = [event_table(size, rng).rename(columns={'Need_0': f'Need_{i}'}) for i in range(3)]
+    return sum(len(df) for df in tables), lambda: overlay_many_events(tables)
+
+
+def bench_dissolve(size, rng):
+    df = event_table(size, rng)
+    return len(df), lambda: dissolve_events(df, dissolve_fields=['Need_0'])
+
+
+def bench_polygon_measures(size, rng):
+    import shapely
+
+    # Activity centers buffered by 3 miles and dissolved, as in the bike access script
+    lrs = SyntheticLRS(max(int(STATEWIDE_ROUTES * size), 1), seed=int(rng.integers(0, 2 ** 31)))
+    df, shapes = activity_centers(lrs)
+    buffers = shapely.union_all(shapely.buffer(shapely.from_wkb(shapes), 3 / MILES_PER_DEGREE_Y, quad_segs=8))
+    coords, offsets, line = line_vertices(shapely.from_wkb(lrs.wkb()))
+    return len(lrs), lambda: polygon_measure_arrays(coords, offsets, [buffers])
+
+
+def bench_distance_measures(size, rng):
+    import shapely
+
+    # Roads within 3 miles of the activity centers, as bench_polygon_measures without the buffers
+    lrs = SyntheticLRS(max(int(STATEWIDE_ROUTES * size), 1), seed=int(rng.integers(0, 2 ** 31)))
+    df, shapes = activity_centers(lrs)
+    distance = 3 / MILES_PER_DEGREE_Y
+    points = source_points(shapely.from_wkb(shapes), np.sqrt(8 * distance * distance * RELATIVE_TOLERANCE))
+    coords, offsets, line = line_vertices(shapely.from_wkb(lrs.wkb()))
+    return len(lrs), lambda: distance_measure_arrays(coords, offsets, points, distance)
+
+
+def bench_network_measures(size, rng):
+    import shapely
+
+    # Roads within 3 miles of the activity centers and stops along the roads, without the
+    # limited access routes
+    lrs = SyntheticLRS(max(int(STATEWIDE_ROUTES * size), 1), seed=int(rng.integers(0, 2 ** 31)))
+    shapes = np.concatenate([shapely.from_wkb(activity_centers(lrs)[1]), shapely.from_wkb(transit_stops(lrs)[1])])
+    distance = 3 / MILES_PER_DEGREE_Y
+    points = source_points(shapes, np.sqrt(8 * RELATIVE_TOLERANCE) * distance)
+    coords, offsets, line = line_vertices(shapely.from_wkb(lrs.wkb()))
+    route_names = np.asarray(lrs.names, dtype=object)[line]
+
+    def run():
+        blocked = blocked_vertices(route_names, coords, offsets, limited_access_table(lrs), 'RTE_NM LINE RTE_FROM_MSR RTE_TO_MSR')
+        network_measure_arrays(coords, offsets, points, distance, blocked=blocked)
+    return len(lrs), run
+
+
+def bench_point_in_polygon(size, rng):
+    import shapely
+
+    n = max(int(STATEWIDE_ROUTES * EVENTS_PER_ROUTE * size), 1)
+    x = rng.uniform(-83.7, -75.2, n)
+    y = rng.uniform(36.5, 39.5, n)
+
+    # A 40 x 40 grid of overlapping squares stands in for the boundary layers
+    cx, cy = np.meshgrid(np.linspace(-83.7, -75.2, 40), np.linspace(36.5, 39.5, 40))
+    polygons = shapely.buffer(shapely.points(cx.ravel(), cy.ravel()), 0.15, quad_segs=4)
+    return n, lambda: containing_polygon(x, y, polygons)
+
+
+def bench_segment_ids(size, rng):
+    n = max(int(STATEWIDE_ROUTES * EVENTS_PER_ROUTE * size), 1)
+    routes = route_names(max(int(STATEWIDE_ROUTES * size), 1), rng)
+    names = routes.to_numpy()[rng.integers(0, len(routes), n)]
+    x = rng.uniform(-83.7, -75.2, n)
+    y = rng.uniform(36.5, 39.5, n)
+    return n, lambda: segment_ids(names, x, y)
+
+
+def bench_dedup(size, rng):
+    df = event_table(size, rng, fields=8)
+    df = pd.concat([df, df.sample(frac=0.1, random_state=1)], ignore_index=True)
+    fields = [f'Need_{i}' for i in range(8)]
+
+    def run():
+        bits = pack_flags(df, fields)
+        duplicate = duplicate_segments(df, bits, measure_scale=FINAL_MEASURE_SCALE)
+        overlap_report(df.loc[~duplicate].reset_index(drop=True), bits[~duplicate], measure_scale=FINAL_MEASURE_SCALE)
+    return len(df), run
+
+
+def _create_dataframe():
+    """ create_dataframe from CreateTables.py.  The script connects to ArcGIS and checks its
+    output folder when it is imported, so only the function is loaded from its source """
+    path = os.path.join(main_path, 'Need for Bicycle Access to Activity Centers', 'CreateTables.py')
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    function = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == 'create_dataframe')
+    namespace = {'pd': pd}
+    exec(compile(ast.Module(body=[function], type_ignores=[]), path, 'exec'), namespace)
+    return namespace['create_dataframe']
+
+
+def bench_acs_tables(size, rng):
+    create_dataframe = _create_dataframe()
+    n = max(int(STATEWIDE_BLOCK_GROUPS * size * 10), 1)
+    stats = [f'B08301_{i:03d}E' for i in range(1, 22)]
+    data = [['NAME', 'GEO_ID'] + stats] + [
+        [f'Block Group {i}', f'1500000US51{i:010d}'] + [str(v) for v in rng.integers(0, 2000, len(stats))] for i in range(n)]
+    table = {
+        'geography': 'block group',
+        'functions': [
+            {'name': 'Walk_Bike', 'alias': 'Walk or bike', 'operation': 'sum', 'statistics': ['B08301_018E', 'B08301_019E']},
+            {'name': 'Pct_Walk_Bike', 'alias': 'Percent walk or bike', 'operation': 'percent', 'statistics': ['Walk_Bike', 'B08301_001E']}
+        ]
+    }
+
+    def run():
+        if create_dataframe(table, data) is None:
+            raise Skip(f'create_dataframe failed with pandas {pd.__version__}')
+    return n, run
+
+
+def bench_final_assembly(size, rng):
+    routes = route_names(max(int(STATEWIDE_ROUTES * size), 1), rng)
+    tables = [event_table(size, rng, routes=routes, events_per_route=EVENTS_PER_ROUTE // 2).rename(columns={'Need_0': f'Need_{i}'})
+              for i in range(12)]
+    fields = [f'Need_{i}' for i in range(12)]
+    catalog = RouteCatalog(routes)
+
+    def run():
+        df = overlay_many_events(tables, measure_scale=FINAL_MEASURE_SCALE)
+        bits = pack_flags(df, fields)
+        keep = has_any(bits)
+        df = pd.concat([df.loc[keep].drop(columns=fields).reset_index(drop=True), unpack_flags(bits[keep], fields)], axis=1)
+        duplicate = duplicate_segments(df, bits[keep], measure_scale=FINAL_MEASURE_SCALE, catalog=catalog)
+        overlap_report(df.loc[~duplicate].reset_index(drop=True), bits[keep][~duplicate], measure_scale=FINAL_MEASURE_SCALE, catalog=catalog)
+    return sum(len(df) for df in tables), run
+
+
+BENCHMARKS = {
+    'overlay': bench_overlay,
+    'dissolve': bench_dissolve,
+    'polygon_measures': bench_polygon_measures,
+    'distance_measures': bench_distance_measures,
+    'network_measures': bench_network_measures,
+    'point_in_polygon': bench_point_in_polygon,
+    'segment_ids': bench_segment_ids,
+    'dedup': bench_dedup,
+    'acs_tables': bench_acs_tables,
+    'final_assembly': bench_final_assembly,
+}
+
+
+def current_commit():
+    """ (commit hash, whether the working tree has changes) """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=main_path, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=main_path, capture_output=True, text=True).stdout.strip() != ''
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', True
+
+
+def run_benchmark(name, size, repeat, seed=0):
+    """ Result of one benchmark at one size, with the best time of repeat runs """
+    rng = np.random.default_rng(seed)
+    try:
+        events, function = BENCHMARKS[name](size, rng)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    except Skip as e:
+        return {'benchmark': name, 'size': size, 'skipped': str(e)}
+    seconds = min(times)
+    return {'benchmark': name, 'size': size, 'events': int(events), 'seconds': seconds,
+            'events_per_second': events / seconds if seconds > 0 else None}
+
+
+def load_results(commit):
+    path = os.path.join(RESULTS_DIR, f'{commit}.json')
+    if not os.path.exists(path):
+        raise Exception(f'No benchmark results for commit {commit} in {RESULTS_DIR}')
+    with open(path) as f:
+        return {(r['benchmark'], r['size']): r for r in json.load(f)['results']}
+
+
+def save_results(results, commit, dirty):
+    """ Adds the results to the file of the commit, replacing earlier results of the same
+    benchmarks and sizes """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{commit}.json')
+    saved = load_results(commit) if os.path.exists(path) else {}
+    saved.update({(r['benchmark'], r['size']): r for r in results})
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'dirty': dirty,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} cores',
+            'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__},
+            'results': sorted(saved.values(), key=lambda r: (list(BENCHMARKS).index(r['benchmark']) if r['benchmark'] in BENCHMARKS else 99, r['size']))
+        }, f, indent=1)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot paths of the needs scripts')
+    parser.add_argument('--sizes', nargs='+', type=float, default=SIZES, help='data sizes as a fraction of statewide')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run (all by default)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the fastest is kept')
+    parser.add_argument('--compare', help='commit whose saved results are shown next to these')
+    parser.add_argument('--no-save', action='store_true', help='do not save the results')
+    args = parser.parse_args()
+
+    commit, dirty = current_commit()
+    previous = load_results(args.compare) if args.compare else {}
+    print(f'Benchmarks on {commit}{" (with uncommitted changes)" if dirty else ""}')
+    print(f'{"benchmark":18} {"size":>6} {"events":>10} {"seconds":>9} {"events/s":>12}' + (f' {args.compare:>12} {"change":>8}' if args.compare else ''))
+
+    results = []
+    for name in args.only or list(BENCHMARKS):
+        for size in args.sizes:
+            result = run_benchmark(name, size, args.repeat if size < 10 else 1)
+            results.append(result)
+            if 'skipped' in result:
+                print(f'{name:18} {size:>6g}  skipped: {result["skipped"]}')
+                continue
+            line = f'{name:18} {size:>6g} {result["events"]:>10} {result["seconds"]:>9.3f} {result["events_per_second"]:>12,.0f}'
+            before = previous.get((name, size))
+            if before and before.get('events_per_second'):
+                line += f' {before["events_per_second"]:>12,.0f} {result["events_per_second"] / before["events_per_second"] - 1:>+8.0%}'
+            print(line)
+
+    if not args.no_save:
+        print(f'Results saved to {save_results(results, commit, dirty)}')
+
+
+if __name__ == '__main__':
+    main()
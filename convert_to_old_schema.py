@@ -10,6 +10,8 @@ import numpy as np
 import arcpy
 import os
 
+from needs_tools.tables import read_table
+
 arcpy.env.overwriteOutput = True
 main_path = os.path.dirname(os.path.abspath(__file__))
 common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
@@ -286,7 +288,7 @@ class Field:
 
 # Create DataFrame for input data in new schema
 new_cols = [field for field in NEW_FIELD_ALIAS]
-df_new_data = pd.DataFrame([row for row in arcpy.da.SearchCursor(new_source, new_cols)], columns=new_cols)
+df_new_data = read_table(new_source, new_cols)
 
 # Dictionary showing how to rename each column
 dict_col_rename = {'Segment_ID': 'Segment_ID','ST_NM': 'ST_NM','RTE_NM': 'VDOT_RM','VDOT_COMMON_NM': 'VDOT_COMMON_NM','BEGIN_MSR': 'From_measure','END_MSR': 'To_measure','Segment_Length': 'Segment_Length','MASTER_RTE_NM': 'MASTER_RTE_NM','RTE_OPPOSITE_DIRECTION_RTE_NM': 'RTE_OPPOSITE_DIRECTION_RTE_NM','Direction': 'Direction','VDOT_FC': 'VDOT_FC','VDOT_District': 'VDOT_District','MPO': 'MPO','AADT_2018': 'AADT_2018','CoSS': 'CoSS','CoSS_Primary': 'CoSS_Primary','CoSS_Name': 'CoSS_Name','CoSS_Congestion': 'CoSS_congestion','CoSS_Reliability': 'CoSS_reliability','CoSS_Rail_Reliability': 'CoSS_Rail_Reliability','CoSS_Capacity_Preservation': 'CoSS_capacity_preservation','CoSS_LA_TDM': 'CoSS_LA_TDM','CoSS_non_LA_TDM': 'CoSS_non_LA_TDM','RN_Name': 'RN_Name','RN_Congestion': 'RN_congestion','RN_Reliability': 'RN_reliability','RN_Capacity_Preservation': 'RN_Capacity_Preservation','RN_LA_TDM': 'RN_LA_TDM','RN_non_LA_TDM': 'RN_non_LA_TDM', 'RN_AC_Bicycle_Access': 'RN_AC_Bicycle_Access','RN_AC_Pedestrian_Access': 'RN_AC_pedestrian_access','RN_AC_Transit_Access': 'RN_AC_Transit_Access','RN_Transit_Equity': 'RN_transit_equity','UDA': 'UDA','UDA_Name': 'UDA_Name','UDA_Road_Capacity': 'UDA_road_capacity','UDA_Road_Ops': 'UDA_road_ops','UDA_Transit_Freq': 'UDA_transit_freq','UDA_Transit_Ops': 'UDA_transit_ops','UDA_Transit_Capacity': 'UDA_transit_capacity','UDA_Transit_Facilities': 'UDA_transit_facilities','UDA_Street_Grid': 'UDA_street_grid','UDA_Bike_Infrast': 'UDA_bike_infrast','UDA_Ped_Infrast': 'UDA_ped_infrast','UDA_Comp_Street': 'UDA_comp_street','UDA_Safety_Feat': 'UDA_safety_feat','UDA_Onstreet_Park': 'UDA_onstreet_park','UDA_Offstreet_Park': 'UDA_offstreet_park','UDA_Intersection_Des': 'UDA_intersection_des','UDA_Signage': 'UDA_signage','UDA_Traffic_Calm': 'UDA_traffic_calm','UDA_Landscape': 'UDA_landscape','UDA_Sidewalk': 'UDA_sidewalk','RN_Growth_Area': 'RN_Growth_Area','IEDA': 'IEDA','Safety_Segments': 'Safety_Segments','CoSS_Safety_Segments': 'CoSS_Safety_Segments','Safety_Intersection': 'Safety_Intersection','CoSS_Safety_Intersection': 'CoSS_Safety_Intersection','Safety_Pedestrian': 'Safety_Pedestrian','All_Limited_Access': 'All_Limited_Access','Select_Limited_Access': 'Select_Limited_Access'}
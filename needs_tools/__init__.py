@@ -0,0 +1,6 @@
+""" Shared tools used by the needs scripts.
+
+The modules in this package do not import arcpy at module level so that they can
+be used from any Python environment.  Functions that read or write geodatabase
+tables import arcpy when they are called.
+"""
@@ -0,0 +1,111 @@
+""" Duplicate and overlapping segment detection for event tables.
+
+Each segment is reduced to a 64-bit key hashed from its route id, its fixed-point from
+and to measures, its need bitmask and the codes of the values of any other fields that
+are compared.
+Sorting the keys once finds the exact duplicates, so the wide table never has to be
+compared column by column.  Segments on the same route with the same needs whose measures
+overlap are found with one more sort, by route, needs and from measure, keeping the
+largest to measure seen so far.
+
+Both steps are O(n log n) and only keep a few integer arrays per segment.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.measures import MEASURE_SCALE, MISSING_MEASURE, to_fixed
+from needs_tools.routes import RouteCatalog
+
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(values):
+    """ splitmix64 finalizer, so that nearby integers get unrelated hashes """
+    with np.errstate(over='ignore'):
+        z = np.asarray(values).astype(np.uint64) + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def segment_keys(*columns):
+    """ 64-bit hash of each row of the integer columns """
+    key = np.zeros(len(columns[0]), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in columns:
+            key = _mix(key * np.uint64(31) ^ _mix(np.asarray(column).astype(np.int64).view(np.uint64)))
+    return key
+
+
+def _segment_columns(df, event_properties, bits, other_fields, measure_scale, catalog):
+    parts = event_properties.replace(';', ' ').split()
+    route_field, from_field, to_field = parts[0], parts[2], parts[3]
+    catalog = RouteCatalog(df[route_field]) if catalog is None else catalog
+    route = catalog.encode(df[route_field]).astype(np.int64)
+    begin = to_fixed(df[from_field], measure_scale).astype(np.int64)
+    end = to_fixed(df[to_field], measure_scale).astype(np.int64)
+    columns = [route, np.minimum(begin, end), np.maximum(begin, end), np.asarray(bits, dtype=np.uint64)]
+    # Equal values of a field get the same code, so the codes can be compared instead of the values
+    columns.extend(pd.factorize(df[field])[0].astype(np.int64) for field in other_fields)
+    return columns
+
+
+def duplicate_segments(df, bits, event_properties='RTE_NM LINE BEGIN_MSR END_MSR', other_fields=(),
+                       measure_scale=MEASURE_SCALE, catalog=None):
+    """ True for every row that repeats an earlier row's route, measures, needs and other
+    fields.  Rows with equal keys are checked field by field, so a hash collision keeps both
+    rows instead of dropping one """
+    columns = _segment_columns(df, event_properties, bits, other_fields, measure_scale, catalog)
+    key = segment_keys(*columns)
+    order = np.argsort(key, kind='stable')
+
+    same = key[order][1:] == key[order][:-1]
+    for column in columns:
+        column = column[order]
+        same &= column[1:] == column[:-1]
+
+    duplicate = np.zeros(len(df), dtype=bool)
+    duplicate[order[1:][same]] = True
+    return duplicate
+
+
+def overlapping_segments(df, bits, event_properties='RTE_NM LINE BEGIN_MSR END_MSR', tolerance=0,
+                         measure_scale=MEASURE_SCALE, catalog=None):
+    """ Pairs of rows on the same route with the same needs whose measures overlap by more
+    than tolerance miles.  Exact duplicates are included.  Returns (row, earlier row)
+    position arrays, where the earlier row is the one with the furthest to measure among
+    the rows that start before it """
+    route, begin, end, bits = _segment_columns(df, event_properties, bits, (), measure_scale, catalog)
+    valid = np.flatnonzero((route >= 0) & (begin != MISSING_MEASURE) & (end != MISSING_MEASURE))
+    order = valid[np.lexsort((begin[valid], bits[valid], route[valid]))]
+    if len(order) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Routes and needs are numbered by group, and the measures are packed below the group so
+    # that the running largest to measure never carries over from one group to the next
+    group = np.cumsum(np.append(True, (route[order][1:] != route[order][:-1]) | (bits[order][1:] != bits[order][:-1])))
+    offset = begin[order].min() - 1
+    span = end[order].max() - offset + 1
+    begin_key = group * span + (begin[order] - offset)
+    end_key = group * span + (end[order] - offset)
+
+    max_end_key = np.maximum.accumulate(end_key)
+    holder = np.maximum.accumulate(np.where(end_key == max_end_key, np.arange(len(order)), 0))
+    overlap = begin_key[1:] + int(round(tolerance * measure_scale)) < max_end_key[:-1]
+    later = np.flatnonzero(overlap) + 1
+    return order[later], order[holder[later - 1]]
+
+
+def overlap_report(df, bits, event_properties='RTE_NM LINE BEGIN_MSR END_MSR', tolerance=0,
+                   measure_scale=MEASURE_SCALE, catalog=None):
+    """ Rows of df that overlap an earlier row with the same route and needs, with the route
+    and measures of that row in Overlaps_ fields (Overlaps_RTE_NM, Overlaps_BEGIN_MSR and
+    Overlaps_END_MSR by default) """
+    parts = event_properties.replace(';', ' ').split()
+    row, earlier = overlapping_segments(df, bits, event_properties, tolerance, measure_scale, catalog)
+    report = df.iloc[row].reset_index(drop=True)
+    for field in (parts[0], parts[2], parts[3]):
+        report[f'Overlaps_{field}'] = df[field].iloc[earlier].to_numpy()
+    return report
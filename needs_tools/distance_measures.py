@@ -0,0 +1,203 @@
+""" Route measures of the stretches of routes within a distance of points, lines or polygons.
+
+Finds the stretches that clipping the LRS with dissolved buffers of the sources finds,
+without making the buffers.  The distance from the route vertices to the nearest source
+point is found with a KD-tree, and each segment between two vertices is cut into pieces
+until every piece is known to be within the distance or beyond it:
+
+- beyond it when the distances at its ends, less its length, leave no room for a point
+  of the piece to be within the distance
+- within it when one source point is within the distance of both ends, since the circle
+  around that point holds everything between them
+- otherwise, once it is shorter than the tolerance, within it when its middle is
+
+A piece that starts or ends within the distance of a source point is cut where it
+crosses the circle around that point, so most segments are settled in a few rounds.
+
+The M values at the ends of the pieces are interpolated from the segment's vertices.
+Lines and the outlines of polygons are stood in for by points close enough together that
+the circles around them reach to within the tolerance of the true buffer, and the
+stretches inside the polygons themselves are added from polygon_measure_arrays.
+
+    df = distance_route_events(lrs, [activity_centers, gtfs_stops], 7 * METERS_PER_MILE, arcpy.SpatialReference(3969))
+
+shapely 2 and scipy are required and are imported when these functions are called.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.lrs_cache import lrs_geometry
+from needs_tools.polygon_measures import JOIN_TOLERANCE, join_runs, polygon_measure_arrays, route_segments, source_shapes
+from needs_tools.storage import split_geopackage_path
+from needs_tools.trace import traced
+
+
+METERS_PER_MILE = 1609.344
+
+# Largest error in where a stretch begins or ends, as a fraction of the distance
+RELATIVE_TOLERANCE = 1e-4
+
+
+def source_points(shapes, spacing):
+    """ x and y of the points standing in for the shapes: the points themselves, and points
+    no more than spacing apart along lines and the outlines of polygons """
+    import shapely
+
+    shapes = np.asarray(shapes, dtype=object)
+    shapes = shapely.get_parts(shapes[~shapely.is_missing(shapes)])
+    shapes = shapes[~shapely.is_empty(shapes)]
+    polygons = shapely.get_type_id(shapes) == 3
+    shapes[polygons] = shapely.boundary(shapes[polygons])
+    xy = shapely.get_coordinates(shapely.segmentize(shapes, spacing))
+    return xy[:, 0], xy[:, 1]
+
+
+def distance_measure_arrays(coords, offsets, points, distance, tolerance=None, join_tolerance=JOIN_TOLERANCE):
+    """ (part, begin, end) of every stretch of the single parts within the distance of the
+    points (x, y), sorted by part and begin.  coords and offsets are the vertices from
+    needs_tools.lrs_cache.line_vertices """
+    from scipy.spatial import cKDTree
+
+    tolerance = distance * RELATIVE_TOLERANCE if tolerance is None else tolerance
+    x, y = np.asarray(points[0], dtype=np.float64), np.asarray(points[1], dtype=np.float64)
+    sources = np.column_stack([x, y])
+
+    # Segments are only looked at near the cells of a grid, one distance across, that hold a
+    # source point
+    cells = np.unique(np.floor(sources / distance), axis=0) if len(sources) else np.zeros((0, 2))
+    boxes = np.column_stack([cells * distance - distance, (cells + 1) * distance + distance])
+    part_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    start = route_segments(coords, offsets, boxes)
+    p0 = coords[start, :2]
+    step = coords[start + 1, :2] - p0
+    length = np.hypot(step[:, 0], step[:, 1])
+
+    # Distances beyond limit are not needed exactly, limit is used for them instead
+    tree = cKDTree(sources)
+    limit = 2 * distance
+
+    def nearest(xy):
+        """ (distance, source point) of the nearest source point within limit, or (limit, -1) """
+        if len(xy) == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        near, source = tree.query(xy, distance_upper_bound=limit, workers=-1)
+        found = source < len(sources)
+        return np.where(found, near, limit), np.where(found, source, -1)
+
+    def reaches(source, xy):
+        """ Whether each source point is within the distance of the point xy """
+        gap = sources[np.maximum(source, 0)] - xy
+        return (source >= 0) & (np.hypot(gap[:, 0], gap[:, 1]) <= distance)
+
+    def crossing(source, segment, last):
+        """ Fraction of the segment where it leaves (last) or enters the circle around each
+        source point """
+        u = p0[segment] - sources[source]
+        v = step[segment]
+        a, b, c = (v * v).sum(axis=1), (u * v).sum(axis=1), (u * u).sum(axis=1) - distance ** 2
+        root = np.sqrt(np.maximum(b * b - a * c, 0))
+        return (-b + root if last else -b - root) / a
+
+    # Distances of the vertices at the ends of the segments
+    needed = np.zeros(len(coords), dtype=bool)
+    needed[start] = True
+    needed[start + 1] = True
+    vertex_near, vertex_source = nearest(coords[needed, :2])
+    position = np.cumsum(needed) - 1
+
+    segment = np.arange(len(start))
+    t0, t1 = np.zeros(len(start)), np.ones(len(start))
+    f0, f1 = vertex_near[position[start]], vertex_near[position[start + 1]]
+    s0, s1 = vertex_source[position[start]], vertex_source[position[start + 1]]
+    kept = []
+    while len(segment):
+        a = p0[segment] + t0[:, None] * step[segment]
+        b = p0[segment] + t1[:, None] * step[segment]
+        span = (t1 - t0) * length[segment]
+        beyond = (f0 + f1 - span) / 2 > distance
+        within = ~beyond & ((f0 <= distance) & reaches(s0, b) | (f1 <= distance) & reaches(s1, a))
+
+        # Pieces shorter than the tolerance go by their middle
+        small = np.flatnonzero(~beyond & ~within & (span <= tolerance))
+        within[small] = nearest((a[small] + b[small]) / 2)[0] <= distance
+        kept.append((segment[within], t0[within], t1[within]))
+
+        rest = ~beyond & ~within
+        rest[small] = False
+        segment, t0, t1, f0, f1, s0, s1 = (values[rest] for values in (segment, t0, t1, f0, f1, s0, s1))
+
+        # A piece that starts inside the circle of a source point is within the distance
+        # until it leaves the circle, and one that ends inside a circle is from where it
+        # enters it.  What is left between is looked at again
+        low, high = t0.copy(), t1.copy()
+        starts_in = f0 <= distance
+        ends_in = f1 <= distance
+        low[starts_in] = np.minimum(crossing(s0[starts_in], segment[starts_in], True), t1[starts_in])
+        high[ends_in] = np.maximum(crossing(s1[ends_in], segment[ends_in], False), t0[ends_in])
+        kept.append((segment[starts_in], t0[starts_in], low[starts_in]))
+        kept.append((segment[ends_in], high[ends_in], t1[ends_in]))
+
+        # Pieces the circles did not shorten by more than the tolerance are cut in half
+        grace = tolerance / 2 / length[segment]
+        moved = (low < high) & ((low > t0 + grace) | (high < t1 - grace))
+        halved = (low < high) & ~moved
+        middle = (t0[halved] + t1[halved]) / 2
+        low = np.concatenate([low[moved], t0[halved], middle])
+        high = np.concatenate([high[moved], middle, t1[halved]])
+        segment = np.concatenate([segment[moved], segment[halved], segment[halved]])
+        f0, s0 = nearest(p0[segment] + low[:, None] * step[segment])
+        f1, s1 = nearest(p0[segment] + high[:, None] * step[segment])
+        t0, t1 = low, high
+
+    segment, low, high = (np.concatenate(values) for values in zip(*kept)) if kept else (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+    # M values at the ends of each piece
+    m0, m1 = coords[start[segment], 2], coords[start[segment] + 1, 2]
+    begin = m0 + low * (m1 - m0)
+    end = m0 + high * (m1 - m0)
+    begin, end = np.minimum(begin, end), np.maximum(begin, end)
+    return join_runs(part_of_vertex[start[segment]], begin, end, join_tolerance)
+
+
+@traced()
+def distance_route_events(lrs, sources, distance, spatial_reference=None, route_field='RTE_NM', tolerance=None):
+    """ Events of the stretches of the LRS routes within the distance of the sources, with
+    the fields RTE_NM, BEGIN_MSR and END_MSR.  The same result, to within the tolerance, as
+    clipping the LRS with the dissolved buffers of the sources.
+
+    sources is a feature class or an array of shapely geometries, or a list of them.  The
+    distance and tolerance are in the units of spatial_reference, which the LRS and the
+    feature classes are projected to (the LRS's coordinate system by default).  The
+    tolerance is RELATIVE_TOLERANCE of the distance by default.
+    """
+    import shapely
+
+    tolerance = distance * RELATIVE_TOLERANCE if tolerance is None else tolerance
+    source_reference = spatial_reference
+    if split_geopackage_path(lrs) is None and source_reference is None:
+        import arcpy
+
+        source_reference = arcpy.Describe(lrs).spatialReference
+
+    # The routes are read from their memory-mapped copy, see needs_tools/lrs_cache.py
+    coords, offsets, route_names = lrs_geometry(lrs, route_field, spatial_reference=spatial_reference).route_vertices()
+    shapes = [source_shapes(source, source_reference) for source in (sources if isinstance(sources, list) else [sources])]
+    shapes = np.concatenate(shapes) if shapes else np.zeros(0, dtype=object)
+
+    # Points this far apart along an outline leave gaps of at most the tolerance between
+    # their circles and the buffer of the outline
+    spacing = np.sqrt(8 * distance * tolerance)
+    part, begin, end = distance_measure_arrays(coords, offsets, source_points(shapes, spacing), distance, tolerance)
+
+    shapes = shapes[~shapely.is_missing(shapes)]
+    polygons = shapes[np.isin(shapely.get_type_id(shapes), [3, 6])]
+    if len(polygons):
+        inside = polygon_measure_arrays(coords, offsets, polygons)
+        part, begin, end = join_runs(*(np.concatenate([near, within]) for near, within in zip((part, begin, end), inside)))
+
+    return pd.DataFrame({
+        route_field: pd.Series(np.asarray(route_names, dtype=object)[part], dtype=object),
+        'BEGIN_MSR': begin,
+        'END_MSR': end
+    })
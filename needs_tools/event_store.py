@@ -0,0 +1,117 @@
+""" Route-clustered Parquet event tables.
+
+Intermediate and output event tables are written as zstd-compressed Parquet files with
+the rows sorted by route and from measure.  The first and last row of every route are
+kept in the file's metadata, so the events of a few routes can be read without reading
+the rest of the file, and every stage reads the columns straight into Arrow buffers
+instead of parsing CSV text.
+
+Writing the tables to a geodatabase and making their route event layers is a separate,
+final step that is skipped when the NEEDS_EXPORT_GDB environment variable is "no".
+
+pyarrow is required and is imported when these functions are called.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+ROUTE_INDEX_KEY = b'needs.route_index'
+
+# Rows per Parquet row group.  Reading a few routes only decompresses their row groups
+ROW_GROUP_ROWS = 65536
+
+
+def export_enabled():
+    """ Whether event tables are also written to geodatabases, from the NEEDS_EXPORT_GDB
+    environment variable (yes by default) """
+    return os.environ.get('NEEDS_EXPORT_GDB', 'yes').lower() not in ('no', 'false', '0')
+
+
+def write_events(df, path, route_field='RTE_NM', from_field='BEGIN_MSR'):
+    """ Writes the DataFrame to a Parquet event table sorted by route and from measure,
+    with the row offsets of each route in the file metadata """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sort_fields = [field for field in (route_field, from_field) if field in df.columns]
+    if sort_fields:
+        df = df.sort_values(sort_fields, kind='stable', na_position='last')
+
+    routes = pd.Series(df[route_field].to_numpy(), dtype=object) if route_field in df.columns else pd.Series([], dtype=object)
+    present = routes.notna().to_numpy()
+    starts = np.flatnonzero(present & np.append(True, routes.to_numpy()[1:] != routes.to_numpy()[:-1]))
+    stops = np.append(starts[1:], present.sum()) if len(starts) else starts
+    route_index = {
+        'route_field': route_field,
+        'routes': [str(route) for route in routes.to_numpy()[starts]],
+        'starts': starts.tolist(),
+        'stops': stops.tolist()
+    }
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[ROUTE_INDEX_KEY] = json.dumps(route_index).encode('utf-8')
+    pq.write_table(table.replace_schema_metadata(metadata), path, compression='zstd', row_group_size=ROW_GROUP_ROWS)
+    return path
+
+
+def route_index(path):
+    """ Dictionary of route name to the (first, last + 1) rows of its events """
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(path).metadata or {}
+    if ROUTE_INDEX_KEY not in metadata:
+        raise Exception(f'{path} is not a route-clustered event table')
+    index = json.loads(metadata[ROUTE_INDEX_KEY])
+    return dict(zip(index['routes'], zip(index['starts'], index['stops'])))
+
+
+def read_events(path, fields=None, routes=None):
+    """ Reads a Parquet event table as an Arrow table.  With routes, only the row groups
+    that hold those routes are read """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = None if fields is None else list(fields)
+    if routes is None:
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    index = route_index(path)
+    ranges = sorted(index[route] for route in set(routes) if route in index)
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    if not ranges:
+        return parquet_file.schema_arrow.empty_table().select(columns) if columns else parquet_file.schema_arrow.empty_table()
+
+    group_rows = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+    group_starts = np.append(0, np.cumsum(group_rows))
+    pieces = []
+    for start, stop in ranges:
+        first = np.searchsorted(group_starts, start, 'right') - 1
+        last = np.searchsorted(group_starts, stop, 'left')
+        groups = parquet_file.read_row_groups(list(range(first, last)), columns=columns)
+        pieces.append(groups.slice(start - group_starts[first], stop - start))
+    return pa.concat_tables(pieces)
+
+
+def read_events_frame(path, fields=None, routes=None):
+    """ Reads a Parquet event table as a DataFrame """
+    return read_events(path, fields, routes).to_pandas()
+
+
+def export_events(events, lrs, out_gdb, table_name, layer_name=None, event_properties='RTE_NM; Line; BEGIN_MSR; END_MSR'):
+    """ Writes an event table to a geodatabase table and, with layer_name, a feature class
+    of its route events.  events can be a Parquet event table or anything read_table can
+    read.  Returns the geodatabase table """
+    import arcpy
+    from needs_tools.tables import read_table, write_table
+
+    out_table = os.path.join(out_gdb, table_name)
+    write_table(read_table(events), out_table)
+    if layer_name is not None:
+        arcpy.lr.MakeRouteEventLayer(lrs, event_properties.split(';')[0].strip(), out_table, event_properties, f'{table_name} Events', None, "NO_ERROR_FIELD", "NO_ANGLE_FIELD", "NORMAL", "ANGLE", "LEFT", "POINT")
+        arcpy.conversion.FeatureClassToFeatureClass(f'{table_name} Events', out_gdb, layer_name)
+    return out_table
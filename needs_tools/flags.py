@@ -0,0 +1,52 @@
+""" Need flags packed into one uint64 per segment.
+
+The final needs layer has one YES/NO text field per need.  Inside the scripts the needs
+are carried as a bitmask instead, with bit i set when the i-th need field is YES, so that
+checks across many needs are single integer operations.  The flags are only turned back
+into YES/NO text when a table is written.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+MAX_FLAGS = 64
+
+
+def _check_fields(fields):
+    if len(fields) > MAX_FLAGS:
+        raise Exception(f'At most {MAX_FLAGS} need fields can be packed, got {len(fields)}')
+
+
+def pack_flags(df, fields):
+    """ Bitmask of the fields that are YES in each row.  Missing fields count as NO """
+    _check_fields(fields)
+    bits = np.zeros(len(df), dtype=np.uint64)
+    for i, field in enumerate(fields):
+        if field in df.columns:
+            bits |= (df[field].to_numpy(dtype=object) == 'YES').astype(np.uint64) << np.uint64(i)
+    return bits
+
+
+def unpack_flags(bits, fields):
+    """ DataFrame with a YES/NO column for each field """
+    _check_fields(fields)
+    bits = np.asarray(bits, dtype=np.uint64)
+    return pd.DataFrame({
+        field: pd.Series(np.where(bits & (np.uint64(1) << np.uint64(i)), 'YES', 'NO'), dtype=object)
+        for i, field in enumerate(fields)
+    })
+
+
+def flag_mask(fields, selected):
+    """ Bitmask with the bits of the selected fields set """
+    mask = np.uint64(0)
+    for field in selected:
+        mask |= np.uint64(1) << np.uint64(fields.index(field))
+    return mask
+
+
+def has_any(bits, mask=None):
+    """ True for rows with at least one of the flags in mask (any flag by default) """
+    bits = np.asarray(bits, dtype=np.uint64)
+    return bits != 0 if mask is None else (bits & np.uint64(mask)) != 0
@@ -0,0 +1,122 @@
+""" Incremental rebuilds of the final needs layer.
+
+Every step of the final needs layer works one route at a time: the overlay, the LRS and
+area fields, Segment_IDs and the duplicate checks only compare segments on the same route.
+So when a few routes change in the source event tables, only those routes have to be
+rebuilt and swapped into the previous result.
+
+Each source table is reduced to one 64-bit digest per route, a hash of the route's rows
+that does not depend on their order.  The digests of the last run are kept in a state
+folder, and a route is rebuilt when its digest changed in any source, or it was added to
+or removed from one.  Anything that affects every route (the code and the boundary
+layers) goes into a fingerprint, and when that changes the whole layer is rebuilt.
+
+Incremental rebuilds are used when the NEEDS_INCREMENTAL environment variable is "yes".
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.dedup import _mix
+from needs_tools.event_store import read_events_frame
+from needs_tools.spatial import read_shapes
+from needs_tools.tables import read_table, write_table
+
+
+STATE_FILE = 'state.json'
+DIGESTS_FILE = 'route_digests.parquet'
+
+
+def incremental_enabled():
+    """ Whether the final needs layer is rebuilt incrementally, from the NEEDS_INCREMENTAL
+    environment variable (no by default) """
+    return os.environ.get('NEEDS_INCREMENTAL', 'no').lower() in ('yes', 'true', '1')
+
+
+def route_digests(df, route_field='RTE_NM'):
+    """ Series of a 64-bit digest of the rows of each route.  Rows are hashed with their
+    fields in name order and the row hashes are summed, so the digest does not depend on
+    the order of the rows or columns """
+    if len(df) == 0:
+        return pd.Series([], dtype=np.uint64)
+    row_hash = _mix(pd.util.hash_pandas_object(df[sorted(df.columns)], index=False).to_numpy())
+    codes, routes = pd.factorize(df[route_field])
+    digests = np.zeros(len(routes), dtype=np.uint64)
+    np.add.at(digests, codes[codes >= 0], row_hash[codes >= 0])
+    return pd.Series(digests, index=pd.Index(routes, dtype=object))
+
+
+def digest_sources(sources, route_field='RTE_NM'):
+    """ DataFrame of Source, RTE_NM and Digest for a dictionary of source DataFrames """
+    frames = []
+    for name, df in sources.items():
+        digests = route_digests(df, route_field)
+        frames.append(pd.DataFrame({'Source': name, route_field: digests.index.to_numpy(dtype=object),
+                                    'Digest': digests.to_numpy()}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def fingerprint(files=(), frames=()):
+    """ Hash of the contents of files and DataFrames that affect every route """
+    digest = hashlib.blake2b(digest_size=20)
+    for path in files:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for df in frames:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def layer_frame(layer, fields):
+    """ DataFrame of the fields and the WKB shapes of a feature class, for fingerprint """
+    import shapely
+
+    shapes, df = read_shapes(layer, fields)
+    df['WKB'] = shapely.to_wkb(shapes)
+    return df
+
+
+def load_state(state_dir):
+    """ (fingerprint, route digests) of the last run, or (None, None) """
+    state_path = os.path.join(state_dir, STATE_FILE)
+    digests_path = os.path.join(state_dir, DIGESTS_FILE)
+    if not os.path.exists(state_path) or not os.path.exists(digests_path):
+        return None, None
+    with open(state_path) as f:
+        state = json.load(f)
+    return state['fingerprint'], read_table(digests_path)
+
+
+def save_state(state_dir, state_fingerprint, digests):
+    os.makedirs(state_dir, exist_ok=True)
+    write_table(digests, os.path.join(state_dir, DIGESTS_FILE))
+    with open(os.path.join(state_dir, STATE_FILE), 'w') as f:
+        json.dump({'fingerprint': state_fingerprint, 'routes': int(digests['RTE_NM'].nunique())}, f)
+
+
+def changed_routes(previous, current, route_field='RTE_NM'):
+    """ Routes whose digest differs between two digest tables in any source """
+    # Nullable integers keep the digests exact where a route is only in one of the tables
+    previous = previous.astype({'Digest': 'UInt64'})
+    current = current.astype({'Digest': 'UInt64'})
+    merged = previous.merge(current, 'outer', on=['Source', route_field], suffixes=('_previous', '_current'), indicator=True)
+    changed = (merged['_merge'] != 'both') | (merged['Digest_previous'] != merged['Digest_current']).fillna(True)
+    return set(merged.loc[changed, route_field])
+
+
+def route_subset(df, routes, route_field='RTE_NM'):
+    """ Rows of df on the routes """
+    return df.loc[df[route_field].isin(routes)].reset_index(drop=True)
+
+
+def patch_routes(previous, rebuilt, routes, route_field='RTE_NM'):
+    """ The previous table with the rows of the rebuilt routes replaced by the rebuilt rows.
+    previous can be a DataFrame or the path of the previous Parquet event table """
+    if not isinstance(previous, pd.DataFrame):
+        previous = read_events_frame(previous)
+    kept = previous.loc[~previous[route_field].isin(routes)]
+    return pd.concat([kept, rebuilt[previous.columns.intersection(rebuilt.columns, sort=False)]], ignore_index=True)
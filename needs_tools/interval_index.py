@@ -0,0 +1,167 @@
+""" Route/measure interval index for looking up events by location.
+
+The events are sorted by route and from measure, and each event also stores the largest
+to measure of the events on its route up to and including it.  Both arrays are packed
+with the route so that a point or range query is two binary searches over the whole
+index, and a batch of queries is answered with one vectorized search.
+
+The sorted key arrays and the event table are saved together in one .npz file, so an
+index is loaded without sorting again and queries do not need ArcGIS or the needs layer.
+
+    index = RouteIntervalIndex.load('2023_VTrans_MidTerm_Needs_index.npz')
+    index.point('R-VA   IS00064EB', 120.5)
+    index.range('R-VA   IS00064EB', 120, 125)
+    index.batch(df_projects['RTE_NM'], df_projects['BEGIN_MSR'], df_projects['END_MSR'])
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.measures import MEASURE_SCALE, MISSING_MEASURE, to_fixed
+from needs_tools.routes import RouteCatalog
+from needs_tools.tables import read_table, to_structured_array
+
+
+DEFAULT_EVENT_PROPERTIES = 'RTE_NM LINE BEGIN_MSR END_MSR'
+
+# Field added to batch results with the position of the query each row answers
+QUERY_FIELD = 'QUERY_ID'
+
+
+class RouteIntervalIndex:
+    """ Interval index over an event table """
+
+    def __init__(self, df, event_properties=DEFAULT_EVENT_PROPERTIES, measure_scale=MEASURE_SCALE):
+        parts = event_properties.replace(';', ' ').split()
+        self.route_field, self.from_field, self.to_field = parts[0], parts[2], parts[3]
+        self.event_properties = event_properties
+        self.measure_scale = measure_scale
+
+        self.routes = RouteCatalog(df[self.route_field])
+        route = self.routes.encode(df[self.route_field]).astype(np.int64)
+        begin = to_fixed(df[self.from_field], measure_scale).astype(np.int64)
+        end = to_fixed(df[self.to_field], measure_scale).astype(np.int64)
+        low, high = np.minimum(begin, end), np.maximum(begin, end)
+        valid = np.flatnonzero((route >= 0) & (begin != MISSING_MEASURE) & (end != MISSING_MEASURE))
+
+        # Measures are shifted to start at 1 and packed below the route id, leaving 0 and
+        # span - 1 free for queries that start before or end after every event
+        self.offset = int(low[valid].min()) - 1 if len(valid) else 0
+        self.span = int(high[valid].max()) - self.offset + 2 if len(valid) else 2
+        begin_key = route[valid] * self.span + (low[valid] - self.offset)
+        order = np.argsort(begin_key, kind='stable')
+
+        self.rows = valid[order]
+        self.begin_key = begin_key[order]
+        self.end_key = (route[valid] * self.span + (high[valid] - self.offset))[order]
+        self.max_end_key = np.maximum.accumulate(self.end_key) if len(order) else self.end_key
+        self.table = df.reset_index(drop=True)
+        self._route_ids = {name: i for i, name in enumerate(self.routes.names)}
+
+    @classmethod
+    def from_table(cls, table, event_properties=DEFAULT_EVENT_PROPERTIES, fields=None, measure_scale=MEASURE_SCALE):
+        """ Builds the index from a DataFrame, CSV or geodatabase table """
+        return cls(read_table(table, fields), event_properties, measure_scale)
+
+    def save(self, path):
+        """ Saves the index arrays and the event table to an .npz file.  Text nulls are kept
+        in a mask, as the fixed width text columns can only hold empty strings """
+        null_fields = [name for name in self.table.columns
+                       if not pd.api.types.is_numeric_dtype(self.table[name])
+                       and not pd.api.types.is_datetime64_any_dtype(self.table[name])
+                       and self.table[name].isna().any()]
+        nulls = np.stack([self.table[name].isna().to_numpy() for name in null_fields], axis=1) if null_fields else np.zeros((len(self.table), 0), dtype=bool)
+        np.savez(path, table=to_structured_array(self.table), null_fields=np.array(null_fields, dtype=str), nulls=nulls,
+                 route_names=np.array(self.routes.names, dtype=str), rows=self.rows, begin_key=self.begin_key,
+                 end_key=self.end_key, max_end_key=self.max_end_key, offset=np.array(self.offset), span=np.array(self.span),
+                 event_properties=np.array(self.event_properties), measure_scale=np.array(self.measure_scale))
+
+    @classmethod
+    def load(cls, path):
+        """ Loads an index saved with save() """
+        with np.load(path) as data:
+            df = pd.DataFrame(data['table'])
+            for i, name in enumerate(data['null_fields']):
+                df[name] = df[name].astype(object).where(~data['nulls'][:, i], None)
+
+            index = cls.__new__(cls)
+            index.event_properties = str(data['event_properties'])
+            parts = index.event_properties.replace(';', ' ').split()
+            index.route_field, index.from_field, index.to_field = parts[0], parts[2], parts[3]
+            index.measure_scale = int(data['measure_scale'])
+            index.routes = RouteCatalog(data['route_names'].astype(object))
+            index.offset, index.span = int(data['offset']), int(data['span'])
+            index.rows, index.begin_key, index.end_key, index.max_end_key = data['rows'], data['begin_key'], data['end_key'], data['max_end_key']
+            index.table = df
+            index._route_ids = {name: i for i, name in enumerate(index.routes.names)}
+            return index
+
+    def _keys(self, routes, begin, end):
+        route = self.routes.encode(routes).astype(np.int64)
+        begin = to_fixed(begin, self.measure_scale).astype(np.int64) - self.offset
+        end = to_fixed(end, self.measure_scale).astype(np.int64) - self.offset
+        low, high = np.minimum(begin, end), np.maximum(begin, end)
+        # Measures beyond the indexed range are moved to its free ends so they can not match
+        # events on another route
+        low, high = np.clip(low, 0, self.span - 1), np.clip(high, 0, self.span - 1)
+        known = route >= 0
+        return known, route * self.span + low, route * self.span + high
+
+    def batch_positions(self, routes, begin, end=None):
+        """ Positions in the event table of the events found by each query.  Returns (query,
+        position) arrays.  A query with no end measure, or with the same from and to measure,
+        finds the events that contain the point, end points included.  Other queries find
+        the events that overlap the range by more than a point """
+        end = begin if end is None else end
+        known, low, high = self._keys(routes, begin, end)
+        point = low == high
+
+        # Events that start before the end of the query ...
+        last = np.where(point, np.searchsorted(self.begin_key, high, 'right'), np.searchsorted(self.begin_key, high, 'left'))
+        # ... from the first event on the route whose running to measure reaches the query
+        first = np.where(point, np.searchsorted(self.max_end_key, low, 'left'), np.searchsorted(self.max_end_key, low, 'right'))
+        counts = np.where(known, np.maximum(last - first, 0), 0)
+
+        query = np.repeat(np.arange(len(counts)), counts)
+        candidate = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+        end_key = self.end_key[candidate]
+        inside = np.where(point[query], end_key >= low[query], end_key > low[query])
+        return query[inside], self.rows[candidate[inside]]
+
+    def batch(self, routes, begin, end=None):
+        """ Events found by each query as a DataFrame with the query position in QUERY_ID """
+        query, position = self.batch_positions(pd.Series(routes, dtype=object), np.asarray(begin, dtype=np.float64),
+                                               None if end is None else np.asarray(end, dtype=np.float64))
+        df = self.table.iloc[position].reset_index(drop=True)
+        df.insert(0, QUERY_FIELD, query)
+        return df
+
+    def positions(self, route, begin, end=None):
+        """ Positions in the event table of the events found by a single query, with the same
+        rules as batch_positions.  This skips the array conversions of a batch so one lookup
+        takes a few microseconds """
+        route_id = self._route_ids.get(route)
+        if route_id is None or begin is None or begin != begin:
+            return np.zeros(0, dtype=np.int64)
+        end = begin if end is None else end
+        low = min(max(int(round(min(begin, end) * self.measure_scale)) - self.offset, 0), self.span - 1)
+        high = min(max(int(round(max(begin, end) * self.measure_scale)) - self.offset, 0), self.span - 1)
+        low, high = route_id * self.span + low, route_id * self.span + high
+
+        if low == high:
+            first = self.max_end_key.searchsorted(low, 'left')
+            last = self.begin_key.searchsorted(high, 'right')
+            inside = self.end_key[first:last] >= low
+        else:
+            first = self.max_end_key.searchsorted(low, 'right')
+            last = self.begin_key.searchsorted(high, 'left')
+            inside = self.end_key[first:last] > low
+        return self.rows[first:last][inside]
+
+    def point(self, route, measure):
+        """ Events on the route that contain the measure """
+        return self.table.iloc[self.positions(route, measure)]
+
+    def range(self, route, begin, end):
+        """ Events on the route that overlap the measures """
+        return self.table.iloc[self.positions(route, begin, end)]
@@ -0,0 +1,252 @@
+""" Memory-mapped copy of the route shapes of an LRS.
+
+The first time a stage needs the route shapes of an LRS, their vertices are read once and
+written as flat .npy arrays to .needs_cache\\lrs:
+
+    coords.npy        x, y and m of every vertex, one (n, 3) float64 array
+    offsets.npy       the single part i has the vertices offsets[i] to offsets[i + 1]
+    part_route.npy    route id of each single part
+    bounds.npy        xmin, ymin, xmax, ymax of each single part
+    route_parts.npy   route i has the single parts route_parts[i] to route_parts[i + 1]
+    routes.json       route names in id order (sorted by name) and where they came from
+
+Later reads open the arrays with numpy memory mapping, so they take no time and every
+stage and worker process shares the one copy the operating system keeps in memory.  The
+copy is made again when the size or modification time of a file of the LRS changes.
+A copy projected to another coordinate system is kept separately from the LRS's own.
+
+    geometry = lrs_geometry(LRS)
+    coords, offsets, route_names = geometry.route_vertices()
+
+    python -m needs_tools.lrs_cache <LRS>    make the copy ahead of a run
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.spatial import read_shapes
+from needs_tools.stage_cache import dataset_files
+from needs_tools.storage import split_geopackage_path
+
+
+CACHE_DIR = os.environ.get('NEEDS_LRS_CACHE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.needs_cache', 'lrs'))
+
+ARRAYS = ['coords', 'offsets', 'part_route', 'bounds', 'route_parts']
+
+
+def line_vertices(lines):
+    """ (coords, offsets, line) of M-aware shapely lines.  coords is an (n, 3) array of the
+    x, y and m of every vertex, the single part i has the vertices offsets[i] to
+    offsets[i + 1], and line is the position of each single part's line """
+    import shapely
+
+    lines = np.asarray(lines, dtype=object)
+    if len(lines) and not shapely.has_m(lines[~shapely.is_missing(lines)]).all():
+        raise Exception('Route shapes must have M values')
+    parts, line = shapely.get_parts(lines, return_index=True)
+    coords, part = shapely.get_coordinates(parts, include_m=True, return_index=True)
+    offsets = np.searchsorted(part, np.arange(len(parts) + 1))
+    return coords, offsets, line
+
+
+def _json_vertices(shapes):
+    """ (coords, offsets, line) from Esri JSON polylines, which keep their M values """
+    coords, offsets, line = [], [0], []
+    for i, text in enumerate(shapes):
+        if text is None:
+            continue
+        shape = json.loads(text)
+        if not shape.get('hasM'):
+            raise Exception('Route shapes must have M values')
+        m_index = 3 if shape.get('hasZ') else 2
+        for path in shape.get('paths', []):
+            vertices = np.array([[vertex[0], vertex[1], vertex[m_index]] for vertex in path], dtype=np.float64)
+            coords.append(vertices)
+            offsets.append(offsets[-1] + len(vertices))
+            line.append(i)
+    coords = np.concatenate(coords) if coords else np.zeros((0, 3))
+    return coords, np.array(offsets, dtype=np.int64), np.array(line, dtype=np.int64)
+
+
+def read_route_vertices(lrs, route_field='RTE_NM', spatial_reference=None, where_clause=None):
+    """ (coords, offsets, route names) of the single parts of the routes in an LRS feature
+    class, see line_vertices """
+    if split_geopackage_path(lrs) is not None:
+        shapes, df = read_shapes(lrs, [route_field], where_clause=where_clause)
+        coords, offsets, line = line_vertices(shapes)
+    else:
+        import arcpy
+
+        # The shapes are read as JSON, which always has the M values
+        rows = [row for row in arcpy.da.SearchCursor(lrs, [route_field, 'SHAPE@JSON'], where_clause, spatial_reference)]
+        df = pd.DataFrame([row[:1] for row in rows], columns=[route_field])
+        coords, offsets, line = _json_vertices([row[1] for row in rows])
+    return coords, offsets, df[route_field].to_numpy(dtype=object)[line]
+
+
+def _reference_code(spatial_reference):
+    """ Factory code of an arcpy spatial reference, or 'native' for the LRS's own """
+    if spatial_reference is None:
+        return 'native'
+    return str(spatial_reference.factoryCode or spatial_reference.name)
+
+
+def _signature(lrs, route_field, spatial_reference=None):
+    """ Source, route field, coordinate system and the size and modification time of each
+    file of the LRS """
+    geopackage = split_geopackage_path(lrs)
+    files = [[file, os.path.getsize(file), os.stat(file).st_mtime_ns] for file in dataset_files(lrs if geopackage is None else geopackage[0])]
+    return {'lrs': os.path.abspath(str(lrs)), 'route_field': route_field, 'spatial_reference': _reference_code(spatial_reference), 'files': files}
+
+
+def _folder(lrs, route_field, signature, cache_dir):
+    key = hashlib.blake2b(json.dumps(signature, sort_keys=True).encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f'{_prefix(lrs, route_field, signature["spatial_reference"])}{key}')
+
+
+def _prefix(lrs, route_field, reference_code):
+    name = os.path.basename(str(lrs).rstrip('\\/'))
+    return f'{name}-{route_field}-{reference_code}-'
+
+
+def _ranges(starts, counts):
+    """ starts[0], ..., starts[0] + counts[0] - 1, starts[1], ... """
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.repeat(starts, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+
+def export_lrs_geometry(lrs, folder, route_field='RTE_NM', signature=None, spatial_reference=None):
+    """ Reads the route shapes of the LRS, projected to spatial_reference if one is given,
+    and writes them to the arrays in the folder """
+    print(f'Copying the route shapes of {lrs} to {folder}')
+    coords, offsets, part_names = read_route_vertices(lrs, route_field, spatial_reference)
+
+    # Single parts are put in route order, so the parts of each route are together
+    names = pd.Series(part_names, dtype=object)
+    route_names = np.sort(names.dropna().unique().astype(str)).astype(object)
+    part_route = pd.Index(route_names).get_indexer(names)
+    keep = np.flatnonzero(part_route >= 0)
+    order = keep[np.argsort(part_route[keep], kind='stable')]
+    counts = np.diff(offsets)[order]
+    vertex = _ranges(offsets[order], counts)
+    coords = np.ascontiguousarray(coords[vertex], dtype=np.float64)
+    offsets = np.append(0, np.cumsum(counts)).astype(np.int64)
+    part_route = part_route[order].astype(np.int32)
+
+    bounds = np.full((len(order), 4), np.nan)
+    filled = np.flatnonzero(counts > 0)
+    if len(filled):
+        bounds[filled, :2] = np.minimum.reduceat(coords[:, :2], offsets[filled], axis=0)
+        bounds[filled, 2:] = np.maximum.reduceat(coords[:, :2], offsets[filled], axis=0)
+    route_parts = np.searchsorted(part_route, np.arange(len(route_names) + 1)).astype(np.int64)
+
+    partial = f'{folder}.partial-{os.getpid()}'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    arrays = {'coords': coords, 'offsets': offsets, 'part_route': part_route, 'bounds': bounds, 'route_parts': route_parts}
+    for name in ARRAYS:
+        np.save(os.path.join(partial, f'{name}.npy'), arrays[name])
+    with open(os.path.join(partial, 'routes.json'), 'w') as f:
+        json.dump({'names': route_names.tolist(), 'signature': signature or _signature(lrs, route_field, spatial_reference)}, f)
+
+    # Another process may have made the same copy at the same time, in which case it is used
+    try:
+        os.replace(partial, folder)
+    except OSError:
+        if not os.path.exists(os.path.join(folder, 'routes.json')):
+            raise
+        shutil.rmtree(partial, ignore_errors=True)
+    return folder
+
+
+class LRSGeometry:
+    """ Route shapes of an LRS read from the memory-mapped arrays in a folder """
+
+    def __init__(self, folder):
+        self.folder = folder
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r'))
+        with open(os.path.join(folder, 'routes.json')) as f:
+            self.names = np.array(json.load(f)['names'], dtype=object)
+        self._index = pd.Index(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def route_ids(self, names):
+        """ Id of each route name, or -1 for routes not in the LRS """
+        return self._index.get_indexer(pd.Series(names, dtype=object))
+
+    def parts(self, routes=None):
+        """ Single parts of the routes, or all of them """
+        if routes is None:
+            return np.arange(len(self.part_route))
+        ids = self.route_ids(routes)
+        ids = np.unique(ids[ids >= 0])
+        first, last = self.route_parts[ids], self.route_parts[ids + 1]
+        return _ranges(first, last - first)
+
+    def route_vertices(self, routes=None):
+        """ (coords, offsets, route names) of the single parts of the routes, or of all of
+        them, as read_route_vertices returns.  All of the routes are returned without
+        copying the vertices """
+        if routes is None:
+            return self.coords, self.offsets, self.names[self.part_route]
+        parts = self.parts(routes)
+        counts = self.offsets[parts + 1] - self.offsets[parts]
+        vertex = _ranges(self.offsets[parts], counts)
+        return self.coords[vertex], np.append(0, np.cumsum(counts)).astype(np.int64), self.names[self.part_route[parts]]
+
+    def bbox(self, xmin, ymin, xmax, ymax):
+        """ Names of the routes with a single part whose extent overlaps the box """
+        bounds = self.bounds
+        overlaps = (bounds[:, 0] <= xmax) & (bounds[:, 2] >= xmin) & (bounds[:, 1] <= ymax) & (bounds[:, 3] >= ymin)
+        return self.names[np.unique(self.part_route[overlaps])]
+
+
+def lrs_geometry(lrs, route_field='RTE_NM', cache_dir=CACHE_DIR, spatial_reference=None):
+    """ LRSGeometry of the LRS, copying its route shapes to the cache first if they are not
+    there or the LRS has changed since.  With an arcpy spatial_reference the shapes are
+    projected to it.  GeoPackage tables are not projected """
+    signature = _signature(lrs, route_field, spatial_reference)
+    folder = _folder(lrs, route_field, signature, cache_dir)
+    if not os.path.exists(os.path.join(folder, 'routes.json')):
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Copies of older versions of the LRS are deleted.  Copies open in another process
+        # are left for the next run
+        prefix = _prefix(lrs, route_field, signature['spatial_reference'])
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and '.partial' not in name and os.path.join(cache_dir, name) != folder:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        export_lrs_geometry(lrs, folder, route_field, signature, spatial_reference)
+    return LRSGeometry(folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m needs_tools.lrs_cache',
+                                     description='Copies the route shapes of an LRS to memory-mapped arrays')
+    parser.add_argument('lrs', nargs='+', help='LRS feature classes')
+    parser.add_argument('--route-field', default='RTE_NM', help='route name field')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='folder of the copies (NEEDS_LRS_CACHE)')
+    parser.add_argument('--spatial-reference', type=int, help='factory code of a coordinate system to project to, e.g. 3969')
+    args = parser.parse_args(argv)
+
+    spatial_reference = None
+    if args.spatial_reference is not None:
+        import arcpy
+
+        spatial_reference = arcpy.SpatialReference(args.spatial_reference)
+    for lrs in args.lrs:
+        geometry = lrs_geometry(lrs, args.route_field, args.cache_dir, spatial_reference)
+        print(f'{lrs}: {len(geometry)} routes, {len(geometry.part_route)} parts, {len(geometry.coords)} vertices in {geometry.folder}')
+
+
+if __name__ == '__main__':
+    main()
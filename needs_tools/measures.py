@@ -0,0 +1,36 @@
+""" Fixed-point route measures.
+
+Measures are stored and compared as integer counts of a fixed fraction of a mile, so
+that events from different tables line up exactly and no rounding is needed before an
+overlay.  Measures are only turned back into miles when a table is written.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Thousandths of a mile (about 5 feet)
+MEASURE_SCALE = 1000
+
+# Hundredths of a mile, the precision of the final needs layer
+FINAL_MEASURE_SCALE = 100
+
+# Stored in place of a missing measure
+MISSING_MEASURE = np.iinfo(np.int32).min
+
+
+def to_fixed(values, scale=MEASURE_SCALE):
+    """ Converts measures in miles to int32 fixed-point measures.  Missing or non-numeric
+    measures become MISSING_MEASURE """
+    miles = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    fixed = np.rint(miles * scale)
+    limit = np.iinfo(np.int32).max
+    if np.nanmax(np.abs(fixed), initial=0) > limit:
+        raise Exception(f'Measures are too large to store in {1 / scale} mile units')
+    return np.where(np.isnan(fixed), MISSING_MEASURE, fixed).astype(np.int32)
+
+
+def to_miles(fixed, scale=MEASURE_SCALE):
+    """ Converts fixed-point measures back to miles, with NaN for missing measures """
+    fixed = np.asarray(fixed)
+    return np.where(fixed == MISSING_MEASURE, np.nan, fixed / scale)
@@ -0,0 +1,192 @@
+""" Route measures of the stretches of routes within a network distance of sources.
+
+The bike and walk sheds of distance_measures.py are straight-line radii, which reach
+across rivers and limited access roads.  Here the distance is measured along the roads
+instead.  The route vertices are the nodes of a graph and the segments between them are
+its edges.  Routes meet where they share a vertex, so bridges and overpasses that cross
+a road without one are not junctions.  Stretches of the barrier events, such as the
+limited access routes, are left out of the graph.
+
+Every source point is joined to the ends of its nearest segment, as far as the straight
+line to the segment and then along it, vertices inside source polygons are at no
+distance, and all of them hang off one extra node.  A single Dijkstra run from that
+node, stopped at the distance, gives every vertex its distance from the nearest source.
+A segment is within the distance from each end for as far as that end's distance leaves
+room for, and from each source point joined to it for as far either way along it.
+
+    df = network_route_events(lrs, [activity_centers, gtfs_stops], 7 * METERS_PER_MILE,
+                              arcpy.SpatialReference(3969), barriers=tbl_limited_access,
+                              barrier_properties='RTE_NM LINE RTE_FROM_MSR RTE_TO_MSR')
+
+shapely 2 and scipy are required and are imported when these functions are called.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.distance_measures import RELATIVE_TOLERANCE, source_points
+from needs_tools.interval_index import RouteIntervalIndex
+from needs_tools.lrs_cache import lrs_geometry
+from needs_tools.polygon_measures import JOIN_TOLERANCE, join_runs, source_shapes
+from needs_tools.storage import split_geopackage_path
+from needs_tools.trace import traced
+
+
+# Smallest edge weight.  Dijkstra in scipy does not follow edges of no weight
+MIN_WEIGHT = 1e-9
+
+
+def graph_nodes(coords, snap):
+    """ Node of each vertex.  Vertices on the same point of a grid snap across share a node """
+    if len(coords) == 0:
+        return np.zeros(0, dtype=np.int64)
+    key = np.round(coords[:, :2] / snap).astype(np.int64)
+    key -= key.min(axis=0)
+    return np.unique(key[:, 0] * (key[:, 1].max() + 1) + key[:, 1], return_inverse=True)[1].ravel()
+
+
+def route_edges(coords, offsets, node, blocked=None):
+    """ (start, length) of the segments between consecutive vertices of a single part that
+    join two different nodes, without the blocked ones.  blocked has one flag per
+    segment start vertex """
+    part_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    start = np.flatnonzero((part_of_vertex[:-1] == part_of_vertex[1:]) & (node[:-1] != node[1:])) if len(coords) else np.zeros(0, dtype=np.int64)
+    if blocked is not None:
+        start = start[~blocked[start]]
+    step = coords[start + 1, :2] - coords[start, :2]
+    return start, np.hypot(step[:, 0], step[:, 1])
+
+
+def blocked_vertices(route_names, coords, offsets, barriers, barrier_properties):
+    """ Flag for each vertex of whether the segment that starts there is on an event of the
+    barriers table """
+    index = RouteIntervalIndex.from_table(barriers, barrier_properties)
+    part_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    start = np.flatnonzero(part_of_vertex[:-1] == part_of_vertex[1:]) if len(coords) else np.zeros(0, dtype=np.int64)
+    middle = (coords[start, 2] + coords[start + 1, 2]) / 2
+    query = index.batch_positions(pd.Series(np.asarray(route_names, dtype=object)[part_of_vertex[start]], dtype=object), middle)[0]
+    blocked = np.zeros(len(coords), dtype=bool)
+    blocked[start[np.unique(query)]] = True
+    return blocked
+
+
+def network_distances(node, start, length, seed_nodes, seed_costs, distance):
+    """ Distance of each node from the nearest seed along the edges, inf beyond distance """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    nodes = int(node.max()) + 1 if len(node) else 0
+
+    # The extra node, numbered nodes, is joined to every seed.  Routes that run over the
+    # same vertices give the same edge more than once, as do sources near the same edge,
+    # and the sparse matrix would add their weights, so only the shortest of each is kept
+    a = np.concatenate([node[start], seed_nodes])
+    b = np.concatenate([node[start + 1], np.full(len(seed_nodes), nodes)])
+    weight = np.concatenate([length, seed_costs])
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    order = np.lexsort((weight, high, low))
+    low, high, weight = low[order], high[order], weight[order]
+    first = np.ones(len(low), dtype=bool)
+    first[1:] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+
+    weights = np.maximum(weight[first], MIN_WEIGHT)
+    graph = coo_matrix((weights, (low[first], high[first])), shape=(nodes + 1, nodes + 1)).tocsr()
+    return dijkstra(graph, directed=False, indices=nodes, limit=distance)[:nodes]
+
+
+def network_measure_arrays(coords, offsets, points, distance, polygons=(), blocked=None, snap=None, join_tolerance=JOIN_TOLERANCE):
+    """ (part, begin, end) of every stretch of the single parts within the network distance
+    of the points (x, y) and polygons, sorted by part and begin.  coords and offsets are
+    the vertices from needs_tools.lrs_cache.line_vertices, and blocked is the flag of each
+    vertex from blocked_vertices """
+    import shapely
+
+    snap = distance * RELATIVE_TOLERANCE if snap is None else snap
+    node = graph_nodes(coords, snap)
+    start, length = route_edges(coords, offsets, node, blocked)
+
+    # Each source point is joined to both ends of its nearest edge, by the straight line to
+    # the edge and then along it.  Barriers are not edges, so nothing is joined to them
+    x, y = np.asarray(points[0], dtype=np.float64), np.asarray(points[1], dtype=np.float64)
+    seed_nodes, seed_costs = np.zeros(0, dtype=np.int64), np.zeros(0)
+    edge, gap, along = np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    if len(x) and len(start):
+        segments = shapely.linestrings(np.stack([coords[start, :2], coords[start + 1, :2]], axis=1))
+        (point, edge), gap = shapely.STRtree(segments).query_nearest(shapely.points(x, y), max_distance=distance, return_distance=True, all_matches=False)
+        along = shapely.line_locate_point(segments[edge], shapely.points(x[point], y[point]))
+        seed_nodes = np.concatenate([node[start[edge]], node[start[edge] + 1]])
+        seed_costs = np.concatenate([gap + along, gap + length[edge] - along])
+
+    polygons = np.asarray(polygons, dtype=object)
+    polygons = polygons[~shapely.is_missing(polygons)]
+    if len(polygons) and len(start):
+        used = np.unique(np.concatenate([start, start + 1]))
+        vertex = shapely.STRtree(polygons).query(shapely.points(coords[used, :2]), predicate='intersects')[0]
+        inside = np.unique(node[used[vertex]])
+        seed_nodes = np.concatenate([seed_nodes, inside])
+        seed_costs = np.concatenate([seed_costs, np.zeros(len(inside))])
+
+    reach = network_distances(node, start, length, seed_nodes, seed_costs, distance)
+
+    # Each edge is within the distance for as far from each end as that end's distance
+    # leaves room for, and for as far either way from each source point joined to it as
+    # the straight line from the point leaves room for
+    d0, d1 = reach[node[start]], reach[node[start + 1]]
+    ahead = np.flatnonzero(d0 <= distance)
+    behind = np.flatnonzero(d1 <= distance)
+    left = distance - gap
+    low = np.concatenate([np.zeros(len(ahead)), 1 - np.minimum((distance - d1[behind]) / length[behind], 1),
+                          np.maximum((along - left) / length[edge], 0)])
+    high = np.concatenate([np.minimum((distance - d0[ahead]) / length[ahead], 1), np.ones(len(behind)),
+                           np.minimum((along + left) / length[edge], 1)])
+    edge = start[np.concatenate([ahead, behind, edge])]
+
+    # M values at the ends of each stretch
+    m0, m1 = coords[edge, 2], coords[edge + 1, 2]
+    begin = m0 + low * (m1 - m0)
+    end = m0 + high * (m1 - m0)
+    begin, end = np.minimum(begin, end), np.maximum(begin, end)
+    part_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return join_runs(part_of_vertex[edge], begin, end, join_tolerance)
+
+
+@traced()
+def network_route_events(lrs, sources, distance, spatial_reference=None, barriers=None, barrier_properties='RTE_NM LINE BEGIN_MSR END_MSR',
+                         route_field='RTE_NM', snap=None):
+    """ Events of the stretches of the LRS routes within the network distance of the
+    sources, with the fields RTE_NM, BEGIN_MSR and END_MSR.
+
+    sources is a feature class or an array of shapely geometries, or a list of them.
+    barriers is an event table of stretches that can not be travelled along.  The distance
+    and snap are in the units of spatial_reference, which the LRS and the feature classes
+    are projected to (the LRS's coordinate system by default).  Vertices closer than snap
+    are the same node, RELATIVE_TOLERANCE of the distance by default.
+    """
+    import shapely
+
+    source_reference = spatial_reference
+    if split_geopackage_path(lrs) is None and source_reference is None:
+        import arcpy
+
+        source_reference = arcpy.Describe(lrs).spatialReference
+
+    # The routes are read from their memory-mapped copy, see needs_tools/lrs_cache.py
+    coords, offsets, route_names = lrs_geometry(lrs, route_field, spatial_reference=spatial_reference).route_vertices()
+    shapes = [source_shapes(source, source_reference) for source in (sources if isinstance(sources, list) else [sources])]
+    shapes = np.concatenate(shapes) if shapes else np.zeros(0, dtype=object)
+    shapes = shapes[~shapely.is_missing(shapes)]
+
+    blocked = None
+    if barriers is not None:
+        blocked = blocked_vertices(route_names, coords, offsets, barriers, barrier_properties)
+
+    # Points along the outlines of polygons join them to the roads that leave them
+    points = source_points(shapes, np.sqrt(8 * RELATIVE_TOLERANCE) * distance)
+    polygons = shapes[np.isin(shapely.get_type_id(shapes), [3, 6])]
+    part, begin, end = network_measure_arrays(coords, offsets, points, distance, polygons, blocked, snap)
+
+    return pd.DataFrame({
+        route_field: pd.Series(np.asarray(route_names, dtype=object)[part], dtype=object),
+        'BEGIN_MSR': begin,
+        'END_MSR': end
+    })
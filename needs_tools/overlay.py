@@ -0,0 +1,541 @@
+""" In-process replacement for arcpy.lr.OverlayRouteEvents.
+
+Line events are overlaid on sorted per-route breakpoint arrays with NumPy.  Every
+from and to measure becomes a breakpoint, the breakpoints split each route into
+pieces, and each output event is a run of consecutive pieces covered by the same
+combination of input events.  Any number of tables can be overlaid in one pass, so
+the cost grows with the total number of events rather than with the number of
+tables.  Nothing is written to disk unless an output table is given, and ArcGIS is
+only needed to read or write geodatabase tables.
+
+Measures are compared as fixed-point integers (see needs_tools.measures), so events
+that meet in miles meet exactly and no rounding pass is needed beforehand.
+
+The route table functions can split their work by route across worker processes, see
+needs_tools.shards.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.measures import MEASURE_SCALE, MISSING_MEASURE, to_fixed, to_miles
+from needs_tools.shards import map_routes
+from needs_tools.tables import read_table, write_table
+from needs_tools.trace import traced
+
+
+DEFAULT_EVENT_PROPERTIES = 'RTE_NM LINE BEGIN_MSR END_MSR'
+
+
+def parse_event_properties(event_properties):
+    """ Splits event properties such as 'RTE_NM; LINE; BEGIN_MSR; END_MSR' into
+    (route field, from measure field, to measure field) """
+    parts = event_properties.replace(';', ' ').split()
+    if len(parts) != 4 or parts[1].upper() != 'LINE':
+        raise Exception(f'Only line event properties are supported: {event_properties}')
+    return parts[0], parts[2], parts[3]
+
+
+def breakpoints(routes, begin, end):
+    """ Sorts the fixed-point from and to measures of all events into unique (route, measure)
+    breakpoints.
+
+    Returns (bp_routes, bp_measures, start, stop) where start and stop are the breakpoint ids
+    of each event's from and to measures.  Piece i runs from breakpoint i to breakpoint i + 1,
+    so an event covers pieces start to stop - 1.
+    """
+    n = len(routes)
+    all_routes = np.concatenate([routes, routes]).astype(np.int64)
+    all_measures = np.concatenate([begin, end]).astype(np.int64)
+    if n:
+        # Route and measure packed into one integer key so a single argsort orders both
+        low = all_measures.min()
+        span = int(all_measures.max() - low) + 1
+        key = all_routes * span + (all_measures - low)
+        order = np.argsort(key)
+        sorted_key = key[order]
+    else:
+        order = np.zeros(0, dtype=np.int64)
+        sorted_key = order
+    sorted_routes = all_routes[order]
+    sorted_measures = all_measures[order]
+
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = sorted_key[1:] != sorted_key[:-1]
+    ids = np.empty(len(order), dtype=np.int64)
+    ids[order] = np.cumsum(new) - 1
+
+    return sorted_routes[new], sorted_measures[new], ids[:n], ids[n:]
+
+
+def expand_pieces(start, stop):
+    """ Returns (event, piece) for every piece covered by every event """
+    counts = stop - start
+    offsets = np.cumsum(counts) - counts
+    event = np.repeat(np.arange(len(start)), counts)
+    piece = np.arange(counts.sum()) - np.repeat(offsets - start, counts)
+    return event, piece
+
+
+def _kth_event(sorted_events, first, count, piece, k):
+    """ The k-th event covering each piece, or -1 where the piece is not covered """
+    if len(sorted_events) == 0:
+        return np.full(len(piece), -1, dtype=np.int64)
+    position = np.minimum(first[piece] + k, len(sorted_events) - 1)
+    return np.where(count[piece] > 0, sorted_events[position], -1)
+
+
+def _valid_events(routes, begin, end):
+    """ Drops events without a route or measure and orders each event's measures low to high """
+    routes = np.asarray(routes, dtype=np.int64)
+    begin = np.asarray(begin, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    valid = (routes >= 0) & (begin != MISSING_MEASURE) & (end != MISSING_MEASURE)
+    ids = np.flatnonzero(valid)
+    begin, end = begin[valid], end[valid]
+    return ids, routes[valid], np.minimum(begin, end), np.maximum(begin, end)
+
+
+def _point_matches(point_routes, point_measures, routes, low, high):
+    """ Pairs each point with the events on its route that contain it, end points included """
+    points = pd.DataFrame({'route': point_routes, 'point': np.arange(len(point_routes))})
+    events = pd.DataFrame({'route': routes, 'event': np.arange(len(routes))})
+    pairs = points.merge(events, on='route')
+    point = pairs['point'].to_numpy(dtype=np.int64)
+    event = pairs['event'].to_numpy(dtype=np.int64)
+    inside = (low[event] <= point_measures[point]) & (point_measures[point] <= high[event])
+    return point[inside], event[inside]
+
+
+def _touching(in_routes, in_measures, ov_routes, ov_measures):
+    """ Pairs of events where a measure of one equals a measure of the other on the same route """
+    a = pd.DataFrame({'route': in_routes, 'measure': in_measures, 'in': np.arange(len(in_routes))})
+    b = pd.DataFrame({'route': ov_routes, 'measure': ov_measures, 'ov': np.arange(len(ov_routes))})
+    pairs = a.merge(b, on=['route', 'measure'])
+    return pairs['in'].to_numpy(dtype=np.int64), pairs['ov'].to_numpy(dtype=np.int64)
+
+
+def _zero_length(in_routes, in_low, in_high, ov_routes, ov_low, ov_high, union):
+    """ Zero-length output events written when zero_length_events is 'ZERO'.
+
+    Zero-length input events are paired with the events of the other table that contain
+    them (or written alone for a UNION).  For an INTERSECT, line events that only touch
+    at an end point also produce a zero-length event at that point.
+    """
+    in_zero = np.flatnonzero(in_low == in_high)
+    ov_zero = np.flatnonzero(ov_low == ov_high)
+    in_line = np.flatnonzero(in_low < in_high)
+    ov_line = np.flatnonzero(ov_low < ov_high)
+    parts = []
+
+    # Zero-length input events with any overlay events containing them
+    point, event = _point_matches(in_routes[in_zero], in_low[in_zero], ov_routes, ov_low, ov_high)
+    parts.append((in_zero[point], event, in_low[in_zero[point]]))
+    ov_matched = np.zeros(len(ov_routes), dtype=bool)
+    ov_matched[event] = True
+    if union:
+        unmatched = in_zero[np.setdiff1d(np.arange(len(in_zero)), point)]
+        parts.append((unmatched, np.full(len(unmatched), -1), in_low[unmatched]))
+
+    # Zero-length overlay events inside input line events
+    point, event = _point_matches(ov_routes[ov_zero], ov_low[ov_zero], in_routes[in_line], in_low[in_line], in_high[in_line])
+    parts.append((in_line[event], ov_zero[point], ov_low[ov_zero[point]]))
+    ov_matched[ov_zero[point]] = True
+    if union:
+        unmatched = ov_zero[~ov_matched[ov_zero]]
+        parts.append((np.full(len(unmatched), -1), unmatched, ov_low[unmatched]))
+    else:
+        # Line events that touch end to end
+        for in_measures, ov_measures in ((in_high, ov_low), (in_low, ov_high)):
+            a, b = _touching(in_routes[in_line], in_measures[in_line], ov_routes[ov_line], ov_measures[ov_line])
+            parts.append((in_line[a], ov_line[b], in_measures[in_line[a]]))
+
+    in_idx = np.concatenate([np.asarray(a, dtype=np.int64) for a, _, _ in parts])
+    ov_idx = np.concatenate([np.asarray(b, dtype=np.int64) for _, b, _ in parts])
+    zero_measures = np.concatenate([np.asarray(m, dtype=np.int64) for _, _, m in parts])
+    routes = np.where(in_idx >= 0, in_routes[np.maximum(in_idx, 0)] if len(in_routes) else -1,
+                      ov_routes[np.maximum(ov_idx, 0)] if len(ov_routes) else -1)
+    return routes, zero_measures, in_idx, ov_idx
+
+
+def _next_covered(count):
+    """ For each piece, the first piece at or after it covered by at least one event """
+    n = len(count)
+    covered = np.where(count > 0, np.arange(n), n)
+    return np.minimum.accumulate(covered[::-1])[::-1]
+
+
+def _check_overlay_type(overlay_type):
+    overlay_type = overlay_type.upper()
+    if overlay_type not in ('UNION', 'INTERSECT'):
+        raise Exception(f'Unsupported overlay type: {overlay_type}')
+    return overlay_type
+
+
+def _overlay_valid(routes, lows, highs, union):
+    """ Overlays tables of valid events.  Returns (routes, begin, end, idx) where idx has one
+    array per table with positions in that table's arrays, or -1 """
+    sizes = [len(r) for r in routes]
+    offsets = np.cumsum(sizes) - sizes
+    bp_routes, bp_measures, start, stop = breakpoints(np.concatenate(routes), np.concatenate(lows), np.concatenate(highs))
+    n_pieces = len(bp_measures)
+
+    # Events covering each piece, grouped by table then piece
+    event, piece = expand_pieces(start, stop)
+    table = np.repeat(np.arange(len(sizes)), sizes)[event]
+    order = np.argsort(table * n_pieces + piece, kind='stable')
+    event, piece, table = event[order], piece[order], table[order]
+    bounds = np.searchsorted(table, np.arange(len(sizes) + 1))
+    coverage = []
+    for i in range(len(sizes)):
+        table_events = event[bounds[i]:bounds[i + 1]] - offsets[i]
+        count = np.bincount(piece[bounds[i]:bounds[i + 1]], minlength=n_pieces)
+        coverage.append((table_events, np.cumsum(count) - count, count))
+
+    # One row per piece for every combination of covering events
+    covered = np.array([count > 0 for _, _, count in coverage]).reshape(len(sizes), n_pieces)
+    keep = covered.any(axis=0) if union else covered.all(axis=0)
+    rows = np.where(keep, np.prod([np.maximum(count, 1) for _, _, count in coverage], axis=0), 0)
+    row_piece = np.repeat(np.arange(n_pieces), rows)
+    k = np.arange(len(row_piece)) - np.repeat(np.cumsum(rows) - rows, rows)
+    row_events = []
+    for table_events, first, count in coverage:
+        radix = np.maximum(count, 1)[row_piece]
+        row_events.append(_kth_event(table_events, first, count, row_piece, k % radix))
+        k = k // radix
+
+    # Keep only the piece where each run of the same combination of events begins.  A row
+    # continues the previous piece if each of its events started before this piece and
+    # each table it is not covered by also did not cover the previous piece
+    previous = np.maximum(row_piece - 1, 0)
+    continues = np.ones(len(row_piece), dtype=bool)
+    for (_, _, count), row_event, offset in zip(coverage, row_events, offsets):
+        event_start = start[np.minimum(offset + np.maximum(row_event, 0), len(start) - 1)] if len(start) else row_piece
+        continues &= np.where(row_event >= 0, event_start < row_piece, count[previous] == 0)
+    run_start = ~continues
+    row_piece = row_piece[run_start]
+    row_events = [row_event[run_start] for row_event in row_events]
+
+    # A run ends where one of its events ends or where another table next covers the route
+    run_stop = np.full(len(row_piece), n_pieces, dtype=np.int64)
+    for (_, _, count), row_event, offset in zip(coverage, row_events, offsets):
+        event_stop = stop[np.minimum(offset + np.maximum(row_event, 0), len(stop) - 1)] if len(stop) else row_piece
+        run_stop = np.minimum(run_stop, np.where(row_event >= 0, event_stop, _next_covered(count)[row_piece]))
+
+    return bp_routes[row_piece], bp_measures[row_piece], bp_measures[run_stop], row_events
+
+
+def overlay_many_arrays(routes, begins, ends, overlay_type='UNION'):
+    """ Overlays any number of tables of line events in a single pass.
+
+    routes, begins and ends are lists with one array per table of integer route codes and
+    fixed-point measures.  Returns (routes, begin, end, idx) sorted by route and from measure, where idx
+    is a list with one array per table of the positions of the source events, or -1 where
+    the output event is not covered by that table.  A UNION keeps every piece covered by at
+    least one table and an INTERSECT only the pieces covered by all tables.  Zero-length
+    events are not written.
+    """
+    union = _check_overlay_type(overlay_type) == 'UNION'
+    valid = [_valid_events(r, b, e) for r, b, e in zip(routes, begins, ends)]
+    out_routes, out_begin, out_end, idx = _overlay_valid(
+        [v[1] for v in valid], [v[2] for v in valid], [v[3] for v in valid], union)
+    idx = [np.where(i >= 0, ids[np.maximum(i, 0)] if len(ids) else -1, -1) for i, (ids, _, _, _) in zip(idx, valid)]
+    return out_routes, out_begin, out_end, idx
+
+
+def overlay_arrays(in_routes, in_begin, in_end, ov_routes, ov_begin, ov_end, overlay_type='UNION', zero_length_events='ZERO'):
+    """ Overlays two sets of line events given as integer route codes and fixed-point measures.
+
+    Returns (routes, begin, end, in_idx, ov_idx) sorted by route and from measure.  in_idx and
+    ov_idx are the positions of the source events in the input arrays, or -1 where the
+    output event is not covered by that table.  Events with a negative route code or a
+    missing measure are ignored.
+    """
+    union = _check_overlay_type(overlay_type) == 'UNION'
+    in_ids, in_routes, in_low, in_high = _valid_events(in_routes, in_begin, in_end)
+    ov_ids, ov_routes, ov_low, ov_high = _valid_events(ov_routes, ov_begin, ov_end)
+    out_routes, out_begin, out_end, (out_in, out_ov) = _overlay_valid(
+        [in_routes, ov_routes], [in_low, ov_low], [in_high, ov_high], union)
+
+    if zero_length_events.upper() == 'ZERO':
+        z_routes, z_measures, z_in, z_ov = _zero_length(in_routes, in_low, in_high, ov_routes, ov_low, ov_high, union)
+        out_routes = np.concatenate([out_routes, z_routes])
+        out_begin = np.concatenate([out_begin, z_measures])
+        out_end = np.concatenate([out_end, z_measures])
+        out_in = np.concatenate([out_in, z_in])
+        out_ov = np.concatenate([out_ov, z_ov])
+        order = np.lexsort((out_end, out_begin, out_routes))
+        out_routes, out_begin, out_end, out_in, out_ov = out_routes[order], out_begin[order], out_end[order], out_in[order], out_ov[order]
+
+    # Back to positions in the original inputs
+    out_in = np.where(out_in >= 0, in_ids[np.maximum(out_in, 0)] if len(in_ids) else -1, -1)
+    out_ov = np.where(out_ov >= 0, ov_ids[np.maximum(out_ov, 0)] if len(ov_ids) else -1, -1)
+    return out_routes, out_begin, out_end, out_in, out_ov
+
+
+def fill_value(series):
+    """ Value arcpy writes to a field when an output event is not covered by its table """
+    if pd.api.types.is_bool_dtype(series):
+        return False
+    if pd.api.types.is_numeric_dtype(series):
+        return 0
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.NaT
+    return ''
+
+
+def take_rows(series, idx):
+    """ Values of the series at positions idx, filled with fill_value where idx is -1 """
+    missing = idx < 0
+    if len(series) == 0:
+        # The fill values keep the series' dtype, so shards with and without rows of the
+        # table give the same schema
+        return pd.Series([fill_value(series)] * len(idx), dtype=series.dtype)
+    values = series.iloc[np.where(missing, 0, idx)].reset_index(drop=True)
+    if missing.any():
+        values = values.where(~missing, fill_value(series))
+    return values
+
+
+def unique_name(name, taken):
+    """ Adds _1, _2, ... to a field name until it does not clash with the names in taken """
+    new_name = name
+    n = 0
+    while new_name in taken:
+        n += 1
+        new_name = f'{name}_{n}'
+    taken.add(new_name)
+    return new_name
+
+
+def route_codes(*route_columns):
+    """ Encodes the route names of one or more columns as shared integer codes sorted by name.
+    Returns a code array for each column and the route names.  Columns that already hold
+    route catalog ids are used as they are and the route names are None """
+    if route_columns and all(pd.api.types.is_integer_dtype(col) for col in route_columns):
+        return [np.asarray(col, dtype=np.int64) for col in route_columns], None
+    sizes = [len(col) for col in route_columns]
+    codes, names = pd.factorize(pd.concat([pd.Series(col, dtype=object) for col in route_columns], ignore_index=True), sort=True)
+    splits = np.split(codes, np.cumsum(sizes)[:-1])
+    return splits, names
+
+
+def route_values(route_names, routes):
+    """ Output route column: names for named routes, otherwise int32 route ids """
+    if route_names is None:
+        return pd.Series(routes, dtype=np.int32)
+    return pd.Series(np.asarray(route_names, dtype=object)[routes], dtype=object)
+
+
+def _event_frame(route_names, routes, begin, end, measure_scale, out_event_properties, dfs, event_fields, idx, in_fields):
+    """ Builds the output DataFrame of an overlay from the source rows of each table """
+    out_route, out_from, out_to = parse_event_properties(out_event_properties)
+    columns = {
+        out_route: route_values(route_names, routes),
+        out_from: to_miles(begin, measure_scale),
+        out_to: to_miles(end, measure_scale)
+    }
+    if in_fields.upper() == 'FIELDS':
+        taken = set(columns)
+        for df, fields, table_idx in zip(dfs, event_fields, idx):
+            for name in df.columns:
+                if name not in fields:
+                    columns[unique_name(name, taken)] = take_rows(df[name], table_idx)
+
+    return pd.DataFrame(columns)
+
+
+def overlay_events(in_df, overlay_df, overlay_type='UNION', in_event_properties=DEFAULT_EVENT_PROPERTIES,
+                   overlay_event_properties=DEFAULT_EVENT_PROPERTIES, out_event_properties=None,
+                   zero_length_events='ZERO', in_fields='FIELDS', measure_scale=MEASURE_SCALE):
+    """ Overlays two event DataFrames.
+
+    The output has the route and measure fields from out_event_properties (the input event
+    properties by default) followed by the other fields of the input and overlay tables.
+    Overlay fields whose names are already used get a _1 suffix.  Where an output event is
+    not covered by one of the tables, that table's fields are 0 for numbers and '' for text,
+    matching the output of arcpy.lr.OverlayRouteEvents.  Measures are compared in units of
+    1 / measure_scale miles.
+    """
+    in_props = parse_event_properties(in_event_properties)
+    ov_props = parse_event_properties(overlay_event_properties)
+
+    (in_codes, ov_codes), route_names = route_codes(in_df[in_props[0]], overlay_df[ov_props[0]])
+    routes, begin, end, in_idx, ov_idx = overlay_arrays(
+        in_codes, to_fixed(in_df[in_props[1]], measure_scale), to_fixed(in_df[in_props[2]], measure_scale),
+        ov_codes, to_fixed(overlay_df[ov_props[1]], measure_scale), to_fixed(overlay_df[ov_props[2]], measure_scale),
+        overlay_type, zero_length_events)
+
+    return _event_frame(route_names, routes, begin, end, measure_scale, out_event_properties or in_event_properties,
+                        (in_df, overlay_df), (in_props, ov_props), (in_idx, ov_idx), in_fields)
+
+
+def overlay_many_events(dfs, event_properties=DEFAULT_EVENT_PROPERTIES, overlay_type='UNION', out_event_properties=None,
+                        in_fields='FIELDS', measure_scale=MEASURE_SCALE):
+    """ Overlays any number of event DataFrames in a single pass.
+
+    event_properties is one string used for every table or a list with one per table.  The
+    result is the same as overlaying the tables two at a time in order with NO_ZERO: fields
+    follow the order of the tables, later fields whose names are already used get a _1
+    suffix, and fields of tables that do not cover an output event are 0 or ''.
+    """
+    if isinstance(event_properties, str):
+        event_properties = [event_properties] * len(dfs)
+    event_fields = [parse_event_properties(p) for p in event_properties]
+
+    codes, route_names = route_codes(*[df[fields[0]] for df, fields in zip(dfs, event_fields)])
+    routes, begin, end, idx = overlay_many_arrays(
+        codes,
+        [to_fixed(df[fields[1]], measure_scale) for df, fields in zip(dfs, event_fields)],
+        [to_fixed(df[fields[2]], measure_scale) for df, fields in zip(dfs, event_fields)],
+        overlay_type)
+
+    return _event_frame(route_names, routes, begin, end, measure_scale, out_event_properties or event_properties[0],
+                        dfs, event_fields, idx, in_fields)
+
+
+def _overlay_pair(dfs, *args):
+    return overlay_events(dfs[0], dfs[1], *args)
+
+
+def dissolve_events(df, event_properties=DEFAULT_EVENT_PROPERTIES, dissolve_fields=(), out_event_properties=None,
+                    dissolve_type='DISSOLVE', measure_scale=MEASURE_SCALE):
+    """ Combines events on the same route with the same values in dissolve_fields.
+
+    With DISSOLVE, events that overlap or meet end to end are combined.  With CONCATENATE,
+    only events where the to measure of one is the from measure of the next are combined.
+    The output has the route and measure fields followed by the dissolve fields, sorted by
+    route and from measure.
+    """
+    route_field, from_field, to_field = parse_event_properties(event_properties)
+    if isinstance(dissolve_fields, str):
+        dissolve_fields = [field for field in dissolve_fields.replace(';', ' ').split()]
+    dissolve_fields = list(dissolve_fields)
+    dissolve_type = dissolve_type.upper()
+    if dissolve_type not in ('DISSOLVE', 'CONCATENATE'):
+        raise Exception(f'Unsupported dissolve type: {dissolve_type}')
+
+    (codes,), route_names = route_codes(df[route_field])
+    ids, routes, low, high = _valid_events(codes, to_fixed(df[from_field], measure_scale), to_fixed(df[to_field], measure_scale))
+    if dissolve_fields:
+        groups = df.iloc[ids].groupby(dissolve_fields, sort=False, dropna=False).ngroup().to_numpy(dtype=np.int64)
+    else:
+        groups = np.zeros(len(ids), dtype=np.int64)
+
+    order = np.lexsort((high, low, groups, routes))
+    ids, routes, low, high, groups = ids[order], routes[order], low[order], high[order], groups[order]
+
+    # Each run of combined events starts where the route or values change, or where the
+    # event starts after the events before it have ended
+    same = np.zeros(len(ids), dtype=bool)
+    same[1:] = (routes[1:] == routes[:-1]) & (groups[1:] == groups[:-1])
+    if dissolve_type == 'DISSOLVE':
+        reach = pd.Series(high).groupby(np.cumsum(~same)).cummax().to_numpy()
+        joined = low[1:] <= reach[:-1]
+    else:
+        joined = low[1:] == high[:-1]
+    new_run = ~same
+    new_run[1:] |= ~joined
+    run = np.cumsum(new_run) - 1
+    first = np.flatnonzero(new_run)
+
+    run_high = np.full(len(first), np.iinfo(np.int64).min)
+    np.maximum.at(run_high, run, high)
+    run_ids = ids[first]
+
+    out_route, out_from, out_to = parse_event_properties(out_event_properties or event_properties)
+    out = pd.DataFrame({
+        out_route: route_values(route_names, routes[first]),
+        out_from: to_miles(low[first], measure_scale),
+        out_to: to_miles(run_high, measure_scale)
+    })
+    for name in dissolve_fields:
+        out[name] = df[name].iloc[run_ids].reset_index(drop=True)
+
+    order = np.lexsort((out[out_to].to_numpy(), out[out_from].to_numpy(), routes[first]))
+    return out.iloc[order].reset_index(drop=True)
+
+
+def _dissolve_shard(dfs, *args):
+    return dissolve_events(dfs[0], *args)
+
+
+def _read_events(tables, route_fields, catalog):
+    """ Reads each table, with route names replaced by catalog ids when there is a catalog """
+    dfs = [read_table(table) for table in tables]
+    if catalog is not None:
+        dfs = [catalog.encode_frame(df, field) for df, field in zip(dfs, route_fields)]
+    return dfs
+
+
+@traced()
+def overlay_route_events(in_table, in_event_properties, overlay_table, overlay_event_properties, overlay_type,
+                         out_table=None, out_event_properties=None, zero_length_events='ZERO', in_fields='FIELDS',
+                         build_index='INDEX', workers=None, measure_scale=MEASURE_SCALE, catalog=None):
+    """ Drop-in replacement for arcpy.lr.OverlayRouteEvents with the same arguments.
+
+    Tables can be DataFrames, CSVs or geodatabase tables.  The result is returned as a
+    DataFrame and also written to out_table when one is given.  build_index is accepted
+    for compatibility and ignored.  Large tables are split by route across worker
+    processes (NEEDS_WORKERS by default).  With a route catalog, routes are handled as
+    ids and only turned back into names in the result.
+    """
+    route_fields = [parse_event_properties(in_event_properties)[0], parse_event_properties(overlay_event_properties)[0]]
+    out_route = parse_event_properties(out_event_properties or in_event_properties)[0]
+    dfs = _read_events([in_table, overlay_table], route_fields, catalog)
+    df = map_routes(_overlay_pair, dfs, route_fields, out_route,
+                    (overlay_type, in_event_properties, overlay_event_properties, out_event_properties,
+                     zero_length_events, in_fields, measure_scale), workers)
+    if catalog is not None:
+        df = catalog.decode_frame(df, out_route)
+    if out_table is not None:
+        write_table(df, out_table)
+    return df
+
+
+@traced()
+def overlay_many_route_events(tables, event_properties, out_table=None, overlay_type='UNION', out_event_properties=None,
+                              in_fields='FIELDS', workers=None, measure_scale=MEASURE_SCALE, catalog=None):
+    """ Overlays a list of event tables in a single pass, replacing a chain of
+    arcpy.lr.OverlayRouteEvents calls with zero_length_events='NO_ZERO'.
+
+    Tables can be DataFrames, CSVs or geodatabase tables and are never modified.  The
+    result is returned as a DataFrame and also written to out_table when one is given.
+    Large tables are split by route across worker processes (NEEDS_WORKERS by default).
+    With a route catalog, routes are handled as ids and only turned back into names in the
+    result.
+    """
+    if isinstance(event_properties, str):
+        event_properties = [event_properties] * len(tables)
+    route_fields = [parse_event_properties(p)[0] for p in event_properties]
+    out_route = parse_event_properties(out_event_properties or event_properties[0])[0]
+    dfs = _read_events(tables, route_fields, catalog)
+    df = map_routes(overlay_many_events, dfs, route_fields, out_route,
+                    (event_properties, overlay_type, out_event_properties, in_fields, measure_scale), workers)
+    if catalog is not None:
+        df = catalog.decode_frame(df, out_route)
+    if out_table is not None:
+        write_table(df, out_table)
+    return df
+
+
+@traced()
+def dissolve_route_events(in_events, in_event_properties, dissolve_field, out_table=None, out_event_properties=None,
+                          dissolve_type='DISSOLVE', build_index='INDEX', workers=None, measure_scale=MEASURE_SCALE,
+                          catalog=None):
+    """ Drop-in replacement for arcpy.lr.DissolveRouteEvents with the same arguments.
+
+    dissolve_field is a ';' separated string or a list of field names.  The result is
+    returned as a DataFrame and also written to out_table when one is given.  build_index
+    is accepted for compatibility and ignored.
+    """
+    route_field = parse_event_properties(in_event_properties)[0]
+    out_route = parse_event_properties(out_event_properties or in_event_properties)[0]
+    dfs = _read_events([in_events], [route_field], catalog)
+    df = map_routes(_dissolve_shard, dfs, [route_field], out_route,
+                    (in_event_properties, dissolve_field, out_event_properties, dissolve_type, measure_scale), workers)
+    if catalog is not None:
+        df = catalog.decode_frame(df, out_route)
+    if out_table is not None:
+        write_table(df, out_table)
+    return df
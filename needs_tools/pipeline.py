@@ -0,0 +1,216 @@
+""" Dependency-graph runner for the need scripts.
+
+Each stage is a script with the datasets it reads (inputs) and the datasets it writes
+(outputs).  A stage depends on every stage that writes one of its inputs, and stages
+whose dependencies have finished are started together, each in its own Python process,
+up to a limit on the number of stages running at once.  A full refresh therefore takes
+as long as the slowest chain of dependent stages instead of the sum of all of them.
+
+The output of each stage's script is written to its own log file.  When a stage fails,
+the stages that depend on it are skipped and the others still run.  With a StageCache,
+a stage whose inputs, parameters and code have not changed since a cached run gets its
+outputs from the cache instead of running.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """ A need script with the datasets it reads and writes.  parameters are names of
+    module-level variables of the script that its results depend on """
+
+    def __init__(self, name, script, inputs=(), outputs=(), parameters=(), title=None):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.parameters = list(parameters)
+        self.title = name if title is None else title
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+
+def _key(path):
+    """ Dataset paths compared case-insensitively with either slash, as Windows does """
+    return os.path.normcase(os.path.normpath(str(path).replace('\\', '/')))
+
+
+def dependencies(stages):
+    """ Dictionary of stage name to the names of the stages that write its inputs """
+    writers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if _key(output) in writers:
+                raise Exception(f'{output} is written by both {writers[_key(output)]} and {stage.name}')
+            writers[_key(output)] = stage.name
+    return {stage.name: sorted({writers[_key(path)] for path in stage.inputs if _key(path) in writers} - {stage.name})
+            for stage in stages}
+
+
+def stage_order(stages):
+    """ Stage names in an order where every stage comes after its dependencies """
+    depends_on = dependencies(stages)
+    order = []
+    done = set()
+    remaining = [stage.name for stage in stages]
+    while remaining:
+        ready = [name for name in remaining if set(depends_on[name]) <= done]
+        if not ready:
+            raise Exception(f'The stages {remaining} depend on each other')
+        order += ready
+        done.update(ready)
+        remaining = [name for name in remaining if name not in done]
+    return order
+
+
+def select_stages(stages, names):
+    """ The named stages and every stage they depend on """
+    by_name = {stage.name: stage for stage in stages}
+    depends_on = dependencies(stages)
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in by_name:
+            raise Exception(f'Unknown stage {name}, expected one of {sorted(by_name)}')
+        if name not in selected:
+            selected.add(name)
+            pending += depends_on[name]
+    return [stage for stage in stages if stage.name in selected]
+
+
+def critical_path(stages, durations):
+    """ (seconds, stage names) of the longest chain of dependent stages given the time
+    each stage takes """
+    depends_on = dependencies(stages)
+    finish = {}
+    previous = {}
+    for name in stage_order(stages):
+        before = max(depends_on[name], key=lambda dependency: finish[dependency], default=None)
+        finish[name] = durations.get(name, 0) + (finish[before] if before else 0)
+        previous[name] = before
+    if not finish:
+        return 0, []
+    name = max(finish, key=finish.get)
+    seconds = finish[name]
+    path = []
+    while name is not None:
+        path.insert(0, name)
+        name = previous[name]
+    return seconds, path
+
+
+def missing_inputs(stages):
+    """ Inputs that no stage writes and that do not exist.  Datasets inside a geodatabase
+    are checked by their geodatabase folder """
+    written = {_key(output) for stage in stages for output in stage.outputs}
+    missing = []
+    for stage in stages:
+        for path in stage.inputs:
+            if _key(path) in written:
+                continue
+            match = re.match(r'^(.*?\.gdb)([\\/]|$)', str(path), re.IGNORECASE)
+            if not os.path.exists(match.group(1) if match else path):
+                missing.append((stage.name, path))
+    return missing
+
+
+def stage_environment(max_stages):
+    """ Environment for the stage processes.  When NEEDS_WORKERS is "all", the cores are
+    divided between the stages that run at once """
+    env = dict(os.environ)
+    if env.get('NEEDS_WORKERS', '1').lower() in ('all', 'max'):
+        env['NEEDS_WORKERS'] = str(max((os.cpu_count() or 1) // max_stages, 1))
+    return env
+
+
+def _run_script(stage, log_dir, python, env, cache):
+    log_path = os.path.join(log_dir, f'{stage.name}.log')
+    start = time.perf_counter()
+    key = None
+    if cache is not None:
+        key, manifest = cache.stage_key(stage)
+        if cache.restore(stage, key):
+            with open(log_path, 'w') as log:
+                log.write(f'Outputs restored from the cache ({key})\n')
+            return 'cached', time.perf_counter() - start, log_path
+
+    # Each script writes its step trace next to its log, see needs_tools/trace.py
+    env = dict(env, NEEDS_TRACE_DIR=os.path.abspath(log_dir), NEEDS_TRACE_NAME=stage.name)
+    with open(log_path, 'w') as log:
+        result = subprocess.run([python, '-u', stage.script], stdout=log, stderr=subprocess.STDOUT,
+                                cwd=os.path.dirname(os.path.abspath(stage.script)), env=env)
+    if result.returncode != 0:
+        return 'failed', time.perf_counter() - start, log_path
+    if key is not None:
+        cache.store(stage, key, manifest)
+    return 'done', time.perf_counter() - start, log_path
+
+
+def run_stages(stages, max_stages=2, log_dir='logs', python=None, env=None, cache=None):
+    """ Runs the stages in dependency order, up to max_stages at once.  With a StageCache,
+    stages whose key is in the cache are restored from it.  Returns a dictionary of stage
+    name to (status, seconds, log file) where status is "done", "cached", "failed" or
+    "skipped" """
+    python = sys.executable if python is None else python
+    env = stage_environment(max_stages) if env is None else env
+    os.makedirs(log_dir, exist_ok=True)
+
+    by_name = {stage.name: stage for stage in stages}
+    depends_on = dependencies(stages)
+    stage_order(stages)
+
+    results = {}
+    waiting = [stage.name for stage in stages]
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_stages) as executor:
+        while waiting or running:
+            for name in list(waiting):
+                status = [results[dependency][0] if dependency in results else None for dependency in depends_on[name]]
+                if any(s in ('failed', 'skipped') for s in status):
+                    print(f'  Skipped {by_name[name].title}, a stage it depends on did not finish')
+                    results[name] = ('skipped', 0, None)
+                    waiting.remove(name)
+                elif all(s in ('done', 'cached') for s in status) and len(running) < max_stages:
+                    print(f'  Started {by_name[name].title}')
+                    running[executor.submit(_run_script, by_name[name], log_dir, python, env, cache)] = name
+                    waiting.remove(name)
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status, seconds, log_path = future.result()
+                except Exception as e:
+                    print(f'  {by_name[name].title}: {e}')
+                    status, seconds, log_path = 'failed', 0, None
+                results[name] = (status, seconds, log_path)
+                label = {'done': 'Finished', 'cached': 'Restored', 'failed': 'FAILED'}[status]
+                print(f'  {label} {by_name[name].title} in {seconds / 60:.1f} minutes ({log_path})')
+    return results
+
+
+def run_trace(results, log_dir, path):
+    """ Writes the trace of a run: each stage's status and time with the steps from the
+    trace its script wrote.  Compare two runs with python -m needs_tools.trace compare """
+    stages = {}
+    for name, (status, seconds, log_path) in results.items():
+        trace_path = os.path.join(log_dir, f'{name}.trace.json')
+        trace = {'steps': []}
+        if status == 'done' and os.path.exists(trace_path):
+            with open(trace_path) as f:
+                trace = json.load(f)
+        stages[name] = dict(trace, status=status, wall=seconds)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'stages': stages}, f, indent=1)
+    return path
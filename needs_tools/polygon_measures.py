@@ -0,0 +1,246 @@
+""" Route measures of the stretches of routes inside polygons.
+
+Replaces the sequence the need scripts used to find the parts of the LRS inside buffers
+and boundaries: PairwiseClip the LRS, MultipartToSinglepart, then an UpdateCursor that
+reads geom.firstPoint.M and geom.lastPoint.M into BEGIN_MSR and END_MSR.
+
+The route shapes are split into straight segments between vertices, each segment is
+matched to the polygons it touches with an STRtree, and segments inside a polygon are
+kept whole while the rest are intersected with it.  The M value at each end of a piece
+is interpolated from the M values of the segment's vertices.  Pieces that meet along a
+route are joined, so each output event is one single part of the clipped line.  Nothing
+is written to disk.
+
+    df = polygon_route_events(lrs, bike_needs_buffer)
+
+shapely 2 is required and is imported when these functions are called.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.lrs_cache import lrs_geometry, read_route_vertices
+from needs_tools.overlay import overlay_events
+from needs_tools.spatial import read_shapes
+from needs_tools.storage import split_geopackage_path
+from needs_tools.trace import traced
+
+
+# Pieces of a route closer than this many miles apart in M are joined
+JOIN_TOLERANCE = 1e-9
+
+# Polygons with more vertices than this are cut into tiles before the segments are matched
+# to them, so each intersection only sees a small part of a large buffer
+MAX_TILE_VERTICES = 512
+
+# Most cells on each side of the grid of polygon extents used to drop segments far from
+# every polygon before any segment geometry is made
+GRID_CELLS = 2048
+
+
+def tile_polygons(polygons, max_vertices=MAX_TILE_VERTICES):
+    """ Single polygons, with polygons of more than max_vertices vertices cut into a grid
+    of tiles of about that size """
+    import shapely
+
+    polygons = shapely.get_parts(np.asarray(polygons, dtype=object))
+    polygons = polygons[~shapely.is_empty(polygons) & (shapely.area(polygons) > 0)]
+    vertices = shapely.get_num_coordinates(polygons)
+    large = vertices > max_vertices
+    if not large.any():
+        return polygons
+
+    tiles = [polygons[~large]]
+    for polygon, count in zip(polygons[large], vertices[large]):
+        xmin, ymin, xmax, ymax = shapely.bounds(polygon)
+        cells = int(np.ceil(np.sqrt(count / max_vertices)))
+        x = np.linspace(xmin, xmax, cells + 1)
+        y = np.linspace(ymin, ymax, cells + 1)
+        i, j = np.divmod(np.arange(cells * cells), cells)
+        boxes = shapely.box(x[j], y[i], x[j + 1], y[i + 1])
+        pieces = shapely.get_parts(shapely.intersection(polygon, boxes))
+        # Cells that miss the polygon give empty pieces, which have no extent
+        tiles.append(pieces[(shapely.get_type_id(pieces) == 3) & ~shapely.is_empty(pieces) & (shapely.area(pieces) > 0)])
+    return np.concatenate(tiles)
+
+
+def _near_boxes(p0, p1, boxes, cells=GRID_CELLS):
+    """ Whether each segment from p0 to p1 may touch one of the boxes (xmin, ymin, xmax,
+    ymax).  The boxes are marked on a grid, and a segment shorter than a cell is near them
+    if one of the up to four cells its extent covers is marked """
+    if len(boxes) == 0:
+        return np.zeros(len(p0), dtype=bool)
+    cells = int(min(cells, max(np.sqrt(len(p0)), 16)))
+    xmin, ymin = boxes[:, 0].min(), boxes[:, 1].min()
+    size = max(boxes[:, 2].max() - xmin, boxes[:, 3].max() - ymin) / cells or 1.0
+
+    # Cells covered by each box, marked with a 2D running sum of +1 and -1 at its corners
+    low = np.floor((boxes[:, :2] - (xmin, ymin)) / size).astype(np.int64)
+    high = np.floor((boxes[:, 2:] - (xmin, ymin)) / size).astype(np.int64) + 1
+    counts = np.zeros((cells + 2, cells + 2), dtype=np.int64)
+    np.add.at(counts, (low[:, 0], low[:, 1]), 1)
+    np.add.at(counts, (high[:, 0], low[:, 1]), -1)
+    np.add.at(counts, (low[:, 0], high[:, 1]), -1)
+    np.add.at(counts, (high[:, 0], high[:, 1]), 1)
+    marked = counts.cumsum(axis=0).cumsum(axis=1) > 0
+
+    def cell(values, origin):
+        return np.clip(np.floor((values - origin) / size), -1, cells + 1).astype(np.int64)
+
+    x0, x1 = cell(p0[:, 0], xmin), cell(p1[:, 0], xmin)
+    y0, y1 = cell(p0[:, 1], ymin), cell(p1[:, 1], ymin)
+    long = (np.abs(x1 - x0) > 1) | (np.abs(y1 - y0) > 1)
+
+    # Cells outside the grid, which are -1 or cells + 1, are never marked
+    marked = np.pad(marked[:cells + 1, :cells + 1], ((1, 1), (1, 1)))
+    near = long.copy()
+    for x in (x0, x1):
+        for y in (y0, y1):
+            near |= marked[x + 1, y + 1]
+    return near
+
+
+def route_segments(coords, offsets, boxes):
+    """ First vertex of each segment between consecutive vertices of a single part that
+    may touch one of the boxes (xmin, ymin, xmax, ymax).  Zero-length segments are left out """
+    import shapely
+
+    parts = len(offsets) - 1
+    part_of_vertex = np.repeat(np.arange(parts), np.diff(offsets))
+    if len(coords) == 0 or len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Only the parts whose extent overlaps a box are split into segments
+    near = np.zeros(parts, dtype=bool)
+    filled = np.flatnonzero(np.diff(offsets) > 0)
+    low = np.minimum.reduceat(coords[:, :2], offsets[filled], axis=0)
+    high = np.maximum.reduceat(coords[:, :2], offsets[filled], axis=0)
+    tree = shapely.STRtree(shapely.box(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]))
+    near[filled[np.unique(tree.query(shapely.box(low[:, 0], low[:, 1], high[:, 0], high[:, 1]))[0])]] = True
+
+    start = np.flatnonzero((part_of_vertex[:-1] == part_of_vertex[1:]) & near[part_of_vertex[:-1]])
+    p0 = coords[start]
+    p1 = coords[start + 1]
+    keep = ((p0[:, 0] != p1[:, 0]) | (p0[:, 1] != p1[:, 1])) & _near_boxes(p0, p1, boxes)
+    return start[keep]
+
+
+def join_runs(part, begin, end, tolerance=JOIN_TOLERANCE):
+    """ (part, begin, end) with the stretches that overlap or meet on the same part joined,
+    sorted by part and begin """
+    order = np.lexsort((begin, part))
+    part, begin, end = part[order], begin[order], end[order]
+    reach = pd.Series(end).groupby(part).cummax().to_numpy()
+    new_run = np.ones(len(part), dtype=bool)
+    new_run[1:] = (part[1:] != part[:-1]) | (begin[1:] > reach[:-1] + tolerance)
+    run = np.cumsum(new_run) - 1
+    first = np.flatnonzero(new_run)
+    run_end = np.full(len(first), -np.inf)
+    np.maximum.at(run_end, run, end)
+
+    part, begin, end = part[first], begin[first], run_end
+    stretch = end > begin
+    return part[stretch], begin[stretch], end[stretch]
+
+
+def polygon_measure_arrays(coords, offsets, polygons, tolerance=JOIN_TOLERANCE):
+    """ (part, begin, end) of every stretch of the single parts inside the polygons, sorted
+    by part and begin.  coords and offsets are the vertices from
+    needs_tools.lrs_cache.line_vertices """
+    import shapely
+
+    polygons = tile_polygons(polygons)
+    part_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    start = route_segments(coords, offsets, shapely.bounds(polygons))
+    p0 = coords[start]
+    p1 = coords[start + 1]
+    segments = shapely.linestrings(np.stack([p0[:, :2], p1[:, :2]], axis=1)) if len(start) else np.zeros(0, dtype=object)
+
+    # Pairs of segments and polygons whose extents overlap.  The predicates are checked
+    # afterwards against the prepared polygons, which is much faster than in the query
+    tree = shapely.STRtree(polygons)
+    segment, polygon = tree.query(segments)
+    shapely.prepare(polygons)
+    crosses = shapely.intersects(polygons[polygon], segments[segment])
+    segment, polygon = segment[crosses], polygon[crosses]
+
+    # Segments inside a polygon are kept whole, the others are cut by it.  low and high are
+    # the fractions of the segment at the ends of each piece
+    inside = shapely.covers(polygons[polygon], segments[segment])
+    cut_segment = segment[~inside]
+    pieces, piece_pair = shapely.get_parts(shapely.intersection(segments[cut_segment], polygons[polygon[~inside]]), return_index=True)
+    lines = (shapely.get_type_id(pieces) == 1) & (shapely.length(pieces) > 0)
+    pieces, piece_segment = pieces[lines], cut_segment[piece_pair[lines]]
+
+    piece_coords, piece = shapely.get_coordinates(pieces, return_index=True)
+    d = p1[piece_segment[piece], :2] - p0[piece_segment[piece], :2]
+    fraction = np.clip(((piece_coords - p0[piece_segment[piece], :2]) * d).sum(axis=1) / (d * d).sum(axis=1), 0, 1)
+    low = np.full(len(pieces), np.inf)
+    high = np.full(len(pieces), -np.inf)
+    np.minimum.at(low, piece, fraction)
+    np.maximum.at(high, piece, fraction)
+
+    segment = np.concatenate([segment[inside], piece_segment])
+    low = np.concatenate([np.zeros(inside.sum()), low])
+    high = np.concatenate([np.ones(inside.sum()), high])
+
+    # M values at the ends of each piece
+    m0, m1 = p0[segment, 2], p1[segment, 2]
+    begin = m0 + low * (m1 - m0)
+    end = m0 + high * (m1 - m0)
+    begin, end = np.minimum(begin, end), np.maximum(begin, end)
+    part = part_of_vertex[start[segment]]
+
+    return join_runs(part, begin, end, tolerance)
+
+
+def polygon_measures(route_names, coords, offsets, polygons, route_field='RTE_NM', from_field='BEGIN_MSR', to_field='END_MSR'):
+    """ DataFrame of the route name, from measure and to measure of every stretch of the
+    routes inside the polygons.  route_names has one name per single part """
+    part, begin, end = polygon_measure_arrays(coords, offsets, polygons)
+    return pd.DataFrame({
+        route_field: pd.Series(np.asarray(route_names, dtype=object)[part], dtype=object),
+        from_field: begin,
+        to_field: end
+    })
+
+
+def source_shapes(source, spatial_reference=None):
+    """ Shapes of a feature class projected to spatial_reference, or an array of shapely
+    geometries as it is """
+    if isinstance(source, str):
+        return read_shapes(source, spatial_reference=spatial_reference)[0]
+    return np.asarray(source, dtype=object)
+
+
+@traced()
+def polygon_route_events(lrs, polygons, route_field='RTE_NM', where_clause=None):
+    """ Events of the stretches of the LRS routes inside the polygons, with the fields
+    RTE_NM, BEGIN_MSR and END_MSR.  The same result as clipping the LRS by the polygons,
+    exploding the parts and reading the M values of their first and last points.
+
+    polygons is a polygon feature class or an array of shapely polygons in the LRS's
+    coordinate system, or a list of them, in which case the events are the stretches
+    inside all of them.  Feature classes are projected to the LRS's coordinate system.
+    """
+    spatial_reference = None
+    if split_geopackage_path(lrs) is None:
+        import arcpy
+
+        spatial_reference = arcpy.Describe(lrs).spatialReference
+
+    # The whole LRS is read from its memory-mapped copy, see needs_tools/lrs_cache.py
+    if where_clause is None:
+        coords, offsets, route_names = lrs_geometry(lrs, route_field).route_vertices()
+    else:
+        coords, offsets, route_names = read_route_vertices(lrs, route_field, where_clause=where_clause)
+    polygon_sets = polygons if isinstance(polygons, list) else [polygons]
+    events = None
+    for polygon_set in polygon_sets:
+        df = polygon_measures(route_names, coords, offsets, source_shapes(polygon_set, spatial_reference), route_field)
+        if events is None:
+            events = df
+        else:
+            properties = f'{route_field} LINE BEGIN_MSR END_MSR'
+            events = overlay_events(events, df, 'INTERSECT', properties, properties, zero_length_events='NO_ZERO')
+    return events
@@ -0,0 +1,71 @@
+""" In-memory registry of need stage results.
+
+When several stages run in one process, each stage publishes its output event table here
+and create_final_needs_layer.py uses the published table directly instead of reading the
+stage's file back.  Writing the table to disk happens on a background thread, so a stage
+does not wait for its Parquet file to be written.  When a stage has not been run in this
+process, stage_source returns the path of its event table instead.
+
+run_needs.py runs every stage in its own process, so there the final layer always reads
+the stages' Parquet files.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StageRegistry:
+    """ Stage results by name, persisted to disk in the background """
+
+    def __init__(self):
+        self._frames = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='needs-persist')
+
+    def publish(self, name, df, path=None):
+        """ Makes df the result of the stage.  With path, the table is also written there
+        as a Parquet event table on a background thread """
+        from needs_tools.tables import write_table
+
+        with self._lock:
+            self._frames[name] = df
+            if path is not None:
+                self._pending[name] = self._executor.submit(write_table, df, path)
+        return df
+
+    def __contains__(self, name):
+        return name in self._frames
+
+    def frame(self, name):
+        """ The DataFrame published by the stage """
+        if name not in self._frames:
+            raise Exception(f'Stage {name} has not published a result')
+        return self._frames[name]
+
+    def wait(self, name=None):
+        """ Waits for background writes (of one stage or all of them) to finish.  Errors
+        from a write are raised here """
+        with self._lock:
+            pending = dict(self._pending) if name is None else {name: self._pending[name]} if name in self._pending else {}
+        for stage, future in pending.items():
+            future.result()
+            with self._lock:
+                if self._pending.get(stage) is future:
+                    del self._pending[stage]
+
+
+# Registry shared by the stages run in this process
+STAGES = StageRegistry()
+
+
+def publish_stage(name, df, path=None):
+    """ Publishes a stage result to the process registry, see StageRegistry.publish """
+    return STAGES.publish(name, df, path)
+
+
+def stage_source(name, path):
+    """ The published result of the stage if it ran in this process, otherwise path """
+    if name in STAGES:
+        return STAGES.frame(name)
+    return path
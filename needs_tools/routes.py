@@ -0,0 +1,124 @@
+""" Route catalog built from the overlap LRS.
+
+Every RTE_NM is given a dense int32 id so that event tables can be sorted, joined and
+grouped on integers.  Ids are assigned in order of route name, so sorting by id sorts by
+name.  The catalog also stores the id of each route's opposite direction route and parent
+(master) route, with -1 where there is none.  Route names are only needed again when a
+table is written.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.tables import read_table
+
+
+ROUTE_FIELD = 'RTE_NM'
+OPPOSITE_FIELD = 'RTE_OPPOSITE_DIRECTION_RTE_NM'
+PARENT_FIELD = 'RTE_PARENT_RTE_NM'
+
+
+class RouteCatalog:
+    """ Maps route names to int32 ids and back """
+
+    def __init__(self, names, opposite_names=None, parent_names=None, attributes=None):
+        names = pd.Series(names, dtype=object)
+        keep = names.notna() & ~names.duplicated()
+        order = np.argsort(names[keep].to_numpy(dtype=str), kind='stable')
+        rows = np.flatnonzero(keep.to_numpy())[order]
+
+        self.names = names.to_numpy()[rows]
+        self._index = pd.Index(self.names)
+        self.opposite = self._related(opposite_names, rows)
+        self.parent = self._related(parent_names, rows)
+
+        # The LRS values themselves, which can name routes that are not in the LRS
+        self.opposite_names = self._raw(opposite_names, rows)
+        self.parent_names = self._raw(parent_names, rows)
+        if attributes is not None:
+            self.attributes = attributes.iloc[rows].reset_index(drop=True)
+        else:
+            self.attributes = pd.DataFrame(index=np.arange(len(rows)))
+
+    def _related(self, related_names, rows):
+        if related_names is None:
+            return np.full(len(rows), -1, dtype=np.int32)
+        return self.encode(pd.Series(related_names, dtype=object).to_numpy()[rows])
+
+    def _raw(self, related_names, rows):
+        if related_names is None:
+            return np.full(len(rows), None, dtype=object)
+        return pd.Series(related_names, dtype=object).to_numpy()[rows]
+
+    @classmethod
+    def from_lrs(cls, lrs, fields=()):
+        """ Builds the catalog from an LRS feature class or table.  fields are other LRS fields
+        kept in the attributes DataFrame, in the same order as the ids """
+        fields = [field for field in fields if field not in (ROUTE_FIELD, OPPOSITE_FIELD, PARENT_FIELD)]
+        df = read_table(lrs, [ROUTE_FIELD, OPPOSITE_FIELD, PARENT_FIELD] + fields)
+        return cls(df[ROUTE_FIELD], df[OPPOSITE_FIELD], df[PARENT_FIELD], df[fields])
+
+    def __len__(self):
+        return len(self.names)
+
+    def encode(self, names, extend=False):
+        """ Returns the int32 id of each route name, or -1 for names not in the catalog.  With
+        extend, names not in the catalog are added to the end of it instead """
+        names = pd.Series(names, dtype=object)
+        ids = self._index.get_indexer(names)
+        if extend:
+            missing = (ids < 0) & names.notna().to_numpy()
+            if missing.any():
+                self._add(pd.unique(names[missing]))
+                ids = self._index.get_indexer(names)
+        return ids.astype(np.int32)
+
+    def _add(self, names):
+        n = len(names)
+        self.names = np.concatenate([self.names, np.asarray(names, dtype=object)])
+        self._index = pd.Index(self.names)
+        self.opposite = np.concatenate([self.opposite, np.full(n, -1, dtype=np.int32)])
+        self.parent = np.concatenate([self.parent, np.full(n, -1, dtype=np.int32)])
+        return n
+
+    def added(self):
+        """ Number of routes that are not in the LRS and were added by encode_frame """
+        return len(self.names) - len(self.attributes)
+
+    def decode(self, ids):
+        """ Returns the route name of each id, or None for -1 """
+        ids = np.asarray(ids, dtype=np.int64)
+        names = np.append(self.names, None)
+        return names[np.where(ids >= 0, ids, len(self.names))]
+
+    def opposite_of(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        return np.where(ids >= 0, self.opposite[np.maximum(ids, 0)] if len(self) else -1, -1).astype(np.int32)
+
+    def parent_of(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        return np.where(ids >= 0, self.parent[np.maximum(ids, 0)] if len(self) else -1, -1).astype(np.int32)
+
+    def encode_frame(self, df, field=ROUTE_FIELD):
+        """ Copy of the DataFrame with route names in field replaced by ids.  Routes that are
+        not in the catalog are added to it so no events are lost """
+        return df.assign(**{field: self.encode(df[field], extend=True)})
+
+    def decode_frame(self, df, field=ROUTE_FIELD):
+        """ Copy of the DataFrame with route ids in field replaced by names """
+        return df.assign(**{field: pd.Series(self.decode(df[field]), index=df.index, dtype=object)})
+
+    def lookup(self, fields):
+        """ Dictionary of route name to a tuple of LRS field values for the routes in the LRS.
+        The opposite direction and parent route fields are the LRS values, including names of
+        routes that are not in the LRS """
+        n = len(self.attributes)
+        columns = []
+        for field in fields:
+            if field == OPPOSITE_FIELD:
+                columns.append(self.opposite_names)
+            elif field == PARENT_FIELD:
+                columns.append(self.parent_names)
+            else:
+                columns.append(self.attributes[field].to_numpy())
+        return dict(zip(self.names[:n], zip(*columns)))
@@ -0,0 +1,49 @@
+""" Segment_ID generation from route names and segment midpoints.
+
+A Segment_ID is the direction digit (1 for prime direction, 0 for non-prime), the last
+three characters of the route number and the first seven digits of the midpoint's
+longitude (made positive) and latitude with the decimal points removed.  The IDs are
+built for all segments at once from arrays, and segments whose ID could not be built or
+is shared with another segment are listed in a report instead of being skipped quietly.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _coordinate_digits(values):
+    """ First seven characters of each coordinate's text with the decimal point removed """
+    text = pd.Series([repr(float(v)) for v in values], dtype=object)
+    return text.str.replace('.', '', regex=False).str.slice(0, 7)
+
+
+def segment_ids(route_names, x, y):
+    """ Segment_ID for each segment, or None where the route name or midpoint is missing """
+    routes = pd.Series(route_names, dtype=object).reset_index(drop=True)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = routes.map(lambda name: isinstance(name, str)).to_numpy() & ~np.isnan(x) & ~np.isnan(y)
+
+    names = routes.where(valid, '').astype(str).astype(object)
+    state_route = names.str.startswith('R-VA')
+
+    # Direction as 1 for prime and 0 for non-prime
+    prime = np.where(state_route, names.str.slice(14, 16).isin(['NB', 'EB']), names.str.slice(7, 9) == 'PR')
+    direction = pd.Series(np.where(prime, '1', '0'), dtype=object)
+
+    # Last three of route number to avoid duplicates at intersections
+    number = pd.Series(np.where(state_route, names.str.slice(11, 14), names.str.slice(10, 13)), dtype=object)
+
+    ids = direction + number + _coordinate_digits(np.where(valid, x * -1, 0)) + _coordinate_digits(np.where(valid, y, 0))
+    return np.where(valid, ids.to_numpy(dtype=object), None)
+
+
+def segment_id_report(df, id_field='Segment_ID'):
+    """ Rows of df whose Segment_ID is missing or shared with another row, with the reason in
+    a Problem field """
+    ids = df[id_field]
+    failed = ids.isna()
+    duplicate = ids.duplicated(keep=False) & ~failed
+    report = df[failed | duplicate].copy()
+    report['Problem'] = np.where(failed[failed | duplicate], 'Failed', 'Duplicate')
+    return report.sort_values(['Problem', id_field])
@@ -0,0 +1,97 @@
+""" Route-sharded parallel execution of event table operations.
+
+Overlays and dissolves only compare events on the same route, so the event tables can
+be split into shards by a hash of the route name and each shard processed in its own
+process.  Every route falls in exactly one shard, and the shard results are merged back
+into the order a single process would have written them, so the output does not depend
+on the number of workers.
+
+The number of worker processes comes from the NEEDS_WORKERS environment variable and
+defaults to 1, which runs everything in the current process.
+"""
+
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+# Tables smaller than this are not worth the cost of starting worker processes
+MIN_SHARD_ROWS = 200000
+
+
+def default_workers():
+    """ Number of worker processes set by the NEEDS_WORKERS environment variable """
+    workers = os.environ.get('NEEDS_WORKERS', '1')
+    if workers.lower() in ('all', 'max'):
+        return os.cpu_count() or 1
+    try:
+        return max(int(workers), 1)
+    except ValueError:
+        raise Exception(f'NEEDS_WORKERS must be a number or "all": {workers}')
+
+
+def route_shards(route_names, n_shards):
+    """ Shard number of each route name.  A CRC32 of the name is used rather than hash()
+    so every process puts a route in the same shard """
+    codes, names = pd.factorize(pd.Series(route_names, dtype=object))
+    name_shards = np.array([zlib.crc32(str(name).encode('utf-8')) % n_shards for name in names], dtype=np.int64)
+    return np.where(codes >= 0, name_shards[np.maximum(codes, 0)] if len(names) else 0, 0)
+
+
+def split_by_route(dfs, route_fields, n_shards):
+    """ Splits each DataFrame into n_shards DataFrames by route.  Returns a list with one
+    list of DataFrames per shard """
+    shards = [[] for _ in range(n_shards)]
+    for df, route_field in zip(dfs, route_fields):
+        shard = route_shards(df[route_field], n_shards)
+        order = np.argsort(shard, kind='stable')
+        bounds = np.searchsorted(shard[order], np.arange(n_shards + 1))
+        for i in range(n_shards):
+            shards[i].append(df.iloc[order[bounds[i]:bounds[i + 1]]].reset_index(drop=True))
+    return shards
+
+
+def merge_by_route(results, route_field):
+    """ Concatenates shard results and puts the routes back in sorted order.  The sort is
+    stable, so the rows of each route keep the order they were written in """
+    df = pd.concat(results, ignore_index=True)
+    codes, _ = pd.factorize(df[route_field], sort=True)
+    return df.iloc[np.argsort(codes, kind='stable')].reset_index(drop=True)
+
+
+@contextmanager
+def _script_not_reimported():
+    """ On Windows worker processes are started by importing the main module again.  The
+    needs scripts run at import, so the main module's path is hidden while the workers start
+    and the workers only import the needs_tools modules they need """
+    main = sys.modules.get('__main__')
+    main_file = getattr(main, '__file__', None)
+    if main_file is not None:
+        del main.__file__
+    try:
+        yield
+    finally:
+        if main_file is not None:
+            main.__file__ = main_file
+
+
+def map_routes(func, dfs, route_fields, out_route_field, args=(), workers=None):
+    """ Runs func(dfs, *args) on route shards of the DataFrames in a process pool and merges
+    the results.  func must be a module level function that returns a DataFrame with the
+    route in out_route_field.  Small tables and a single worker run func directly """
+    workers = default_workers() if workers is None else workers
+    if workers <= 1 or sum(len(df) for df in dfs) < MIN_SHARD_ROWS:
+        return func(dfs, *args)
+
+    shards = split_by_route(dfs, route_fields, workers)
+    with _script_not_reimported():
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(func, shard, *args) for shard in shards]
+            results = [future.result() for future in futures]
+
+    return merge_by_route(results, out_route_field)
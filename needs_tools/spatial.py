@@ -0,0 +1,80 @@
+""" Point-in-polygon enrichment of line features with shapely STRtrees.
+
+Each line's midpoint is computed once, and every boundary layer is queried with all of
+the midpoints at once through an STRtree, instead of one SelectLayerByLocation per
+polygon.  A line is in a polygon when its midpoint is inside it or on its boundary,
+matching SelectLayerByLocation with HAVE_THEIR_CENTER_IN.
+
+shapely 2 is required and is imported when these functions are called.
+"""
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.storage import GeoPackageStorage, split_geopackage_path
+
+
+def read_shapes(fc, fields=(), spatial_reference=None, where_clause=None):
+    """ Returns the shapes of a feature class as an array of shapely geometries (None for
+    empty shapes) and a DataFrame of fields.  Shapes are projected to spatial_reference
+    when one is given.  GeoPackage tables are read without arcpy, and are not projected """
+    import shapely
+
+    fields = list(fields)
+    geopackage = split_geopackage_path(fc)
+    if geopackage is not None:
+        df = GeoPackageStorage(geopackage[0]).read(geopackage[1], ['SHAPE@WKB'] + fields, where_clause)
+        return shapely.from_wkb(df['SHAPE@WKB'].to_numpy()), df[fields].reset_index(drop=True)
+
+    import arcpy
+
+    rows = [row for row in arcpy.da.SearchCursor(fc, ['SHAPE@WKB'] + fields, where_clause, spatial_reference)]
+    shapes = shapely.from_wkb([bytes(row[0]) if row[0] is not None else None for row in rows])
+    df = pd.DataFrame([row[1:] for row in rows], columns=fields)
+    return shapes, df
+
+
+def midpoints(lines):
+    """ x and y of the point halfway along each line, NaN for missing lines """
+    import shapely
+
+    lines = np.asarray(lines, dtype=object)
+    points = np.full(len(lines), None, dtype=object)
+    present = ~shapely.is_missing(lines) & ~shapely.is_empty(lines)
+    points[present] = shapely.line_interpolate_point(lines[present], 0.5, normalized=True)
+    return shapely.get_x(points), shapely.get_y(points)
+
+
+def containing_polygon(x, y, polygons, rank=None):
+    """ Position of the polygon that contains each point, or -1.  Where several polygons
+    contain a point, the one with the highest rank wins (by default the last one) """
+    import shapely
+
+    polygons = np.asarray(polygons, dtype=object)
+    rank = np.arange(len(polygons)) if rank is None else np.asarray(rank)
+    tree = shapely.STRtree(polygons)
+    present = ~np.isnan(x) & ~np.isnan(y)
+    point_ids = np.flatnonzero(present)
+    point, polygon = tree.query(shapely.points(x[present], y[present]), predicate='intersects')
+    point = point_ids[point]
+
+    found = np.full(len(x), -1, dtype=np.int64)
+    order = np.lexsort((rank[polygon], point))
+    point, polygon = point[order], polygon[order]
+    last = np.append(point[1:] != point[:-1], True)
+    found[point[last]] = polygon[last]
+    return found
+
+
+def polygon_values(x, y, polygon_fc, field, spatial_reference=None):
+    """ Value of field from the polygon that contains each point, or None.
+
+    SelectLayerByLocation is run once for every value in the order the polygons are
+    read, so a point in polygons with different values gets the last value.  The same
+    order is used here.
+    """
+    polygons, df = read_shapes(polygon_fc, [field], spatial_reference)
+    values = df[field]
+    last_position = pd.Series(np.arange(len(values))).groupby(values.to_numpy(), dropna=False).transform('max')
+    found = containing_polygon(x, y, polygons, last_position.to_numpy())
+    return np.where(found >= 0, values.to_numpy(dtype=object)[np.maximum(found, 0)] if len(values) else None, None)
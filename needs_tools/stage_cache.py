@@ -0,0 +1,235 @@
+""" Content-addressed cache of stage outputs.
+
+A stage's key is a hash of the contents of its input datasets, the values of its
+parameters (module-level assignments in its script such as bike_needs_radius) and its
+code: the script, the other scripts in its folder and the shared tools.  After a stage
+runs, its outputs are copied into the cache under that key.  When a later run computes
+the same key, the outputs are copied back instead of running the script.
+
+Datasets in a geodatabase or GeoPackage and shapefiles are hashed by their field names,
+rows and shapes, so a change to one dataset in Common_Datasets.gdb only reruns the stages
+that read it, and a stage that writes other datasets to the geodatabase of one of its
+inputs can still be skipped.  Other inputs are hashed by the contents of their files.
+Hashes are remembered by the size and modification time of the files, so unchanged
+inputs are only read once.  Restoring a stage does not rewrite its output.gdb.
+"""
+
+import ast
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+
+# Entries kept for each stage, newest first
+KEEP_ENTRIES = 3
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _digest_file(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_files(path):
+    """ Files that hold a dataset: the whole geodatabase for datasets inside a .gdb, the
+    sidecar files of a shapefile, every file in a folder, otherwise the file itself """
+    path = str(path)
+    match = re.match(r'^(.*?\.gdb)([\\/]|$)', path, re.IGNORECASE)
+    if match:
+        path = match.group(1)
+    if os.path.isdir(path):
+        files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        return sorted(file for file in files if not file.lower().endswith('.lock'))
+    if path.lower().endswith('.shp'):
+        return sorted(glob.glob(glob.escape(os.path.splitext(path)[0]) + '.*'))
+    return [path] if os.path.exists(path) else []
+
+
+def is_table_dataset(path):
+    """ Whether the path is a dataset in a geodatabase or GeoPackage, or a shapefile """
+    from needs_tools.storage import split_geopackage_path
+
+    path = str(path)
+    return (re.match(r'^(.*?\.gdb)[\\/]', path, re.IGNORECASE) is not None or path.lower().endswith('.shp')
+            or split_geopackage_path(path) is not None)
+
+
+def _has_shapes(path):
+    from needs_tools.storage import GeoPackageStorage, split_geopackage_path
+
+    geopackage = split_geopackage_path(path)
+    if geopackage is not None:
+        return GeoPackageStorage(geopackage[0]).has_geometry(geopackage[1])
+
+    import arcpy
+
+    return hasattr(arcpy.Describe(path), 'shapeType')
+
+
+def table_digest(path):
+    """ Hash of the field names and rows of a table dataset, and the shapes of a feature
+    class, in the order they are read """
+    from needs_tools.tables import list_fields, read_chunks
+
+    fields = list_fields(path) + (['SHAPE@WKB'] if _has_shapes(path) else [])
+    digest = hashlib.blake2b(json.dumps(fields).encode('utf-8'), digest_size=20)
+    for chunk in read_chunks(path, fields):
+        if 'SHAPE@WKB' in fields:
+            chunk = chunk.assign(**{'SHAPE@WKB': [None if wkb is None else bytes(wkb) for wkb in chunk['SHAPE@WKB']]})
+        digest.update(pd.util.hash_pandas_object(chunk, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def script_parameters(script, names):
+    """ Values of module-level assignments to the names in a script.  Values that are not
+    literals are kept as source text.  The last assignment to a name wins """
+    with open(script, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in names:
+                try:
+                    values[name] = ast.literal_eval(node.value)
+                except ValueError:
+                    values[name] = ast.unparse(node.value)
+    missing = [name for name in names if name not in values]
+    if missing:
+        raise Exception(f'Parameters {missing} are not assigned in {script}')
+    return values
+
+
+def code_files(stage):
+    """ The stage script, the other scripts in its folder and the shared tools """
+    folder = os.path.dirname(os.path.abspath(stage.script))
+    files = set(glob.glob(os.path.join(folder, '*.py'))) | set(glob.glob(os.path.join(TOOLS_DIR, '*.py')))
+    return sorted(files | {os.path.abspath(stage.script)})
+
+
+class StageCache:
+    """ Stage outputs by stage key in a cache folder """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._hashes_path = os.path.join(cache_dir, 'file_hashes.json')
+        self._lock = threading.Lock()
+        self._hashes = {}
+        if os.path.exists(self._hashes_path):
+            with open(self._hashes_path) as f:
+                self._hashes = json.load(f)
+
+    def file_digest(self, path):
+        """ Hash of a file's contents, reused while its size and modification time are
+        the same """
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            known = self._hashes.get(path)
+        if known is not None and known[:2] == stamp:
+            return known[2]
+        digest = _digest_file(path)
+        with self._lock:
+            self._hashes[path] = stamp + [digest]
+        return digest
+
+    def dataset_digest(self, path):
+        """ Hash of an input dataset, see table_digest.  Files that are not table datasets
+        are hashed file by file """
+        from needs_tools.storage import split_geopackage_path
+
+        path = str(path)
+        if not is_table_dataset(path):
+            return {file: self.file_digest(file) for file in dataset_files(path)}
+
+        # The rows are only read again when a file of the geodatabase, GeoPackage or shapefile
+        # changes
+        geopackage = split_geopackage_path(path)
+        files = dataset_files(path if geopackage is None else geopackage[0])
+        stamp = [[file, os.path.getsize(file), os.stat(file).st_mtime_ns] for file in files]
+        stamp = hashlib.blake2b(json.dumps(stamp).encode('utf-8'), digest_size=20).hexdigest()
+        with self._lock:
+            known = self._hashes.get(f'table:{path}')
+        if known is not None and known[0] == stamp:
+            return known[1]
+        digest = table_digest(path)
+        with self._lock:
+            self._hashes[f'table:{path}'] = [stamp, digest]
+        return digest
+
+    def save_hashes(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            hashes = dict(self._hashes)
+        with open(self._hashes_path + '.tmp', 'w') as f:
+            json.dump(hashes, f)
+        os.replace(self._hashes_path + '.tmp', self._hashes_path)
+
+    def stage_key(self, stage):
+        """ (key, manifest) of the stage.  The manifest records what went into the key """
+        root = os.path.commonpath([os.path.abspath(path) for path in code_files(stage)])
+        manifest = {
+            'stage': stage.name,
+            'inputs': {str(path): self.dataset_digest(path) for path in stage.inputs},
+            'parameters': script_parameters(stage.script, stage.parameters),
+            'code': {os.path.relpath(file, root): self.file_digest(file) for file in code_files(stage)}
+        }
+        self.save_hashes()
+        key = hashlib.blake2b(json.dumps(manifest, sort_keys=True, default=str).encode('utf-8'), digest_size=20).hexdigest()
+        return key, manifest
+
+    def _entry(self, stage, key):
+        return os.path.join(self.cache_dir, stage.name, key)
+
+    def restore(self, stage, key):
+        """ Copies the cached outputs of the stage back to their paths.  Returns False when
+        there is no complete entry for the key """
+        entry = self._entry(stage, key)
+        cached = [os.path.join(entry, f'{i}_{os.path.basename(output)}') for i, output in enumerate(stage.outputs)]
+        if not os.path.exists(os.path.join(entry, 'manifest.json')) or not all(os.path.exists(file) for file in cached):
+            return False
+        for file, output in zip(cached, stage.outputs):
+            if not os.path.exists(output) or self.file_digest(output) != self.file_digest(file):
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                shutil.copy2(file, output)
+        os.utime(os.path.join(entry, 'manifest.json'))
+        self.save_hashes()
+        return True
+
+    def store(self, stage, key, manifest):
+        """ Copies the outputs of a finished stage into the cache under its key """
+        missing = [output for output in stage.outputs if not os.path.isfile(output)]
+        if missing:
+            raise Exception(f'Stage {stage.name} did not write {missing}')
+        entry = self._entry(stage, key)
+        partial = entry + '.partial'
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        for i, output in enumerate(stage.outputs):
+            shutil.copy2(output, os.path.join(partial, f'{i}_{os.path.basename(output)}'))
+        manifest = dict(manifest, stored=time.strftime('%Y-%m-%d %H:%M:%S'))
+        with open(os.path.join(partial, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=1, default=str)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(partial, entry)
+        self.prune(stage)
+
+    def prune(self, stage, keep=KEEP_ENTRIES):
+        """ Deletes all but the most recently used entries of the stage """
+        folder = os.path.join(self.cache_dir, stage.name)
+        entries = [os.path.join(folder, name) for name in os.listdir(folder) if not name.endswith('.partial')]
+        entries.sort(key=lambda entry: os.path.getmtime(os.path.join(entry, 'manifest.json'))
+                     if os.path.exists(os.path.join(entry, 'manifest.json')) else 0, reverse=True)
+        for entry in entries[keep:]:
+            shutil.rmtree(entry, ignore_errors=True)
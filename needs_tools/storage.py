@@ -0,0 +1,370 @@
+""" Storage backends for the datasets read and written by the needs scripts.
+
+Datasets are opened by name from a workspace.  ArcpyStorage uses a file geodatabase
+through arcpy, as the scripts always have.  GeoPackageStorage uses a GeoPackage (a
+SQLite database) with only the Python standard library, so the shared tools can run on
+machines without ArcGIS using copies of the same datasets under the same names.
+
+In a GeoPackage every table written with a route field gets a (route, from measure)
+index, and every table with geometry gets an R-tree of the shape extents.  Both backends
+answer route lookups and bounding box lookups:
+
+    storage = open_storage(common_datasets_gdb)
+    storage.routes('SDE_VDOT_RTE_OVERLAP_LRS_DY', ['R-VA   IS00064EB'])
+    storage.bbox('UrbanDevelopmentAreas', -77.6, 37.4, -77.3, 37.7)
+
+Paths such as 'Common_Datasets.gpkg\\tbl_fc23' are read and written by read_table and
+write_table with the GeoPackage backend.  The cursor tokens OID@ and SHAPE@WKB can be
+used as field names with either backend.
+"""
+
+import os
+import re
+import sqlite3
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+GEOMETRY_FIELD = 'geom'
+FID_FIELD = 'fid'
+OID_TOKEN = 'OID@'
+WKB_TOKEN = 'SHAPE@WKB'
+
+# Size of the envelope after the GeoPackage geometry header, by envelope code
+_ENVELOPE_BYTES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+_GEOPACKAGE_PATH = re.compile(r'^(.*?\.gpkg)(?:[\\/]+(.+))?$', re.IGNORECASE)
+
+
+def split_geopackage_path(table):
+    """ (GeoPackage file, table name) for paths inside a GeoPackage, otherwise None """
+    match = _GEOPACKAGE_PATH.match(str(table))
+    if match is None or match.group(2) is None:
+        return None
+    return match.group(1), match.group(2)
+
+
+def open_storage(location):
+    """ Storage backend for a .gpkg file or an arcpy workspace """
+    if str(location).lower().endswith('.gpkg'):
+        return GeoPackageStorage(location)
+    return ArcpyStorage(location)
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def geopackage_geometry(wkb, srs_id=0):
+    """ GeoPackage geometry blob with an xy envelope for a WKB geometry """
+    if wkb is None:
+        return None
+    import shapely
+
+    geometry = shapely.from_wkb(wkb)
+    if geometry.is_empty:
+        return b'GP' + bytes([0, 0x11]) + struct.pack('<i', srs_id) + bytes(wkb)
+    xmin, ymin, xmax, ymax = geometry.bounds
+    return b'GP' + bytes([0, 0x03]) + struct.pack('<i4d', srs_id, xmin, xmax, ymin, ymax) + bytes(wkb)
+
+
+def wkb_dimensions(wkb):
+    """ (has z, has m) of a WKB geometry, from its ISO or extended geometry type """
+    geometry_type = struct.unpack('<I' if wkb[0] == 1 else '>I', bytes(wkb[1:5]))[0]
+    if geometry_type & 0xC0000000:
+        return bool(geometry_type & 0x80000000), bool(geometry_type & 0x40000000)
+    return geometry_type // 1000 in (1, 3), geometry_type // 1000 in (2, 3)
+
+
+def geopackage_wkb(blob):
+    """ WKB of a GeoPackage geometry blob """
+    if blob is None:
+        return None
+    flags = blob[3]
+    return bytes(blob[8 + _ENVELOPE_BYTES[(flags >> 1) & 0x07]:])
+
+
+class GeoPackageStorage:
+    """ Datasets in a GeoPackage """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES
+                ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL),
+                ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', NULL);
+            CREATE TABLE IF NOT EXISTS gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+                description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+            CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+                CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name));
+            CREATE TABLE IF NOT EXISTS gpkg_extensions (
+                table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL,
+                scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+        """)
+        # Setting the application id rewrites the file header even when it is unchanged, which
+        # would change the modification time of the file on every read
+        if connection.execute('PRAGMA application_id').fetchone()[0] != 1196444487:
+            connection.execute('PRAGMA application_id = 1196444487')
+        return connection
+
+    def exists(self, name):
+        with self._connect() as connection:
+            return connection.execute('SELECT 1 FROM gpkg_contents WHERE table_name = ?', (name,)).fetchone() is not None
+
+    def _require(self, name):
+        """ Raises an exception when the dataset is not in the GeoPackage """
+        if not os.path.isfile(self.path) or not self.exists(name):
+            raise Exception(f'{name} does not exist in {self.path}')
+
+    def _geometry_field(self, connection, name):
+        row = connection.execute('SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def has_geometry(self, name):
+        """ Whether a dataset is a feature class """
+        with self._connect() as connection:
+            return self._geometry_field(connection, name) is not None
+
+    def fields(self, name):
+        """ Attribute field names of a dataset """
+        self._require(name)
+        with self._connect() as connection:
+            geometry_field = self._geometry_field(connection, name)
+            columns = [row[1] for row in connection.execute(f'PRAGMA table_info({_quote(name)})')]
+        return [column for column in columns if column not in (FID_FIELD, geometry_field)]
+
+    def _select(self, connection, name, fields):
+        geometry_field = self._geometry_field(connection, name)
+        columns = []
+        for field in fields:
+            if field == OID_TOKEN:
+                columns.append(_quote(FID_FIELD))
+            elif field == WKB_TOKEN:
+                if geometry_field is None:
+                    raise Exception(f'{name} in {self.path} has no geometry')
+                columns.append(_quote(geometry_field))
+            else:
+                columns.append(_quote(field))
+        return ', '.join(columns)
+
+    def _frames(self, cursor, fields, chunk_size):
+        while True:
+            rows = cursor.fetchmany(chunk_size) if chunk_size else cursor.fetchall()
+            if not rows:
+                return
+            columns = list(zip(*rows))
+            del rows
+            df = pd.DataFrame({field: np.fromiter(values, dtype=object, count=len(values)) for field, values in zip(fields, columns)})
+            for field in fields:
+                if field == WKB_TOKEN:
+                    df[field] = [geopackage_wkb(blob) for blob in df[field]]
+                else:
+                    df[field] = df[field].infer_objects()
+            yield df
+            if not chunk_size:
+                return
+
+    def read_chunks(self, name, fields=None, where_clause=None, chunk_size=None, parameters=()):
+        """ Yields the dataset as DataFrames of at most chunk_size rows (all rows when
+        chunk_size is None).  where_clause is SQL """
+        self._require(name)
+        fields = self.fields(name) if fields is None else list(fields)
+        with self._connect() as connection:
+            sql = f'SELECT {self._select(connection, name, fields)} FROM {_quote(name)}'
+            if where_clause:
+                sql += f' WHERE {where_clause}'
+            cursor = connection.execute(sql, parameters)
+            empty = True
+            for df in self._frames(cursor, fields, chunk_size):
+                empty = False
+                yield df
+            if empty:
+                yield pd.DataFrame(columns=fields)
+
+    def read(self, name, fields=None, where_clause=None):
+        return next(self.read_chunks(name, fields, where_clause))
+
+    def write(self, name, df, geometry=None, srs_id=0, route_field='RTE_NM', from_field='BEGIN_MSR'):
+        """ Writes the DataFrame to the dataset, replacing it.  geometry is an optional
+        array of WKB shapes, one per row, which are also indexed in an R-tree """
+        df = df.reset_index(drop=True)
+        with self._connect() as connection:
+            self._drop(connection, name)
+            column_types = []
+            for field in df.columns:
+                column = df[field]
+                if pd.api.types.is_bool_dtype(column) or pd.api.types.is_integer_dtype(column):
+                    column_types.append(f'{_quote(field)} INTEGER')
+                elif pd.api.types.is_numeric_dtype(column):
+                    column_types.append(f'{_quote(field)} REAL')
+                else:
+                    column_types.append(f'{_quote(field)} TEXT')
+            geometry_column = [f'{_quote(GEOMETRY_FIELD)} BLOB'] if geometry is not None else []
+            connection.execute(f'CREATE TABLE {_quote(name)} ({_quote(FID_FIELD)} INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               + ', '.join(geometry_column + column_types) + ')')
+
+            values = [pd.Series(df[field]).astype(object).where(df[field].notna(), None).tolist() for field in df.columns]
+            blobs = []
+            if geometry is not None:
+                blobs = [geopackage_geometry(None if wkb is None else bytes(wkb), srs_id) for wkb in geometry]
+                values = [blobs] + values
+            placeholders = ', '.join('?' * (len(df.columns) + (geometry is not None)))
+            insert_columns = ', '.join(([_quote(GEOMETRY_FIELD)] if geometry is not None else []) + [_quote(field) for field in df.columns])
+            connection.executemany(f'INSERT INTO {_quote(name)} ({insert_columns}) VALUES ({placeholders})', zip(*values) if values else [])
+
+            data_type = 'features' if geometry is not None else 'attributes'
+            connection.execute('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, NULL)',
+                               (f'EPSG:{srs_id}', srs_id, 'EPSG', srs_id, 'undefined'))
+            connection.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                               (name, data_type, name, srs_id))
+            if route_field in df.columns:
+                index_fields = ', '.join(_quote(field) for field in (route_field, from_field) if field in df.columns)
+                connection.execute(f'CREATE INDEX {_quote("idx_" + name + "_route")} ON {_quote(name)} ({index_fields})')
+            if geometry is not None:
+                self._index_geometry(connection, name, blobs, srs_id)
+        return os.path.join(self.path, name)
+
+    def _index_geometry(self, connection, name, blobs, srs_id):
+        rtree = _quote(f'rtree_{name}_{GEOMETRY_FIELD}')
+        first = next((blob for blob in blobs if blob is not None), None)
+        z, m = wkb_dimensions(geopackage_wkb(first)) if first is not None else (False, False)
+        connection.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)', (name, GEOMETRY_FIELD, 'GEOMETRY', srs_id, int(z), int(m)))
+        connection.execute('INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+                           (name, GEOMETRY_FIELD, 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only'))
+        connection.execute(f'CREATE VIRTUAL TABLE {rtree} USING rtree(id, minx, maxx, miny, maxy)')
+        extents = []
+        for fid, blob in enumerate(blobs, start=1):
+            if blob is not None and (blob[3] >> 1) & 0x07 == 1:
+                xmin, xmax, ymin, ymax = struct.unpack('<4d', blob[8:40])
+                extents.append((fid, xmin, xmax, ymin, ymax))
+        connection.executemany(f'INSERT INTO {rtree} VALUES (?, ?, ?, ?, ?)', extents)
+        if extents:
+            bounds = np.array([extent[1:] for extent in extents])
+            connection.execute('UPDATE gpkg_contents SET min_x = ?, max_x = ?, min_y = ?, max_y = ? WHERE table_name = ?',
+                               (bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 2].min(), bounds[:, 3].max(), name))
+
+    def _drop(self, connection, name):
+        connection.execute(f'DROP TABLE IF EXISTS {_quote(name)}')
+        connection.execute(f'DROP TABLE IF EXISTS {_quote(f"rtree_{name}_{GEOMETRY_FIELD}")}')
+        for table in ('gpkg_contents', 'gpkg_geometry_columns', 'gpkg_extensions'):
+            connection.execute(f'DELETE FROM {table} WHERE table_name = ?', (name,))
+
+    def delete(self, name):
+        with self._connect() as connection:
+            self._drop(connection, name)
+
+    def routes(self, name, routes, fields=None, route_field='RTE_NM'):
+        """ Rows of the dataset on the routes, found with the route index """
+        routes = list(dict.fromkeys(routes))
+        frames = []
+        # SQLite limits the number of parameters in one statement
+        for start in range(0, max(len(routes), 1), 500):
+            batch = routes[start:start + 500]
+            where_clause = f'{_quote(route_field)} IN ({", ".join("?" * len(batch))})' if batch else '0'
+            frames.append(next(self.read_chunks(name, fields, where_clause, parameters=batch)))
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def bbox(self, name, xmin, ymin, xmax, ymax, fields=None):
+        """ Rows of the dataset whose shape extent intersects the box, found with the R-tree """
+        rtree = _quote(f'rtree_{name}_{GEOMETRY_FIELD}')
+        where_clause = (f'{_quote(FID_FIELD)} IN (SELECT id FROM {rtree} '
+                        'WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?)')
+        return next(self.read_chunks(name, fields, where_clause, parameters=(xmax, xmin, ymax, ymin)))
+
+
+class ArcpyStorage:
+    """ Datasets in a geodatabase or other arcpy workspace """
+
+    def __init__(self, workspace):
+        self.path = str(workspace)
+
+    def _table(self, name):
+        return os.path.join(self.path, name)
+
+    def exists(self, name):
+        import arcpy
+
+        return arcpy.Exists(self._table(name))
+
+    def fields(self, name):
+        from needs_tools.tables import list_fields
+
+        return list_fields(self._table(name))
+
+    def read_chunks(self, name, fields=None, where_clause=None, chunk_size=None):
+        from needs_tools.tables import CHUNK_ROWS, read_chunks
+
+        return read_chunks(self._table(name), fields, where_clause, chunk_size or CHUNK_ROWS)
+
+    def read(self, name, fields=None, where_clause=None):
+        from needs_tools.tables import read_table
+
+        return read_table(self._table(name), fields, where_clause)
+
+    def write(self, name, df, geometry=None, srs_id=0, route_field='RTE_NM', from_field='BEGIN_MSR'):
+        """ Writes the DataFrame to a table, with an attribute index on the route field.
+        Writing geometry is left to the arcpy geoprocessing tools """
+        import arcpy
+        from needs_tools.tables import write_table
+
+        if geometry is not None:
+            raise Exception('ArcpyStorage does not write geometry, use the geoprocessing tools')
+        out_table = write_table(df, self._table(name))
+        if route_field in df.columns:
+            arcpy.AddIndex_management(out_table, [route_field], f'idx_{name}_route')
+        return out_table
+
+    def delete(self, name):
+        import arcpy
+
+        if arcpy.Exists(self._table(name)):
+            arcpy.Delete_management(self._table(name))
+
+    def routes(self, name, routes, fields=None, route_field='RTE_NM'):
+        """ Rows of the dataset on the routes, using the geodatabase's attribute index """
+        routes = list(dict.fromkeys(routes))
+        frames = []
+        for start in range(0, max(len(routes), 1), 500):
+            batch = [str(route).replace("'", "''") for route in routes[start:start + 500]]
+            where_clause = f"{route_field} IN ({', '.join(f'{chr(39)}{route}{chr(39)}' for route in batch)})" if batch else '1 = 0'
+            frames.append(self.read(name, fields, where_clause))
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def bbox(self, name, xmin, ymin, xmax, ymax, fields=None):
+        """ Rows of the dataset whose shape intersects the box, using the spatial index """
+        import arcpy
+
+        fields = self.fields(name) if fields is None else list(fields)
+        extent = arcpy.Extent(xmin, ymin, xmax, ymax).polygon
+        with arcpy.da.SearchCursor(self._table(name), fields, spatial_filter=extent) as cursor:
+            return pd.DataFrame([row for row in cursor], columns=fields)
+
+
+def copy_to_geopackage(workspace, gpkg, names):
+    """ Copies datasets from an arcpy workspace to a GeoPackage under the same names, with
+    the shapes of feature classes as WKB """
+    import arcpy
+
+    source = ArcpyStorage(workspace)
+    target = GeoPackageStorage(gpkg)
+    for name in names:
+        print(f'  Copying {name}')
+        fields = source.fields(name)
+        if arcpy.Describe(os.path.join(workspace, name)).dataType == 'FeatureClass':
+            df = source.read(name, [WKB_TOKEN] + fields)
+            srs_id = arcpy.Describe(os.path.join(workspace, name)).spatialReference.factoryCode
+            target.write(name, df[fields], geometry=df[WKB_TOKEN], srs_id=srs_id)
+        else:
+            target.write(name, source.read(name, fields))
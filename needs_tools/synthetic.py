@@ -0,0 +1,535 @@
+""" Synthetic statewide route network and event tables for scale testing.
+
+The real Common_Datasets.gdb cannot be shipped with the repository, so this module makes
+stand-ins with the same dataset names, field names and value formats, at any size:
+
+    python -m needs_tools.synthetic synthetic\\Common_Datasets.gpkg --routes 20000
+
+SDE_VDOT_RTE_OVERLAP_LRS_DY has route names in the LRS formats (R-VA   IS00064EB,
+R-VA043SC00620NB, S-VA122PR MAIN ST), the prime and non-prime direction routes of divided
+roads as opposite-direction pairs, and M-aware polylines in longitude and latitude whose
+M values are miles along the route.  The event tables (CoSS, RN, LA, FC, TMC, PSI and
+PSAP) are cut from the routes, and the activity centers, fixed guideway transit stops,
+block groups, MPO and regional network boundaries are placed around them.  The TMC
+performance measures and PSI tables are written as CSV files next to the GeoPackage.
+
+Events scale with the number of roads: about 7 route events per road over every table,
+so 100 roads give several hundred events and 300000 roads a couple of million.  The same
+seed always gives the same data.
+
+shapely 2 is required for the polygons and is imported when they are made.
+"""
+
+import argparse
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+# Extent of the state in degrees, and miles per degree at its middle latitude
+EXTENT = (-83.67, 36.54, -75.24, 39.47)
+MILES_PER_DEGREE_Y = 69.0
+MILES_PER_DEGREE_X = 69.17 * np.cos(np.radians(38.0))
+
+SRS_ID = 4326
+
+# Share of routes, share that are divided, and log-normal route length (median miles and
+# spread) of each route type
+ROUTE_TYPES = pd.DataFrame([
+    ('IS', 0.01, 1.00, 30.0, 0.6),
+    ('US', 0.04, 0.60, 15.0, 0.8),
+    ('SR', 0.10, 0.30, 6.0, 0.9),
+    ('SC', 0.55, 0.03, 1.2, 0.9),
+    ('ST', 0.30, 0.10, 0.4, 0.8),
+], columns=['type', 'share', 'divided', 'median_miles', 'spread'])
+
+STREET_NAMES = ['MAIN', 'BROAD', 'CHURCH', 'HIGH', 'MILL', 'WASHINGTON', 'JEFFERSON', 'MADISON', 'MONROE', 'OAK',
+                'PINE', 'MAPLE', 'CEDAR', 'ELM', 'SPRING', 'RIVER', 'LEE', 'JACKSON', 'FRANKLIN', 'GRACE']
+STREET_SUFFIXES = ['ST', 'AVE', 'RD', 'BLVD', 'DR', 'LN']
+
+ACCESS_CONTROL = ['Full Access Control', 'Partial Access Control']
+FACILITY_TYPES = ['1-One-Way Undivided', '2-Two-Way Undivided', '3-Two-Way Divided']
+ACTIVITY_CENTER_TYPES = ['local serving', 'knowledge', 'freight', 'tourism']
+
+# Vertices per mile of the route polylines, and the distance in miles between the two
+# directions of a divided road
+VERTICES_PER_MILE = 8
+DIVIDED_OFFSET_MILES = 0.01
+
+
+def _miles_to_degrees(dx, dy):
+    return dx / MILES_PER_DEGREE_X, dy / MILES_PER_DEGREE_Y
+
+
+def linestring_m_wkb(coords):
+    """ ISO WKB of a LineString M from an (n, 3) array of x, y and m """
+    coords = np.ascontiguousarray(coords, dtype='<f8')
+    return struct.pack('<BII', 1, 2002, len(coords)) + coords.tobytes()
+
+
+def point_wkb(x, y):
+    """ WKB of points """
+    return [struct.pack('<BIdd', 1, 1, px, py) for px, py in zip(x, y)]
+
+
+class SyntheticLRS:
+    """ Route network of prime and non-prime direction routes with M-aware polylines.
+
+    The vertices of every route are kept in one (n, 3) array of x, y and m, with the first
+    vertex of route i at offsets[i].  The non-prime direction of a divided road runs the
+    other way, a short distance from the prime direction.
+    """
+
+    def __init__(self, n_roads, seed=0):
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+
+        # Prime direction roads of each type, with one route number per road
+        types = rng.choice(len(ROUTE_TYPES), n_roads, p=ROUTE_TYPES['share'] / ROUTE_TYPES['share'].sum())
+        divided = rng.random(n_roads) < ROUTE_TYPES['divided'].to_numpy()[types]
+        lengths = np.round(np.clip(ROUTE_TYPES['median_miles'].to_numpy()[types]
+                                   * np.exp(rng.normal(0, ROUTE_TYPES['spread'].to_numpy()[types])), 0.05, 300), 3)
+        roads = pd.DataFrame({'type': ROUTE_TYPES['type'].to_numpy()[types], 'divided': divided, 'length': lengths})
+        roads['number'] = roads.groupby('type').cumcount() + 1
+        roads['north_south'] = rng.random(n_roads) < 0.5
+        roads['jurisdiction'] = rng.integers(1, 200, n_roads)
+        self._road_names(roads)
+
+        # Divided roads get a non-prime direction route as well
+        prime = roads.assign(prime=True, road=np.arange(n_roads))
+        non_prime = prime.loc[prime['divided']].assign(prime=False)
+        routes = pd.concat([prime, non_prime], ignore_index=True)
+        routes = routes.sort_values(['road', 'prime'], ascending=[True, False], kind='stable').reset_index(drop=True)
+        routes['RTE_NM'] = np.where(routes['prime'], routes['prime_name'], routes['non_prime_name'])
+        routes['RTE_DIRECTION_CD'] = np.where(routes['north_south'], np.where(routes['prime'], 'NB', 'SB'),
+                                              np.where(routes['prime'], 'EB', 'WB'))
+        self.routes = routes
+        self.road = routes['road'].to_numpy()
+        self.prime = routes['prime'].to_numpy()
+        self.lengths = routes['length'].to_numpy()
+
+        # The other direction of each divided road, or -1
+        first = np.flatnonzero(np.append(True, self.road[1:] != self.road[:-1]))
+        count = np.diff(np.append(first, len(routes)))
+        first_of_road = np.repeat(first, count)
+        self.opposite = np.where(np.repeat(count, count) == 2, np.where(self.prime, first_of_road + 1, first_of_road), -1)
+
+        self._make_lines(n_roads)
+
+    def _road_names(self, roads):
+        """ Prime and non-prime route names, street names and common names of the roads """
+        rng = self.rng
+        number = roads['number'].to_numpy()
+        street = np.array(STREET_NAMES, dtype=object)[rng.integers(0, len(STREET_NAMES), len(roads))]
+        suffix = np.array(STREET_SUFFIXES, dtype=object)[rng.integers(0, len(STREET_SUFFIXES), len(roads))]
+        prime_names, non_prime_names, street_names, common_names = [], [], [], []
+        for route_type, n, north_south, jurisdiction, name, kind in zip(
+                roads['type'], number, roads['north_south'], roads['jurisdiction'], street, suffix):
+            prime_direction, non_prime_direction = ('NB', 'SB') if north_south else ('EB', 'WB')
+            if route_type == 'ST':
+                # Street names repeat between jurisdictions, the number keeps them unique
+                street_name = f'{name} {kind} {n}'
+                prime_names.append(f'S-VA{jurisdiction:03d}PR {street_name}')
+                non_prime_names.append(f'S-VA{jurisdiction:03d}NP {street_name}')
+                common_names.append(street_name)
+            elif route_type == 'SC':
+                prime_names.append(f'R-VA{jurisdiction:03d}SC{n:05d}{prime_direction}')
+                non_prime_names.append(f'R-VA{jurisdiction:03d}SC{n:05d}{non_prime_direction}')
+                street_name = f'{name} {kind}'
+                common_names.append(f'SR {n}')
+            else:
+                prime_names.append(f'R-VA   {route_type}{n:05d}{prime_direction}')
+                non_prime_names.append(f'R-VA   {route_type}{n:05d}{non_prime_direction}')
+                street_name = f'{name} {kind}'
+                common_names.append({'IS': 'I-', 'US': 'US ', 'SR': 'SR '}[route_type] + str(n))
+            street_names.append(street_name.upper())
+        roads['prime_name'] = prime_names
+        roads['non_prime_name'] = non_prime_names
+        roads['RTE_STREET_NM'] = street_names
+        roads['RTE_COMMON_NM'] = common_names
+
+    def _make_lines(self, n_roads):
+        """ Random walk polylines of the roads, heading mostly north or east """
+        rng = self.rng
+        road_lengths = np.zeros(n_roads)
+        road_lengths[self.road] = self.lengths
+        vertices = np.clip(np.ceil(road_lengths * VERTICES_PER_MILE).astype(np.int64) + 1, 2, 2000)
+        road_of_vertex = np.repeat(np.arange(n_roads), vertices)
+        first = np.cumsum(vertices) - vertices
+        step = road_lengths / (vertices - 1)
+
+        # Headings drift a little at each vertex
+        north_south = np.zeros(n_roads, dtype=bool)
+        north_south[self.road] = self.routes['north_south'].to_numpy()
+        heading = np.where(north_south, np.pi / 2, 0) + rng.normal(0, 0.3, n_roads)
+        turns = rng.normal(0, 0.08, len(road_of_vertex))
+        turns[first] = 0
+        turn_sum = np.cumsum(turns)
+        headings = heading[road_of_vertex] + turn_sum - turn_sum[first][road_of_vertex]
+
+        dx = np.cos(headings) * step[road_of_vertex]
+        dy = np.sin(headings) * step[road_of_vertex]
+        dx[first] = 0
+        dy[first] = 0
+        x_sum, y_sum = np.cumsum(dx), np.cumsum(dy)
+        x_miles = x_sum - x_sum[first][road_of_vertex]
+        y_miles = y_sum - y_sum[first][road_of_vertex]
+        m = np.arange(len(road_of_vertex)) - first[road_of_vertex]
+        m = np.minimum(m * step[road_of_vertex], road_lengths[road_of_vertex])
+
+        start_x = rng.uniform(EXTENT[0], EXTENT[2], n_roads)
+        start_y = rng.uniform(EXTENT[1], EXTENT[3], n_roads)
+        x_degrees, y_degrees = _miles_to_degrees(x_miles, y_miles)
+        prime_coords = np.column_stack([start_x[road_of_vertex] + x_degrees, start_y[road_of_vertex] + y_degrees, np.round(m, 6)])
+
+        # Each route's vertices.  A non-prime route is its road reversed and moved to the left
+        # of the prime direction, with measures from its own start
+        parts = []
+        offsets = [0]
+        offset_x, offset_y = _miles_to_degrees(-np.sin(headings) * DIVIDED_OFFSET_MILES, np.cos(headings) * DIVIDED_OFFSET_MILES)
+        for road, prime in zip(self.road, self.prime):
+            start, stop = first[road], first[road] + vertices[road]
+            if prime:
+                coords = prime_coords[start:stop]
+            else:
+                coords = prime_coords[start:stop][::-1].copy()
+                coords[:, 0] += offset_x[start:stop][::-1]
+                coords[:, 1] += offset_y[start:stop][::-1]
+                coords[:, 2] = road_lengths[road] - coords[:, 2]
+            parts.append(coords)
+            offsets.append(offsets[-1] + len(coords))
+        self.coords = np.concatenate(parts)
+        self.offsets = np.array(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.routes)
+
+    @property
+    def names(self):
+        return self.routes['RTE_NM'].to_numpy(dtype=object)
+
+    def frame(self):
+        """ LRS fields of the routes """
+        names = self.names
+        return pd.DataFrame({
+            'RTE_NM': names,
+            'RTE_OPPOSITE_DIRECTION_RTE_NM': np.where(self.opposite >= 0, names[np.maximum(self.opposite, 0)], None),
+            'RTE_PARENT_RTE_NM': np.where(self.prime, names, names[np.maximum(self.opposite, 0)]),
+            'RTE_DIRECTION_CD': self.routes['RTE_DIRECTION_CD'].to_numpy(dtype=object),
+            'RTE_STREET_NM': self.routes['RTE_STREET_NM'].to_numpy(dtype=object),
+            'RTE_COMMON_NM': self.routes['RTE_COMMON_NM'].to_numpy(dtype=object),
+            'RTE_TYPE_CD': self.routes['type'].to_numpy(dtype=object),
+            'RTE_FROM_MSR': 0.0,
+            'RTE_TO_MSR': self.lengths
+        })
+
+    def route_coords(self, route):
+        """ (n, 3) array of x, y and m of a route """
+        return self.coords[self.offsets[route]:self.offsets[route + 1]]
+
+    def wkb(self):
+        """ WKB LineString M of each route """
+        return [linestring_m_wkb(self.route_coords(route)) for route in range(len(self))]
+
+    def locate(self, routes, measures):
+        """ x and y of the points at the measures on the routes """
+        routes = np.asarray(routes, dtype=np.int64)
+        measures = np.clip(np.asarray(measures, dtype=np.float64), 0, self.lengths[routes])
+
+        # Measures increase along each route, so adding the end measures of the routes before
+        # it makes one increasing key for every vertex
+        shift = np.cumsum(np.append(0, self.lengths + 1))
+        vertex_route = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        key = self.coords[:, 2] + shift[vertex_route]
+        after = np.clip(np.searchsorted(key, measures + shift[routes], side='right'), self.offsets[routes] + 1, self.offsets[routes + 1] - 1)
+        before = after - 1
+        span = self.coords[after, 2] - self.coords[before, 2]
+        fraction = np.where(span > 0, (measures - self.coords[before, 2]) / np.where(span > 0, span, 1), 0)
+        x = self.coords[before, 0] + fraction * (self.coords[after, 0] - self.coords[before, 0])
+        y = self.coords[before, 1] + fraction * (self.coords[after, 1] - self.coords[before, 1])
+        return x, y
+
+    def segment_wkb(self, routes, begin, end):
+        """ WKB LineString M of the part of each route between the measures """
+        start_x, start_y = self.locate(routes, begin)
+        end_x, end_y = self.locate(routes, end)
+        shapes = []
+        for route, low, high, x0, y0, x1, y1 in zip(routes, begin, end, start_x, start_y, end_x, end_y):
+            coords = self.route_coords(route)
+            inside = coords[(coords[:, 2] > low) & (coords[:, 2] < high)]
+            shapes.append(linestring_m_wkb(np.vstack([[x0, y0, low], inside, [x1, y1, high]])))
+        return shapes
+
+    def route_events(self, routes, piece_miles, coverage=1.0, mirror=True):
+        """ Events on the routes that do not overlap.  Each route is cut at random measures
+        about piece_miles apart and coverage of the pieces are kept.  With mirror, the
+        events of prime direction routes are repeated on their non-prime direction route.
+        Returns a DataFrame of RTE_NM, BEGIN_MSR and END_MSR and the route of each event """
+        rng = self.rng
+        routes = np.asarray(routes, dtype=np.int64)
+        if mirror:
+            routes = routes[self.prime[routes]]
+        lengths = self.lengths[routes]
+        cuts = rng.poisson(lengths / piece_miles)
+
+        # The start, end and cut measures of every route, sorted by route and measure
+        route_of_point = np.concatenate([np.arange(len(routes)), np.arange(len(routes)), np.repeat(np.arange(len(routes)), cuts)])
+        measures = np.round(np.concatenate([np.zeros(len(routes)), lengths, rng.random(cuts.sum()) * np.repeat(lengths, cuts)]), 3)
+        order = np.lexsort((measures, route_of_point))
+        route_of_point, measures = route_of_point[order], measures[order]
+
+        piece = (route_of_point[1:] == route_of_point[:-1]) & (measures[1:] > measures[:-1])
+        piece &= rng.random(len(piece)) < coverage
+        route = routes[route_of_point[:-1][piece]]
+        begin = measures[:-1][piece]
+        end = measures[1:][piece]
+
+        if mirror:
+            opposite = self.opposite[route] >= 0
+            length = self.lengths[route[opposite]]
+            route = np.concatenate([route, self.opposite[route[opposite]]])
+            begin, end = np.concatenate([begin, np.round(length - end[opposite], 3)]), np.concatenate([end, np.round(length - begin[opposite], 3)])
+
+        df = pd.DataFrame({'RTE_NM': self.names[route], 'BEGIN_MSR': begin, 'END_MSR': end})
+        return df, route
+
+    def routes_of_type(self, *types):
+        return np.flatnonzero(self.routes['type'].isin(types).to_numpy())
+
+
+def _choice(rng, values, n, p=None):
+    return np.array(values, dtype=object)[rng.choice(len(values), n, p=p)]
+
+
+def coss_table(lrs):
+    """ tbl_coss_2023: corridors of statewide significance on interstates, US routes and some
+    state routes """
+    rng = lrs.rng
+    candidates = np.concatenate([lrs.routes_of_type('IS', 'US'), rng.permutation(lrs.routes_of_type('SR'))[:len(lrs.routes_of_type('SR')) // 5]])
+    df, route = lrs.route_events(candidates, piece_miles=8)
+    corridor = lrs.road[route] % 12
+    df['COSS'] = 1
+    df['COSS_NAME'] = [f'{chr(65 + c)} Corridor' for c in corridor]
+    df['Primary'] = np.where(lrs.routes['type'].to_numpy()[route] == 'IS', 'YES', 'NO')
+    return df
+
+
+def regional_network_table(lrs):
+    """ tbl_regional_networks: most non-local roads inside a regional network """
+    df, route = lrs.route_events(lrs.routes_of_type('IS', 'US', 'SR', 'SC', 'ST'), piece_miles=3, coverage=0.4)
+    df['RN'] = 1
+    df['RN_Name'] = [f'Regional Network {r % 15 + 1}' for r in lrs.road[route]]
+    return df
+
+
+def limited_access_table(lrs):
+    """ tbl_limited_access: interstates and some divided US routes, with RTE_FROM_MSR and
+    RTE_TO_MSR like the source table """
+    rng = lrs.rng
+    divided_us = lrs.routes_of_type('US')
+    divided_us = divided_us[(lrs.opposite[divided_us] >= 0) & (rng.random(len(divided_us)) < 0.3)]
+    df, route = lrs.route_events(np.concatenate([lrs.routes_of_type('IS'), divided_us]), piece_miles=20)
+    df['RIM_ACCESS_CONTROL_DSC'] = np.where(lrs.routes['type'].to_numpy()[route] == 'IS', ACCESS_CONTROL[0],
+                                            _choice(rng, ACCESS_CONTROL, len(df), [0.3, 0.7]))
+    return df.rename(columns={'BEGIN_MSR': 'RTE_FROM_MSR', 'END_MSR': 'RTE_TO_MSR'})
+
+
+def functional_class_table(lrs):
+    """ tbl_fc23: a functional class on every mile of every route """
+    df, route = lrs.route_events(np.arange(len(lrs)), piece_miles=2)
+    classes = {'IS': ([1], None), 'US': ([2, 3], [0.4, 0.6]), 'SR': ([3, 4, 5], [0.3, 0.4, 0.3]),
+               'SC': ([4, 5, 6, 7], [0.1, 0.2, 0.2, 0.5]), 'ST': ([4, 5, 6, 7], [0.1, 0.1, 0.2, 0.6])}
+    route_types = lrs.routes['type'].to_numpy()[route]
+    fc = np.zeros(len(df), dtype=np.int64)
+    for route_type, (values, p) in classes.items():
+        rows = route_types == route_type
+        fc[rows] = lrs.rng.choice(values, rows.sum(), p=p)
+    df['STATE_FUNCT_CLASS_ID'] = fc
+    return df
+
+
+def tmc_tables(lrs):
+    """ (tbl_tmc_lrs_2023_master, PECC table, TTI table) for TMC segments on the main roads.
+    The LRS table has lowercase field names like the source table """
+    rng = lrs.rng
+    df, route = lrs.route_events(lrs.routes_of_type('IS', 'US', 'SR'), piece_miles=1.5, mirror=False)
+    df['tmc'] = [f'110{"+" if prime else "-"}{i:05d}' for i, prime in enumerate(lrs.prime[route])]
+    tmc = df[['tmc', 'RTE_NM', 'BEGIN_MSR', 'END_MSR']].rename(columns={'RTE_NM': 'rte_nm', 'BEGIN_MSR': 'begin_msr', 'END_MSR': 'end_msr'})
+
+    # PECC on limited access roads, TTI hours on the rest
+    interstate = lrs.routes['type'].to_numpy()[route] == 'IS'
+    pecc = pd.DataFrame({'TMC': tmc['tmc'][interstate].to_numpy(),
+                         'Final Weight': [f'{w:.2f}%' for w in rng.exponential(1.5, interstate.sum())]})
+    tti = pd.DataFrame({'tmc': tmc['tmc'].to_numpy(),
+                        'F22SHrGT13': rng.poisson(1.5, len(tmc)), 'F22SHrGT15': rng.poisson(0.5, len(tmc))})
+    return tmc, pecc, tti
+
+
+def psi_tables(lrs):
+    """ (segment PSI table, intersection PSI table) like SEG_PSI_OIPI.csv and
+    INT_PSI_OIPI.csv.  Intersections are points on the main roads with the routes there """
+    rng = lrs.rng
+    df, route = lrs.route_events(lrs.routes_of_type('US', 'SR', 'SC'), piece_miles=0.5, coverage=0.03, mirror=False)
+    segments = df.rename(columns={'BEGIN_MSR': 'BEGIN_MP', 'END_MSR': 'END_MP'})
+    segments['DIRECTION'] = np.where(lrs.opposite[route] >= 0, 'One-Direction', 'Combined-Direction')
+    segments['TIER'] = _choice(rng, ['VTrans', 'District'], len(segments), [0.6, 0.4])
+
+    candidates = lrs.routes_of_type('US', 'SR', 'SC', 'ST')
+    route = candidates[rng.integers(0, len(candidates), max(len(candidates) // 20, 1))] if len(candidates) else np.zeros(0, dtype=np.int64)
+    measure = rng.random(len(route)) * lrs.lengths[route]
+    x, y = lrs.locate(route, measure)
+    names = lrs.names
+    crossing = names[rng.integers(0, len(lrs), len(route))]
+    intersections = pd.DataFrame({
+        'LAT': y, 'LON': x,
+        'RTE_NAME': [f'{a};{b}' for a, b in zip(names[route], crossing)],
+        'TIER': _choice(rng, ['VTrans', 'District'], len(route), [0.6, 0.4])
+    })
+    return segments, intersections
+
+
+def psap_table(lrs):
+    """ psap4: pedestrian safety action plan segments with their shapes """
+    rng = lrs.rng
+    df, route = lrs.route_events(lrs.routes_of_type('US', 'SR', 'ST'), piece_miles=0.8, coverage=0.05, mirror=False)
+    divided = lrs.opposite[route] >= 0
+    df = df.rename(columns={'BEGIN_MSR': 'FMEAS', 'END_MSR': 'TMEAS'})
+    df['VDOT_DIVIDED'] = np.where(divided, 'Divided', 'Undivided')
+    df['UMIS_FACILITY_TYPE'] = np.where(divided, FACILITY_TYPES[2], _choice(rng, FACILITY_TYPES[:2], len(df), [0.2, 0.8]))
+    return df, lrs.segment_wkb(route, df['FMEAS'].to_numpy(), df['TMEAS'].to_numpy())
+
+
+def _random_points_on_roads(lrs, routes, n):
+    rng = lrs.rng
+    if len(routes) == 0 or n == 0:
+        return np.zeros(0), np.zeros(0)
+    route = routes[rng.integers(0, len(routes), n)]
+    return lrs.locate(route, rng.random(n) * lrs.lengths[route])
+
+
+def activity_centers(lrs):
+    """ VTrans_Activity_Centers: polygons around points on the roads """
+    import shapely
+
+    rng = lrs.rng
+    n = max(len(lrs) // 50, 1)
+    x, y = _random_points_on_roads(lrs, np.arange(len(lrs)), n)
+    radius = rng.uniform(0.3, 1.5, n) / MILES_PER_DEGREE_Y
+    polygons = shapely.buffer(shapely.points(x, y), radius, quad_segs=6)
+    df = pd.DataFrame({'AC_ID': np.arange(1, n + 1), 'prmry_c': _choice(rng, ACTIVITY_CENTER_TYPES, n, [0.4, 0.3, 0.2, 0.1])})
+    return df, shapely.to_wkb(polygons)
+
+
+def transit_stops(lrs):
+    """ FixedGuideway_Transit: GTFS stops along the main roads """
+    rng = lrs.rng
+    n = max(len(lrs) // 40, 1)
+    x, y = _random_points_on_roads(lrs, lrs.routes_of_type('IS', 'US', 'SR', 'ST'), n)
+    df = pd.DataFrame({'stop_id': [f'S{i:06d}' for i in range(len(x))],
+                       'stop_name': [f'Stop {i}' for i in range(len(x))],
+                       'agency': _choice(rng, ['WMATA', 'VRE', 'Amtrak', 'GRTC Pulse', 'HRT Tide'], len(x))})
+    return df, point_wkb(x, y)
+
+
+def block_groups(lrs):
+    """ Block_Group polygons on a grid over the state with EEA and transit flags.  Returns
+    (block groups, transit viability and underserved flags, shapes) """
+    import shapely
+
+    rng = lrs.rng
+    n = max(len(lrs) // 10, 4)
+    columns = int(np.ceil(np.sqrt(n * (EXTENT[2] - EXTENT[0]) / (EXTENT[3] - EXTENT[1]))))
+    rows = int(np.ceil(n / columns))
+    width = (EXTENT[2] - EXTENT[0]) / columns
+    height = (EXTENT[3] - EXTENT[1]) / rows
+    i, j = np.divmod(np.arange(rows * columns), columns)
+    polygons = shapely.box(EXTENT[0] + j * width, EXTENT[1] + i * height, EXTENT[0] + (j + 1) * width, EXTENT[1] + (i + 1) * height)
+
+    geoid = [f'51{c:03d}{t:06d}{b}' for c, t, b in zip(rng.integers(1, 840, len(i)), np.arange(len(i)) // 3 + 100, np.arange(len(i)) % 3 + 1)]
+    df = pd.DataFrame({'GEOID': geoid, 'eea': np.where(rng.random(len(i)) < 0.25, 'YES', 'NO')})
+    flags = pd.DataFrame({'GEOID': geoid,
+                          'TransitViability_Flag': (rng.random(len(i)) < 0.4).astype(int),
+                          'TransitUnderserved_Flag': (rng.random(len(i)) < 0.5).astype(int)})
+    return df, flags, shapely.to_wkb(polygons)
+
+
+def boundaries(lrs, name_field, prefix, count):
+    """ Polygons of regions around the state, such as MPOs and regional networks """
+    import shapely
+
+    rng = lrs.rng
+    x = rng.uniform(EXTENT[0], EXTENT[2], count)
+    y = rng.uniform(EXTENT[1], EXTENT[3], count)
+    polygons = shapely.buffer(shapely.points(x, y), rng.uniform(0.2, 0.6, count), quad_segs=8)
+    return pd.DataFrame({name_field: [f'{prefix} {i + 1}' for i in range(count)]}), shapely.to_wkb(polygons)
+
+
+def generate(gpkg, n_roads=1000, seed=0):
+    """ Writes the synthetic datasets to a GeoPackage under their Common_Datasets.gdb
+    names, and the CSV inputs to the same folder.  Returns the number of rows of each """
+    from needs_tools.storage import GeoPackageStorage
+
+    folder = os.path.dirname(os.path.abspath(gpkg))
+    os.makedirs(folder, exist_ok=True)
+    storage = GeoPackageStorage(gpkg)
+    counts = {}
+
+    def write(name, df, geometry=None, route_field='RTE_NM', from_field='BEGIN_MSR'):
+        storage.write(name, df, geometry, SRS_ID if geometry is not None else 0, route_field, from_field)
+        counts[name] = len(df)
+        print(f'  {name}: {len(df)} rows')
+
+    def write_csv(name, df):
+        df.to_csv(os.path.join(folder, name), index=False)
+        counts[name] = len(df)
+        print(f'  {name}: {len(df)} rows')
+
+    print(f'Generating {n_roads} roads')
+    lrs = SyntheticLRS(n_roads, seed)
+    write('SDE_VDOT_RTE_OVERLAP_LRS_DY', lrs.frame(), lrs.wkb(), from_field='RTE_FROM_MSR')
+    write('tbl_coss_2023', coss_table(lrs))
+    write('tbl_regional_networks', regional_network_table(lrs))
+    write('tbl_limited_access', limited_access_table(lrs), from_field='RTE_FROM_MSR')
+    write('tbl_fc23', functional_class_table(lrs))
+
+    tmc, pecc, tti = tmc_tables(lrs)
+    write('tbl_tmc_lrs_2023_master', tmc, route_field='rte_nm', from_field='begin_msr')
+    write_csv('PECC_2022.csv', pecc)
+    write_csv('2022_TTI_WA.csv', tti)
+
+    segments, intersections = psi_tables(lrs)
+    write_csv('SEG_PSI_OIPI.csv', segments)
+    write_csv('INT_PSI_OIPI.csv', intersections)
+
+    psap, psap_shapes = psap_table(lrs)
+    write('psap4', psap, psap_shapes, from_field='FMEAS')
+
+    for name, (df, shapes) in [('VTrans_Activity_Centers', activity_centers(lrs)),
+                               ('FixedGuideway_Transit', transit_stops(lrs)),
+                               ('MPO', boundaries(lrs, 'MPO_NAME', 'MPO', 15)),
+                               ('RegionalNetworks', boundaries(lrs, 'RN_Name', 'Regional Network', 15))]:
+        write(name, df, shapes)
+
+    groups, flags, group_shapes = block_groups(lrs)
+    write('Block_Group', groups, group_shapes)
+    write('transit_viability_underserved', flags, group_shapes)
+
+    events = sum(count for name, count in counts.items() if name.startswith('tbl_') or name == 'psap4')
+    print(f'{len(lrs)} routes and {events} route events written to {gpkg}')
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m needs_tools.synthetic',
+                                     description='Writes a synthetic LRS and event tables to a GeoPackage')
+    parser.add_argument('gpkg', help='GeoPackage to write, e.g. synthetic\\Common_Datasets.gpkg')
+    parser.add_argument('--routes', type=int, default=1000, help='number of roads (divided roads get two routes)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+    generate(args.gpkg, args.routes, args.seed)
+
+
+if __name__ == '__main__':
+    main()
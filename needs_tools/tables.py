@@ -0,0 +1,361 @@
+""" Read and write event tables as pandas DataFrames.
+
+Tables can be DataFrames, CSV files, Parquet files, GeoPackage tables or geodatabase
+tables.  Tables are read
+in chunks of typed columns, so only one chunk of rows is held as Python objects at a time.
+Filters on a Parquet file are passed to pyarrow, so rows that do not match are dropped as
+the file is read.  Fields of a geodatabase table are set from whole columns with
+update_columns.  arcpy is only imported when a geodatabase table is read or written, and
+pyarrow when a Parquet file is read.
+"""
+
+import ast
+import itertools
+import operator
+
+import numpy as np
+import pandas as pd
+
+from needs_tools.event_store import read_events_frame, write_events
+from needs_tools.storage import GeoPackageStorage, split_geopackage_path
+from needs_tools.trace import traced
+
+# Fields that are managed by the geodatabase and are never copied between tables
+SYSTEM_FIELD_TYPES = ('OID', 'Geometry', 'GlobalID', 'Blob', 'Raster')
+SYSTEM_FIELD_NAMES = ('Shape_Length', 'Shape_Area')
+
+# Rows read from a table at a time
+CHUNK_ROWS = 100000
+
+# Comparisons of a DataFrame.query expression that have a pyarrow equivalent
+ARROW_COMPARISONS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge
+}
+FLIPPED_COMPARISONS = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+INTEGER_FIELD_TYPES = ('SmallInteger', 'Integer', 'BigInteger', 'OID')
+FLOAT_FIELD_TYPES = ('Single', 'Double')
+
+
+def is_csv(table):
+    return str(table).lower().endswith('.csv')
+
+
+def is_parquet(table):
+    return str(table).lower().endswith(('.parquet', '.parq'))
+
+
+def list_fields(table):
+    """ Returns the names of the attribute fields in a geodatabase or GeoPackage table """
+    geopackage = split_geopackage_path(table)
+    if geopackage is not None:
+        return GeoPackageStorage(geopackage[0]).fields(geopackage[1])
+
+    import arcpy
+
+    return [field.name for field in arcpy.ListFields(table)
+            if field.type not in SYSTEM_FIELD_TYPES and field.name not in SYSTEM_FIELD_NAMES]
+
+
+def _column(values, field_type):
+    """ NumPy array for the values of one field from a chunk of cursor rows.  Integer fields
+    with nulls become floats, as they do when pandas builds a DataFrame from the rows """
+    if field_type in INTEGER_FIELD_TYPES:
+        if None in values:
+            return np.array(values, dtype=np.float64)
+        return np.array(values, dtype=np.int64)
+    if field_type in FLOAT_FIELD_TYPES:
+        return np.array(values, dtype=np.float64)
+    if field_type == 'Date':
+        return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy()
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def _gdb_arrow_table(table, fields, where_clause):
+    """ The fields of the geodatabase table as an Arrow table, or None where arcpy can not
+    read them that way """
+    import arcpy
+
+    # ArcGIS Pro 3.2 and later can read the table straight into Arrow buffers
+    if hasattr(arcpy.da, 'TableToArrowTable') and not any('@' in field for field in fields):
+        return arcpy.da.TableToArrowTable(table, fields, where_clause)
+    return None
+
+
+def _gdb_chunks(table, fields, where_clause, chunk_size):
+    import arcpy
+
+    arrow_table = _gdb_arrow_table(table, fields, where_clause)
+    if arrow_table is not None:
+        for batch in arrow_table.to_batches(chunk_size):
+            yield batch.to_pandas()
+        return
+
+    field_types = {field.name: field.type for field in arcpy.ListFields(table)}
+
+    with arcpy.da.SearchCursor(table, fields, where_clause) as cursor:
+        while True:
+            rows = list(itertools.islice(cursor, chunk_size))
+            if not rows:
+                return
+            columns = list(zip(*rows))
+            del rows
+            yield pd.DataFrame({field: _column(values, field_types.get(field)) for field, values in zip(fields, columns)})
+
+
+def _constant(node):
+    if isinstance(node, ast.Constant) and node.value is not None:
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return -node.operand.value
+    raise ValueError('not a constant')
+
+
+def _arrow_comparison(left, op, right):
+    import pyarrow.dataset as ds
+
+    if not isinstance(left, ast.Name):
+        if not isinstance(right, ast.Name) or type(op) not in FLIPPED_COMPARISONS:
+            raise ValueError('not a field compared with a constant')
+        left, op, right = right, FLIPPED_COMPARISONS[type(op)](), left
+    field = ds.field(left.id)
+
+    # Nulls never match a comparison in DataFrame.query except !=, as NaN does not
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if not isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+            raise ValueError('in needs a list of constants')
+        matches = field.isin([_constant(value) for value in right.elts])
+        return ~matches if isinstance(op, ast.NotIn) else matches
+    if type(op) not in ARROW_COMPARISONS:
+        raise ValueError('unknown comparison')
+    comparison = ARROW_COMPARISONS[type(op)](field, _constant(right))
+    return comparison | field.is_null() if isinstance(op, ast.NotEq) else comparison & field.is_valid()
+
+
+def _arrow_expression(node):
+    if isinstance(node, ast.BoolOp):
+        expressions = [_arrow_expression(value) for value in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        expression = expressions[0]
+        for other in expressions[1:]:
+            expression = combine(expression, other)
+        return expression
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        combine = operator.and_ if isinstance(node.op, ast.BitAnd) else operator.or_
+        return combine(_arrow_expression(node.left), _arrow_expression(node.right))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+        return ~_arrow_expression(node.operand)
+    if isinstance(node, ast.Compare):
+        operands = [node.left] + node.comparators
+        expression = None
+        for left, op, right in zip(operands[:-1], node.ops, operands[1:]):
+            comparison = _arrow_comparison(left, op, right)
+            expression = comparison if expression is None else expression & comparison
+        return expression
+    raise ValueError('unsupported expression')
+
+
+def arrow_filter(where_clause):
+    """ pyarrow dataset expression for a DataFrame.query expression made of fields compared
+    with constants (==, !=, <, <=, >, >=, in and not in) joined by and, or and not.  Returns
+    None for anything else, which is left to DataFrame.query """
+    try:
+        return _arrow_expression(ast.parse(where_clause.strip(), mode='eval').body)
+    except (SyntaxError, ValueError):
+        return None
+
+
+def _parquet_chunks(table, fields, chunk_size, expression=None):
+    if expression is None:
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(table, memory_map=True).iter_batches(batch_size=chunk_size, columns=fields):
+            yield batch.to_pandas()
+        return
+
+    import pyarrow.dataset as ds
+
+    for batch in ds.dataset(table, format='parquet').to_batches(columns=fields, filter=expression, batch_size=chunk_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _read_parquet(table, fields, where_clause):
+    """ The Parquet file as a DataFrame, with where_clause passed to pyarrow when it can be """
+    expression = None if where_clause is None else arrow_filter(where_clause)
+    if where_clause is None or expression is None:
+        df = read_events_frame(table, fields)
+        return df if where_clause is None else df.query(where_clause).reset_index(drop=True)
+
+    import pyarrow.parquet as pq
+
+    return pq.read_table(table, columns=fields, filters=expression, memory_map=True).to_pandas()
+
+
+def read_chunks(table, fields=None, where_clause=None, chunk_size=CHUNK_ROWS):
+    """ Yields the rows of the table as DataFrames of at most chunk_size rows.  Only fields
+    are read, and only the rows that match where_clause.  where_clause is SQL for
+    geodatabase and GeoPackage tables, and a DataFrame.query expression for DataFrames, CSV
+    and Parquet.  For Parquet it is passed to pyarrow where arrow_filter can convert it """
+    fields = None if fields is None else list(fields)
+
+    if isinstance(table, pd.DataFrame):
+        df = table if fields is None else table[fields]
+        yield df if where_clause is None else df.query(where_clause)
+        return
+
+    table = str(table)
+    geopackage = split_geopackage_path(table)
+    if geopackage is not None:
+        yield from GeoPackageStorage(geopackage[0]).read_chunks(geopackage[1], fields, where_clause, chunk_size)
+        return
+    if is_csv(table):
+        chunks = pd.read_csv(table, usecols=fields, chunksize=chunk_size)
+    elif is_parquet(table):
+        expression = None if where_clause is None else arrow_filter(where_clause)
+        if expression is not None:
+            yield from _parquet_chunks(table, fields, chunk_size, expression)
+            return
+        chunks = _parquet_chunks(table, fields, chunk_size)
+    else:
+        yield from _gdb_chunks(table, list_fields(table) if fields is None else fields, where_clause, chunk_size)
+        return
+
+    for chunk in chunks:
+        yield chunk if where_clause is None else chunk.query(where_clause)
+
+
+@traced()
+def read_table(table, fields=None, where_clause=None, chunk_size=CHUNK_ROWS):
+    """ Returns the table as a DataFrame.  table can be a DataFrame, a path to a CSV or
+    Parquet file, or anything arcpy can open with a SearchCursor.  See read_chunks for
+    fields and where_clause """
+    if isinstance(table, pd.DataFrame) and where_clause is None:
+        return table if fields is None else table[list(fields)]
+    fields = None if fields is None else list(fields)
+
+    # Files, GeoPackage tables and tables arcpy can read into Arrow are read in one piece,
+    # so the rows are not held twice while chunks are joined.  Only cursor reads are chunked
+    if not isinstance(table, pd.DataFrame):
+        table = str(table)
+        if is_parquet(table):
+            return _read_parquet(table, fields, where_clause)
+        if is_csv(table):
+            df = pd.read_csv(table, usecols=fields)
+            return df if where_clause is None else df.query(where_clause).reset_index(drop=True)
+        geopackage = split_geopackage_path(table)
+        if geopackage is not None:
+            return GeoPackageStorage(geopackage[0]).read(geopackage[1], fields, where_clause)
+        arrow_table = _gdb_arrow_table(table, list_fields(table) if fields is None else fields, where_clause)
+        if arrow_table is not None:
+            return arrow_table.to_pandas()
+
+    chunks = list(read_chunks(table, fields, where_clause, chunk_size))
+    if not chunks:
+        return pd.DataFrame(columns=list_fields(table) if fields is None else fields)
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def to_structured_array(df):
+    """ Converts a DataFrame to a NumPy structured array with fixed width text fields """
+    dtypes = []
+    columns = []
+    for name in df.columns:
+        col = df[name]
+        if pd.api.types.is_bool_dtype(col):
+            values = col.to_numpy(dtype=np.int16)
+        elif pd.api.types.is_integer_dtype(col) and not col.hasnans:
+            values = col.to_numpy(dtype=np.int64)
+        elif pd.api.types.is_numeric_dtype(col):
+            values = col.to_numpy(dtype=np.float64, na_value=np.nan)
+        elif pd.api.types.is_datetime64_any_dtype(col):
+            values = col.to_numpy(dtype='datetime64[us]')
+        else:
+            text = col.astype(object).where(col.notna(), '').astype(str)
+            width = max(int(text.str.len().max()) if len(text) else 0, 1)
+            values = text.to_numpy(dtype=f'U{width}')
+        dtypes.append((str(name), values.dtype))
+        columns.append(values)
+
+    array = np.empty(len(df), dtype=dtypes)
+    for (name, _), values in zip(dtypes, columns):
+        array[name] = values
+    return array
+
+
+@traced()
+def write_table(df, out_table):
+    """ Writes the DataFrame to a CSV, Parquet event table, GeoPackage table or geodatabase
+    table, replacing it if it exists """
+    out_table = str(out_table)
+    geopackage = split_geopackage_path(out_table)
+    if geopackage is not None:
+        return GeoPackageStorage(geopackage[0]).write(geopackage[1], df)
+    if is_csv(out_table):
+        df.to_csv(out_table, index=False)
+        return out_table
+    if is_parquet(out_table):
+        return write_events(df, out_table)
+
+    import arcpy
+
+    if arcpy.Exists(out_table):
+        arcpy.Delete_management(out_table)
+    arcpy.da.NumPyArrayToTable(to_structured_array(df), out_table)
+
+    # Text nulls are written as empty strings, so they are set back to null
+    text_nulls = [name for name in df.columns if df[name].dtype == object and df[name].isna().any()]
+    if text_nulls:
+        update_columns(out_table, {str(name): df[name].to_numpy() for name in text_nulls})
+    return out_table
+
+
+def _cursor_values(values):
+    """ Python values for a cursor from an array, with None for NaN and NaT """
+    column = pd.Series(np.asarray(values)).astype(object)
+    return column.where(column.notna(), None).tolist()
+
+
+@traced()
+def update_columns(table, values, oids=None, where_clause=None):
+    """ Sets fields of a geodatabase table in one cursor pass.  values maps each field to a
+    single value for every row or to an array (NumPy, pandas or Arrow).  With oids, the
+    arrays line up with those object ids and other rows are not changed.  Without oids the
+    arrays are in cursor order for the rows that match where_clause.  Returns the number of
+    rows updated """
+    import arcpy
+
+    fields = list(values)
+    columns = []
+    for field in fields:
+        value = values[field]
+        if np.ndim(value) == 0:
+            columns.append((False, value))
+        else:
+            columns.append((True, _cursor_values(value)))
+
+    n_values = max([len(column) for is_array, column in columns if is_array], default=None)
+    position = None if oids is None else {oid: i for i, oid in enumerate(_cursor_values(oids))}
+
+    if oids is None and n_values is not None and where_clause is None:
+        n_rows = int(arcpy.GetCount_management(table)[0])
+        if n_rows != n_values:
+            raise Exception(f'{table} has {n_rows} rows but {n_values} values were given for {fields}')
+
+    updated = 0
+    with arcpy.da.UpdateCursor(table, ['OID@'] + fields, where_clause) as cur:
+        for i, row in enumerate(cur):
+            j = i if position is None else position.get(row[0])
+            if j is None:
+                continue
+            if n_values is not None and j >= n_values:
+                raise Exception(f'{table} has more rows than the {n_values} values given for {fields}')
+            cur.updateRow([row[0]] + [column[j] if is_array else column for is_array, column in columns])
+            updated += 1
+
+    if oids is None and n_values is not None and updated != n_values:
+        raise Exception(f'{table} has {updated} rows but {n_values} values were given for {fields}')
+    return updated
@@ -0,0 +1,293 @@
+""" Timing, row count and memory trace of the steps of a script.
+
+step('Update LRS Fields') prints the step name like the scripts always have, and also
+starts timing it.  The step ends when the next one starts or the script exits.  Steps
+inside a step use the trace_step context manager.  The shared tools' table, overlay and
+dissolve functions are traced as steps of their own with the rows they read and wrote,
+and trace_geoprocessing(arcpy) traces every geoprocessing tool the script runs.
+For each step the trace records the wall time, the CPU time of the process, the peak
+memory (RSS) of the process at the end of the step and the input and output row counts.
+
+When the NEEDS_TRACE_DIR environment variable is set, the trace is written there as
+<script>.trace.json when the script exits.  Two traces (of a script or of a whole
+run_needs.py run) are compared with
+
+    python -m needs_tools.trace compare before.trace.json after.trace.json
+
+psutil is used for memory when it is installed, otherwise the resource module (not on
+Windows).  Without either, memory is not recorded.
+"""
+
+import argparse
+import atexit
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+def peak_rss():
+    """ Peak resident memory of this process in bytes, or None """
+    try:
+        import psutil
+
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', None) or getattr(memory, 'peak_rss', None) or memory.rss
+    except ImportError:
+        pass
+    try:
+        import resource
+
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+
+def count_rows(value):
+    """ Number of rows of a DataFrame, array or list, or None for anything else """
+    if value is None or isinstance(value, (str, bytes)):
+        return None
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+class Tracer:
+    """ Steps of one script run """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.steps = []
+        self._open = []
+        self._phase = None
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def begin(self, name, rows_in=None):
+        """ Starts a step inside the steps that are open and returns its record """
+        record = {
+            'name': '/'.join([step['name'] for step in self._open] + [name]),
+            'depth': len(self._open),
+            'rows_in': rows_in,
+            'rows_out': None,
+            '_wall': time.perf_counter(),
+            '_cpu': time.process_time()
+        }
+        self.steps.append(record)
+        self._open.append(dict(record, name=name))
+        return record
+
+    def end(self, record, rows_out=None):
+        """ Ends a step started with begin """
+        record['wall'] = time.perf_counter() - record.pop('_wall')
+        record['cpu'] = time.process_time() - record.pop('_cpu')
+        record['peak_rss'] = peak_rss()
+        if rows_out is not None:
+            record['rows_out'] = rows_out
+        self._open.pop()
+
+    def phase(self, name, rows_in=None):
+        """ Ends the current top-level step and starts the next one """
+        self.end_phase()
+        self._phase = self.begin(name, rows_in)
+        return self._phase
+
+    def end_phase(self, rows_out=None):
+        if self._phase is not None:
+            while len(self._open) > 1:
+                self._open.pop()
+            self.end(self._phase, rows_out)
+            self._phase = None
+
+    def to_dict(self):
+        self.end_phase()
+        return {
+            'script': self.name,
+            'started': self.started,
+            'wall': time.perf_counter() - self._start_wall,
+            'cpu': time.process_time() - self._start_cpu,
+            'peak_rss': peak_rss(),
+            'steps': [step for step in self.steps if 'wall' in step]
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        return path
+
+
+# Trace of this process
+TRACE = Tracer(os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0])
+
+
+def _save_trace():
+    trace_dir = os.environ.get('NEEDS_TRACE_DIR')
+    if trace_dir and TRACE.steps:
+        name = os.environ.get('NEEDS_TRACE_NAME', TRACE.name)
+        TRACE.save(os.path.join(trace_dir, f'{name}.trace.json'))
+
+
+atexit.register(_save_trace)
+
+
+def step(name, rows_in=None):
+    """ Prints the name of the next step of the script and starts timing it """
+    print(name)
+    return TRACE.phase(name, rows_in)
+
+
+def step_rows(rows_out):
+    """ Records the output row count of the current step """
+    if TRACE._phase is not None:
+        TRACE._phase['rows_out'] = rows_out if isinstance(rows_out, int) else count_rows(rows_out)
+
+
+@contextmanager
+def trace_step(name, rows_in=None):
+    """ Traces the code in a with block as a step.  Set rows_out on the yielded record """
+    record = TRACE.begin(name, rows_in)
+    try:
+        yield record
+    finally:
+        TRACE.end(record, record.get('rows_out'))
+
+
+def traced(name=None):
+    """ Decorator that traces each call of a function as a step, with the rows of the
+    DataFrames it was given and the rows it returned """
+    def decorator(function):
+        step_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            inputs = [count_rows(value) for value in list(args) + list(kwargs.values()) if hasattr(value, 'columns')]
+            for value in list(args) + list(kwargs.values()):
+                if isinstance(value, (list, tuple)):
+                    inputs += [count_rows(item) for item in value if hasattr(item, 'columns')]
+            record = TRACE.begin(step_name, sum(inputs) if inputs else None)
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                TRACE.end(record)
+            record['rows_out'] = count_rows(result) if hasattr(result, 'columns') else None
+            return result
+        return wrapper
+    return decorator
+
+
+# Toolboxes whose tools are traced by trace_geoprocessing
+TRACED_TOOLBOXES = ('analysis', 'management', 'conversion', 'lr', 'ca', 'na')
+
+
+def trace_geoprocessing(arcpy):
+    """ Traces every call of a geoprocessing tool, both as arcpy.analysis.PairwiseClip and
+    as arcpy.PairwiseClip_analysis """
+    def wrap(namespace, name, step_name):
+        tool = getattr(namespace, name, None)
+        if callable(tool) and not hasattr(tool, '__wrapped__'):
+            setattr(namespace, name, traced(step_name)(tool))
+
+    for alias in TRACED_TOOLBOXES:
+        toolbox = getattr(arcpy, alias, None)
+        if toolbox is None:
+            continue
+        for name in dir(toolbox):
+            if name[:1].isupper():
+                wrap(toolbox, name, f'{alias}.{name}')
+    for name in dir(arcpy):
+        tool, _, alias = name.rpartition('_')
+        if tool[:1].isupper() and alias in TRACED_TOOLBOXES:
+            wrap(arcpy, name, f'{alias}.{tool}')
+
+
+def load_steps(path):
+    """ Dictionary of step name to its total wall time, CPU time, peak memory and rows.
+    Steps that run several times are added up.  In a run trace the steps are prefixed by
+    the stage name """
+    with open(path) as f:
+        trace = json.load(f)
+    runs = trace['stages'] if 'stages' in trace else {trace['script']: trace}
+    steps = {}
+    for stage, run in runs.items():
+        if run is None:
+            continue
+        records = [{'name': '(total)', 'wall': run.get('wall'), 'cpu': run.get('cpu'), 'peak_rss': run.get('peak_rss'),
+                    'rows_in': None, 'rows_out': None}] + run.get('steps', [])
+        for record in records:
+            key = f'{stage}/{record["name"]}' if 'stages' in trace else record['name']
+            total = steps.setdefault(key, {'wall': 0.0, 'cpu': 0.0, 'peak_rss': None, 'rows_in': None, 'rows_out': None, 'calls': 0})
+            total['calls'] += 1
+            for field in ('wall', 'cpu'):
+                total[field] += record.get(field) or 0
+            for field in ('peak_rss', 'rows_in', 'rows_out'):
+                if record.get(field) is not None:
+                    total[field] = record[field] if field == 'peak_rss' else (total[field] or 0) + record[field]
+    return steps
+
+
+def compare_traces(before, after, threshold=0.1, min_seconds=1.0):
+    """ Rows of (step, before seconds, after seconds, change, note) for the steps of two
+    traces, slowest regression first.  A step regressed when it takes threshold (10%) and
+    min_seconds longer """
+    old = load_steps(before)
+    new = load_steps(after)
+    rows = []
+    for name in list(old) + [name for name in new if name not in old]:
+        a = old.get(name)
+        b = new.get(name)
+        a_wall = a['wall'] if a else None
+        b_wall = b['wall'] if b else None
+        notes = []
+        if a is None:
+            notes.append('new')
+        elif b is None:
+            notes.append('removed')
+        else:
+            if b_wall - a_wall > max(threshold * a_wall, min_seconds):
+                notes.append('SLOWER')
+            if a['rows_out'] != b['rows_out']:
+                notes.append(f'rows {a["rows_out"]} -> {b["rows_out"]}')
+            if a['peak_rss'] and b['peak_rss'] and b['peak_rss'] > a['peak_rss'] * (1 + threshold):
+                notes.append(f'memory {a["peak_rss"] / 2 ** 20:.0f} -> {b["peak_rss"] / 2 ** 20:.0f} MB')
+        change = (b_wall or 0) - (a_wall or 0)
+        rows.append((name, a_wall, b_wall, change, ', '.join(notes)))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows
+
+
+def _seconds(value):
+    return '-' if value is None else f'{value:.1f}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m needs_tools.trace', description='Shows and compares step traces')
+    commands = parser.add_subparsers(dest='command', required=True)
+    show = commands.add_parser('show', help='list the steps of a trace')
+    show.add_argument('trace')
+    compare = commands.add_parser('compare', help='compare the steps of two traces')
+    compare.add_argument('before')
+    compare.add_argument('after')
+    compare.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as a regression (0.1 = 10%%)')
+    compare.add_argument('--min-seconds', type=float, default=1.0, help='smallest slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        for name, total in load_steps(args.trace).items():
+            memory = '-' if total['peak_rss'] is None else f'{total["peak_rss"] / 2 ** 20:.0f} MB'
+            print(f'{name[:70]:70} {_seconds(total["wall"]):>9}s {_seconds(total["cpu"]):>9}s cpu {memory:>9}  rows {total["rows_in"]} -> {total["rows_out"]}')
+        return
+
+    print(f'{"step":70} {"before":>9} {"after":>9} {"change":>9}')
+    for name, before, after, change, note in compare_traces(args.before, args.after, args.threshold, args.min_seconds):
+        print(f'{name[:70]:70} {_seconds(before):>9} {_seconds(after):>9} {change:+9.1f}  {note}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+""" Runs the need scripts as a dependency graph.  Each stage below lists the datasets it
+reads and writes, the need categories run at the same time in separate processes, and
+create_final_needs_layer.py starts once the stages it reads from have finished.  Each
+stage's output goes to logs\\<stage>.log.
+
+Stages whose input datasets, parameters and code are the same as in an earlier run get
+their outputs from the cache in .needs_cache instead of running again.
+
+The route shapes of the LRS are copied once to memory-mapped arrays in .needs_cache\\lrs
+before the stages start, and the stages open that copy instead of reading the LRS again
+(see needs_tools/lrs_cache.py).
+
+Each run writes a trace of the time, memory and rows of every stage and step to
+logs\\traces.  Two runs are compared with python -m needs_tools.trace compare.
+
+    python run_needs.py                     run every stage
+    python run_needs.py --stages final      run the final layer and the stages it needs
+    python run_needs.py --max-stages 4      run up to 4 stages at once
+    python run_needs.py --no-cache          run every stage even if it is cached
+    python run_needs.py --list              show the stages and their dependencies
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+main_path = os.path.dirname(os.path.abspath(__file__))
+common_datasets_gdb = os.path.join(main_path, r'A1 - Common Datasets\Common_Datasets.gdb')
+
+# Shared tools in the needs_tools folder at the root of the repository
+sys.path.append(main_path)
+from needs_tools.pipeline import Stage, critical_path, dependencies, missing_inputs, run_stages, run_trace, select_stages, stage_order
+from needs_tools.stage_cache import StageCache
+
+
+def data(*parts):
+    return os.path.join(main_path, 'A1 - Common Datasets', *parts)
+
+
+def common(name):
+    return os.path.join(common_datasets_gdb, name)
+
+
+LRS = common('SDE_VDOT_RTE_OVERLAP_LRS_DY')
+MASTER_LRS = common('SDE_VDOT_RTE_MASTER_LRS_DY')
+
+STAGES = [
+    Stage('congestion', os.path.join(main_path, 'Congestion Mitigation', 'congestion_mitigation.py'),
+          inputs=[LRS, MASTER_LRS, common('tbl_coss_2023'), common('tbl_regional_networks'), common('tbl_limited_access'),
+                  common('tbl_tmc_lrs_2023_master'), data('Congestion Mitigation', 'data', 'PECC_2022.csv'),
+                  data('Congestion Mitigation', 'data', '2022_TTI_WA.csv')],
+          outputs=[data('Congestion Mitigation', 'data', 'tbl_congestion_mitigation.parquet')],
+          parameters=['pecc_threshold', 'tti_13_hours_threshold', 'tti_15_hours_threshold'],
+          title='Congestion Mitigation'),
+    Stage('reliability', os.path.join(main_path, 'Improved Reliability (Roadway)', 'identify_reliability_needs.py'),
+          inputs=[LRS, common('tbl_coss_2023'), common('tbl_regional_networks'), common('tbl_tmc_lrs_2023_master'),
+                  data('Improved Reliability (Roadway)', 'data', '2022_LOTTR_WA_updated.csv')],
+          outputs=[data('Improved Reliability (Roadway)', 'data', 'tbl_reliability.parquet')],
+          title='Improved Reliability (Roadway)'),
+    Stage('tdm', os.path.join(main_path, 'Transportation Demand Management (TDM)', 'Identify_TDM_Needs.py'),
+          inputs=[LRS, common('tbl_coss_2023'), common('tbl_regional_networks'), common('tbl_limited_access'), common('tbl_fc23')],
+          outputs=[data('Transportation Demand Management (TDM)', 'data', 'tbl_tdm_needs.parquet')],
+          title='Transportation Demand Management (TDM)'),
+    Stage('capacity', os.path.join(main_path, 'Capacity Preservation', 'Identify_Capacity_Needs.py'),
+          inputs=[LRS, common('tbl_coss_2023'), common('tbl_regional_networks'), data('Capacity Preservation', 'data', 'data.gdb', 'apn')],
+          outputs=[data('Capacity Preservation', 'data', 'tbl_capacity_preservation.parquet')],
+          title='Capacity Preservation'),
+    Stage('bike', os.path.join(main_path, 'Need for Bicycle Access to Activity Centers', 'identify_bicycle_access_needs.py'),
+          inputs=[LRS, common('RegionalNetworks'), common('MPO'), common('VTrans_Activity_Centers'),
+                  common('FixedGuideway_Transit'), common('tbl_fc23'), common('tbl_limited_access')],
+          outputs=[data('Need for Bicycle Access to Activity Centers', 'data', 'tbl_bicycle_access.parquet')],
+          parameters=['bike_speed', 'bike_commute_time', 'bike_needs_radius', 'bike_shed_method'],
+          title='Bike Access to Activity Centers'),
+    Stage('ped', os.path.join(main_path, 'Need for Pedestrian Access to Activity Centers', 'identify_pedestrian_access_needs.py'),
+          inputs=[LRS, common('RegionalNetworks'), common('MPO'), common('VTrans_Activity_Centers'),
+                  common('FixedGuideway_Transit'), common('tbl_fc23'), common('tbl_limited_access')],
+          outputs=[data('Need for Pedestrian Access to Activity Centers', 'data', 'tbl_ped_access.parquet')],
+          parameters=['walk_speed', 'walk_commute_time', 'walk_needs_radius', 'walk_shed_method'],
+          title='Walk Access to Activity Centers'),
+    Stage('transit', os.path.join(main_path, 'Need for Transit Access to Activity Centers', 'Transit_Access.py'),
+          inputs=[LRS, common('RegionalNetworks'), common('tbl_fc23'), common('tbl_rn'),
+                  data('Need for Transit Access to Activity Centers', 'data', 'ActivityCenterShp', 'Activity_Center 2023-09-14.shp'),
+                  data('Need for Transit Access to Activity Centers', 'data', 'output.gdb', 'Transit_Commute_Time')],
+          outputs=[data('Need for Transit Access to Activity Centers', 'data', 'tbl_transit_access.parquet')],
+          title='Transit Access to Activity Centers'),
+    Stage('eea', os.path.join(main_path, 'Need for Transit Access for Equity Emphasis Areas', 'identify_transit_access_for_eea.py'),
+          inputs=[LRS, common('tbl_fc23'), common('tbl_regional_networks'),
+                  data('Need for Transit Access for Equity Emphasis Areas', 'data', 'intermediate.gdb', 'Block_Group'),
+                  data('Need for Transit Access for Equity Emphasis Areas', 'data', 'transit_viability_underserved.gdb', 'transit_viability_underserved')],
+          outputs=[data('Need for Transit Access for Equity Emphasis Areas', 'data', 'tbl_transit_access_eaa.parquet')],
+          title='Transit Access for Equity Emphasis Areas'),
+    Stage('ped_safety', os.path.join(main_path, 'Pedestrian Safety', 'identify_pedestrian_safety.py'),
+          inputs=[LRS, data('Pedestrian Safety', 'data', 'PSAP4.gdb', 'psap4')],
+          outputs=[data('Pedestrian Safety', 'data', 'tbl_ped_safety.parquet')],
+          title='Pedestrian Safety'),
+]
+
+# Roadway safety needs were manually fixed and are not run again.  Rail reliability, IEDA
+# and UDA needs come from tables made outside of these scripts
+STAGES.append(Stage(
+    'final', os.path.join(main_path, 'Create Final Needs Layer', 'create_final_needs_layer.py'),
+    inputs=[output for stage in STAGES for output in stage.outputs] + [
+        LRS, common('tbl_coss_2023'), common('tbl_fc23'),
+        data('Improved Reliability (Intercity and Passenger Rail)', 'data', 'output.gdb', 'tbl_rail_reliability'),
+        data('Roadway Safety', 'data', 'output.gdb', 'tbl_safety_intersections'),
+        data('Roadway Safety', 'data', 'output.gdb', 'tbl_safety_segment'),
+        data('Access to Industrial and Economic Development Areas (IEDAs)', 'data', 'output.gdb', 'tbl_vedp'),
+        data('Urban Development Areas (UDAs) Needs', 'data', 'output.gdb', 'tbl_uda_needs')],
+    outputs=[os.path.join(main_path, '2023_VTrans_MidTerm_Needs.parquet')],
+    title='Create Final Needs Layer'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the need scripts as a dependency graph')
+    parser.add_argument('--stages', nargs='+', help='stages to run, with the stages they depend on (all by default)')
+    parser.add_argument('--max-stages', type=int, default=int(os.environ.get('NEEDS_MAX_STAGES', 2)),
+                        help='stages run at once (NEEDS_MAX_STAGES, 2 by default)')
+    parser.add_argument('--python', default=sys.executable, help='Python used to run the stage scripts')
+    parser.add_argument('--log-dir', default=os.path.join(main_path, 'logs'), help='folder for the stage logs')
+    parser.add_argument('--cache-dir', default=os.path.join(main_path, '.needs_cache'), help='folder of cached stage outputs')
+    parser.add_argument('--no-cache', action='store_true', help='run every stage without using the cache')
+    parser.add_argument('--list', action='store_true', help='list the stages and their dependencies and exit')
+    args = parser.parse_args()
+
+    stages = STAGES if args.stages is None else select_stages(STAGES, args.stages)
+    if args.list:
+        depends_on = dependencies(stages)
+        for name in stage_order(stages):
+            print(f'{name:12} after {", ".join(depends_on[name]) or "-"}')
+        return
+
+    missing = missing_inputs(stages)
+    if missing:
+        for name, path in missing:
+            print(f'  {name}: missing {path}')
+        raise Exception(f'{len(missing)} stage inputs are missing')
+
+    print('NEEDS SCRIPTS')
+    print('-------------')
+    start = time.perf_counter()
+
+    # Copied with the Python that runs the stages, which has arcpy
+    lrs_inputs = [lrs for lrs in (LRS, MASTER_LRS) if any(lrs in stage.inputs for stage in stages)]
+    if lrs_inputs:
+        subprocess.run([args.python, '-m', 'needs_tools.lrs_cache'] + lrs_inputs, cwd=main_path, check=True)
+
+    cache = None if args.no_cache else StageCache(args.cache_dir)
+    results = run_stages(stages, args.max_stages, args.log_dir, args.python, cache=cache)
+    elapsed = time.perf_counter() - start
+
+    trace_path = run_trace(results, args.log_dir, os.path.join(args.log_dir, 'traces', f'run-{time.strftime("%Y%m%d-%H%M%S")}.trace.json'))
+
+    durations = {name: seconds for name, (status, seconds, log_path) in results.items()}
+    longest, path = critical_path(stages, durations)
+    print()
+    print(f'Total time: {elapsed / 60:.1f} minutes ({sum(durations.values()) / 60:.1f} minutes of stage time)')
+    print(f'Longest chain: {" -> ".join(path)} ({longest / 60:.1f} minutes)')
+    print(f'Trace: {trace_path}')
+
+    failed = [name for name, (status, seconds, log_path) in results.items() if status != 'done']
+    if failed:
+        raise Exception(f'Stages did not finish: {failed}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from needs_tools.interval_index import RouteIntervalIndex
+
+EVENTS = pd.DataFrame({
+    'RTE_NM': ['R2', 'R1', 'R1', 'R3', None],
+    'BEGIN_MSR': [0.0, 5.0, 0.0, 1.0, 2.0],
+    'END_MSR': [3.0, 9.0, 6.0, 2.0, 4.0],
+    'NEED': ['A', None, 'C', 'D', 'E']
+})
+
+
+def test_saved_index_loads_the_same_arrays(tmp_path):
+    index = RouteIntervalIndex(EVENTS)
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = RouteIntervalIndex.load(path)
+
+    for name in ('rows', 'begin_key', 'end_key', 'max_end_key'):
+        assert np.array_equal(getattr(loaded, name), getattr(index, name))
+    assert (loaded.offset, loaded.span) == (index.offset, index.span)
+    assert list(loaded.routes.names) == list(index.routes.names)
+    assert loaded.table['NEED'].isna().tolist() == [False, True, False, False, False]
+    assert loaded.table['RTE_NM'].isna().tolist() == [False, False, False, False, True]
+
+    queries = pd.DataFrame({'RTE_NM': ['R1', 'R1', 'R2', 'R9'], 'BEGIN_MSR': [5.5, 6.0, 1.0, 1.0], 'END_MSR': [5.5, 7.0, 2.0, 2.0]})
+    expected = index.batch(queries['RTE_NM'], queries['BEGIN_MSR'], queries['END_MSR'])
+    found = loaded.batch(queries['RTE_NM'], queries['BEGIN_MSR'], queries['END_MSR'])
+    assert found['QUERY_ID'].tolist() == expected['QUERY_ID'].tolist()
+    assert found['NEED'].isna().tolist() == expected['NEED'].isna().tolist() == [False, True, True, False]
+    assert found['NEED'].dropna().tolist() == expected['NEED'].dropna().tolist()
+    assert loaded.range('R1', 5.5, 5.5)['NEED'].isna().tolist() == [False, True]
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from needs_tools.lrs_cache import line_vertices
+from needs_tools.network_measures import network_measure_arrays
+
+shapely = pytest.importorskip('shapely')
+pytest.importorskip('scipy')
+
+
+def straight_road(length=100):
+    """ One route from x = 0 to x = length, with M equal to x """
+    coords, offsets, line = line_vertices(np.array([shapely.from_wkt(f'LINESTRING M (0 0 0, {length} 0 {length})')], dtype=object))
+    return coords, offsets
+
+
+@pytest.mark.parametrize('source, distance, expected', [
+    (40, 50, [0, 90]),
+    (50, 30, [20, 80]),
+    (0, 30, [0, 30]),
+])
+def test_source_in_the_middle_of_an_edge(source, distance, expected):
+    coords, offsets = straight_road()
+    part, begin, end = network_measure_arrays(coords, offsets, (np.array([source], dtype=float), np.array([0.0])), distance)
+    assert part.tolist() == [0]
+    assert np.allclose([begin[0], end[0]], expected)
+
+
+def test_source_off_the_road():
+    # 30 of the 50 are used to reach the road, which leaves 20 either way along it
+    coords, offsets = straight_road()
+    part, begin, end = network_measure_arrays(coords, offsets, (np.array([50.0]), np.array([30.0])), 50)
+    assert np.allclose([begin[0], end[0]], [30, 70])
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from needs_tools.lrs_cache import line_vertices
+from needs_tools.polygon_measures import MAX_TILE_VERTICES, polygon_measure_arrays, tile_polygons
+
+shapely = pytest.importorskip('shapely')
+
+
+def annulus():
+    """ Ring 90 to 100 from the origin, with more vertices than MAX_TILE_VERTICES """
+    point = shapely.Point(0, 0)
+    return point.buffer(100, quad_segs=2000).difference(point.buffer(90, quad_segs=2000))
+
+
+def test_tiles_of_a_large_polygon_are_not_empty():
+    polygon = annulus()
+    assert shapely.get_num_coordinates(polygon) > MAX_TILE_VERTICES
+    tiles = tile_polygons([polygon])
+    assert len(tiles) > 1
+    assert not shapely.is_empty(tiles).any()
+    assert np.isclose(shapely.area(tiles).sum(), polygon.area)
+
+
+def test_line_across_a_large_polygon():
+    coords, offsets, line = line_vertices(np.array([shapely.from_wkt('LINESTRING M (-200 0 0, 200 0 400)')], dtype=object))
+    part, begin, end = polygon_measure_arrays(coords, offsets, [annulus()])
+    assert part.tolist() == [0, 0]
+    assert np.allclose(begin, [100, 290], atol=1e-3)
+    assert np.allclose(end, [110, 300], atol=1e-3)
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from needs_tools.tables import arrow_filter, read_chunks, read_table
+
+pytest.importorskip('pyarrow')
+
+EVENTS = pd.DataFrame({
+    'RTE_NM': ['R1', 'R1', 'R2', None, 'R3'],
+    'BEGIN_MSR': [0.0, 1.0, 2.0, 3.0, np.nan],
+    'END_MSR': [1.0, 2.0, 3.0, 4.0, 5.0]
+})
+
+WHERE_CLAUSES = [
+    "RTE_NM == 'R1'",
+    "RTE_NM != 'R1'",
+    "BEGIN_MSR >= 1 and END_MSR < 4",
+    "1 <= BEGIN_MSR < 3",
+    "RTE_NM in ['R1', 'R3'] or BEGIN_MSR > 2",
+    "RTE_NM not in ('R1',)",
+    "not (BEGIN_MSR > 1) & (END_MSR > 0)",
+    "BEGIN_MSR > -1"
+]
+
+
+@pytest.fixture
+def parquet_table(tmp_path):
+    path = str(tmp_path / 'events.parquet')
+    EVENTS.to_parquet(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize('where_clause', WHERE_CLAUSES)
+def test_parquet_filters_match_query(parquet_table, where_clause):
+    assert arrow_filter(where_clause) is not None
+    expected = EVENTS.query(where_clause).reset_index(drop=True)
+    pd.testing.assert_frame_equal(read_table(parquet_table, where_clause=where_clause), expected)
+    chunks = list(read_chunks(parquet_table, where_clause=where_clause, chunk_size=2))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True) if chunks else EVENTS.iloc[:0], expected)
+
+
+def test_other_expressions_are_left_to_query(parquet_table):
+    where_clause = 'END_MSR - BEGIN_MSR > 0.5'
+    assert arrow_filter(where_clause) is None
+    pd.testing.assert_frame_equal(read_table(parquet_table, where_clause=where_clause), EVENTS.query(where_clause).reset_index(drop=True))
+
+
+def test_no_matching_rows_keeps_columns(parquet_table):
+    df = read_table(parquet_table, ['RTE_NM', 'END_MSR'], "RTE_NM == 'R9'")
+    assert list(df.columns) == ['RTE_NM', 'END_MSR'] and len(df) == 0